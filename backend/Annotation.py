@@ -6,6 +6,7 @@
 """
 
 class Annotation():
+    __slots__ = ("start_count", "sample_count", "freq_lower_edge", "freq_upper_edge", "label", "comment")
 
     def __init__(self, start_count, sample_count, freq_lower_edge, freq_upper_edge, label, comment):
         """
@@ -22,4 +23,8 @@ class Annotation():
         self.freq_lower_edge = freq_lower_edge
         self.freq_upper_edge = freq_upper_edge
         self.label = label
-        self.comment = comment
\ No newline at end of file
+        self.comment = comment
+
+    def to_dict(self):
+        """ Plain dict of the annotation's fields """
+        return {name: getattr(self, name) for name in self.__slots__}
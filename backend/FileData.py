@@ -6,33 +6,49 @@ CS-410: FileData class that stores file level information about uploaded data fi
 """
 
 import SigMF
+from datetime import datetime, timezone
+
+# Bump whenever the shape of a file record changes so migrations.py can backfill old records
+SCHEMA_VERSION = 4
 
 class FileData:
-    def __init__(self, original_name, sigmf_metadata, pxx_csv_file_id, plot_ids, freqs, bins, fft=1024, airview_annotations=None):
+    def __init__(self, original_name, sigmf_metadata, pxx_csv_file_id, plot_ids, freqs, bins, fft=1024, airview_detections=None):
         """
         Initializes FileData object.
         :param original_name: Original filename without extension
         :param sigmf_metadata: SigMF metadata object
         :param pxx_csv_file_id: File ID of the power spectral density (Pxx) CSV file
-        :param plot_ids: Dictionary containing file IDs for various plots
+        :param plot_ids: Dictionary containing file IDs for various plots (only the spectrogram is required)
         :param bins: Array of time bins for the spectrogram
         :param freqs: Array of frequency bins for the spectrogram
         :param fft: FFT size for spectrogram processing (default: 1024)
-        :param airview_annotations: Optional list of airview annotations from AirVIEW
+        :param airview_detections: Optional detection table from AirVIEW (see detections.py)
         """
         self.filename = original_name
         self.raw_data_file_id = str(plot_ids["raw_data"]) if "raw_data" in plot_ids else None
         self.csv_file_id = str(pxx_csv_file_id)
+        # Plots of lazy uploads are rendered on first request and stored as "None" until then
         self.spectrogram_file_id = str(plot_ids["spectrogram"])
-        self.iq_plot_file_id = str(plot_ids["iq_plot"])
-        self.time_domain_file_id = str(plot_ids["time_domain"])
-        self.freq_domain_file_id = str(plot_ids["freq_domain"])
-        self.metadata = sigmf_metadata.__dict__
+        self.iq_plot_file_id = str(plot_ids.get("iq_plot"))
+        self.time_domain_file_id = str(plot_ids.get("time_domain"))
+        self.freq_domain_file_id = str(plot_ids.get("freq_domain"))
+        self.metadata = sigmf_metadata.metadata()
+        self.calculated_statistics = sigmf_metadata.calculated_statistics()
         self.max_time = bins[-1]
         self.min_freq = freqs[0]
         self.max_freq = freqs[-1]
 
         # Additional metadata
-        self.sigmf = sigmf_metadata.__dict__
+        self.sigmf = sigmf_metadata.to_dict()
         self.fft = fft
-        self.airview_annotations = airview_annotations if airview_annotations is not None else []
+        # Stored as .npy bytes rather than an array of SigMF annotation documents
+        detection_count = len(airview_detections) if airview_detections is not None else 0
+        if detection_count:
+            from detections import serialize
+            self.airview_detections = serialize(airview_detections)
+        else:
+            self.airview_detections = None
+        self.detection_count = detection_count
+        self.has_detections = detection_count > 0
+        self.uploaded_at = datetime.now(timezone.utc)
+        self.schema_version = SCHEMA_VERSION
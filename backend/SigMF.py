@@ -6,7 +6,10 @@
 """
 
 import json
-import Annotation
+from Annotation import Annotation
+
+# FFT size matplotlib's specgram uses when building the PSD shown in the viewer
+PSD_FFT_SIZE = 256
 
 class SigMF():
     
@@ -32,12 +35,14 @@ class SigMF():
         self.annotations = []
 
         for annotation in data['annotations']:
-            sample_start = annotation.get('sample_start', 0)
-            sample_count = annotation.get('sample_count', 0)
-            freq_lower = annotation.get('freq_lower_edge', 0)
-            freq_upper = annotation.get('freq_upper_edge', 0)
-            label = annotation.get('label')
-            comment = annotation.get('comment')
+            # The SigMF spec namespaces these keys with "core:"; older files in this project omit it
+            field = lambda name, default=None: annotation.get(f'core:{name}', annotation.get(name, default))
+            sample_start = field('sample_start', 0)
+            sample_count = field('sample_count', 0)
+            freq_lower = field('freq_lower_edge', 0)
+            freq_upper = field('freq_upper_edge', 0)
+            label = field('label')
+            comment = field('comment')
             self.annotations.append(Annotation(sample_start, sample_count, freq_lower, freq_upper, label, comment))
 
         # Calculate statistics
@@ -56,15 +61,44 @@ class SigMF():
     def _calculate_min_frequency(self):
         """ Compute min frequency from annotations """
         if self.annotations:
-            return min(ann.freq_lower for ann in self.annotations if ann.freq_lower is not None)
+            return min(ann.freq_lower_edge for ann in self.annotations if ann.freq_lower_edge is not None)
         return self.center_frequency - (self.sample_rate / 2) if self.center_frequency and self.sample_rate else 0
 
     def _calculate_max_frequency(self):
         """ Compute max frequency from annotations """
         if self.annotations:
-            return max(ann.freq_upper for ann in self.annotations if ann.freq_upper is not None)
+            return max(ann.freq_upper_edge for ann in self.annotations if ann.freq_upper_edge is not None)
         return self.center_frequency + (self.sample_rate / 2) if self.center_frequency and self.sample_rate else 0
 
     def _calculate_signal_power(self):
         """ Compute an estimated signal power (dummy implementation, replace if needed) """
         return 10 * (self.sample_rate / 1e6)  # Example placeholder logic
+
+    def metadata(self):
+        """ Normalized metadata fields shown in the statistics panel """
+        return {
+            "datatype": self.datatype,
+            "sample_rate": self.sample_rate,
+            "author": self.author,
+            "hardware": self.hardware,
+            "offset": self.offset,
+            "recorder": self.recorder,
+            "datetime": self.datetime,
+            "center_frequency": self.center_frequency,
+            "sample_start": self.sample_start,
+        }
+
+    def calculated_statistics(self, fft_size=PSD_FFT_SIZE):
+        """ Receiver properties derived from the sample rate and PSD FFT size """
+        return {
+            "fft_size": fft_size,
+            "sampling_frequency": self.sample_rate,
+            "frequency_resolution": self.sample_rate / fft_size,
+            "row_duration": fft_size / self.sample_rate if self.sample_rate else 0,
+        }
+
+    def to_dict(self):
+        """ BSON-safe copy of every parsed attribute, annotations included """
+        data = dict(self.__dict__)
+        data["annotations"] = [ann.to_dict() for ann in self.annotations]
+        return data
@@ -5,19 +5,38 @@ import json
 from pydantic.dataclasses import dataclass
 import math
 import copy
+import logging
+import time
+from instrumentation import record, span
+import detections
 
-def findTransmitters(input, scale, beta, jaccard_threshold, max_gap_rows, fft_size):
+logger = logging.getLogger(__name__)
+
+# Samples transformed at a time by computeSpectrogram, bounding the FFT's temporaries
+SPECTROGRAM_BLOCK_SAMPLES = 1 << 20
+
+def coarseScales(input, scale):
+    '''
+    The two wavelet scales findAvgAdjDiffCoarse is run at for a given AirVIEW scale.
+    '''
+    return math.log2(input.shape[1]) - scale, math.log2(input.shape[1]) - (scale + 1)
+
+def findTransmitters(input, scale, beta, jaccard_threshold, max_gap_rows, fft_size, coarse=None):
     '''
     Gets parameters, calculates threshold, and runs algorithm.
 
+    coarse: optional precomputed findAvgAdjDiffCoarse result (params, regions)
+    for this input and scale, e.g. from an AirviewCache
+
     return:
     list[Transmitter]: detected transmitters
     '''
     # params[0] = mean of the pairwise difference of multiscale products
     # params[1] = std of the pairwise differences of multiscale products
     # beta is a threshold-scaling parameter that determines how many standard deviations from the mean should pairwise differences be in order to be ranked as a outlier local maxima
-    params, regions = findAvgAdjDiffCoarse(input, math.log2(input.shape[1]) - scale,
-				math.log2(input.shape[1]) - (scale + 1))
+    if coarse is None:
+        coarse = findAvgAdjDiffCoarse(input, *coarseScales(input, scale))
+    params, regions = coarse
     # num_rows = len(regions)
     # num_columns = len(regions[0])  # Assuming all inner lists have the same length
     # num_items = len(regions[0][0])
@@ -27,6 +46,26 @@ def findTransmitters(input, scale, beta, jaccard_threshold, max_gap_rows, fft_si
     
     detected = findTransmittersMultiScale(input, regions, jaccard_threshold, scale, threshold, max_gap_rows)
     return detected # output annotations in main run function
+
+
+def computeSpectrogram(samples, fft_size, row_average=1):
+    '''
+    Turns samples into a 2d power matrix (dB), one FFT of fft_size samples per row.
+    With row_average > 1 each row is the mean power of that many consecutive FFTs,
+    which shrinks the matrix of captures too large to analyze at full time resolution.
+    The FFTs are taken a block of rows at a time so only the output is full size.
+    '''
+    num_rows = int(np.floor(len(samples)/(fft_size*row_average)))
+    rows = np.asarray(samples[:num_rows*fft_size*row_average]).reshape(num_rows, row_average, fft_size)
+    block_rows = max(1, SPECTROGRAM_BLOCK_SAMPLES // (fft_size*row_average))
+    spectrogram = None
+    for r0 in range(0, num_rows, block_rows):
+        power = np.abs(np.fft.fftshift(np.fft.fft(rows[r0:r0+block_rows], axis=2), axes=2))**2
+        power = power.mean(axis=1) if row_average > 1 else power[:, 0]
+        if spectrogram is None:
+            spectrogram = np.empty((num_rows, fft_size), dtype=power.dtype)
+        spectrogram[r0:r0+len(power)] = 10*np.log10(power)
+    return spectrogram if spectrogram is not None else np.empty((0, fft_size))
     
 
 @dataclass
@@ -38,63 +77,89 @@ class Plugin:
     run_parameter_optimization: str = 'no'
     beta: float = 2.0
     scale: int = 9
-
-    def run(self, samples):
-        print(samples[0:10])
-        print(self.sample_rate)
-        print(self.center_freq)
-        print(self.beta)
-        print(self.scale)
+    # FFTs averaged into each spectrogram row (see computeSpectrogram)
+    row_average: int = 1
+
+    def run(self, samples, cache=None, data_hash=None):
+        '''
+        Runs AirVIEW on the samples.
+
+        cache: optional AirviewCache; together with data_hash (a digest of the
+        samples) it lets repeated runs on the same data skip the spectrogram,
+        the coarse regions and, for identical parameters, the whole detection
+        '''
+        logger.debug("AirVIEW on %d samples, sample rate %s, center frequency %s, beta %s, scale %s, first samples %s",
+                     len(samples), self.sample_rate, self.center_freq, self.beta, self.scale, samples[0:10])
+        use_cache = cache is not None and data_hash is not None
+        if use_cache and self.row_average > 1:
+            # Averaged spectrograms and everything derived from them are cached apart from full resolution ones
+            data_hash = f"{data_hash}:avg{self.row_average}"
 
         # Your Plugin (and optionally, classification) code here
 
-        # turn samples into 2d matrix from 1d array
         fft_size = 1024
-        num_rows = int(np.floor(len(samples)/fft_size))
-        spectrogram = np.zeros((num_rows, fft_size))
-        for i in range(num_rows):
-            spectrogram[i,:] = 10*np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples[i*fft_size:(i+1)*fft_size])))**2)
-
-        print(spectrogram.shape)
-        time_for_fft = fft_size * (1/self.sample_rate) *1000 # time it takes to traverse in ms
+        # samples covered by one spectrogram row
+        row_samples = fft_size * self.row_average
+        num_rows = int(np.floor(len(samples)/row_samples))
+        time_for_fft = row_samples * (1/self.sample_rate) *1000 # time it takes to traverse in ms
         max_gap_rows = math.ceil(0.0/time_for_fft)
         jaccard_threshold = 0.5 # if they are at least halfway overlapping, considered aligned
+        optimize = self.run_parameter_optimization[0].lower() == 'y'
+
+        if use_cache:
+            if optimize:
+                airview_beta_scale = cache.get_optimal_params(data_hash, fft_size)
+                if airview_beta_scale is not None:
+                    return {"data_output" : [], "airview_beta_scale" : airview_beta_scale}
+            else:
+                table = cache.get_detections(data_hash, fft_size, self.scale, self.beta, jaccard_threshold, max_gap_rows)
+                if table is not None:
+                    # The same samples may come with other metadata, so only the boxes are taken from the cache
+                    detections.set_bounds(table, fft_size, self.sample_rate, self.center_freq, row_samples)
+                    return {"data_output" : [], "airview_detections" : table,
+                            "airview_annotations" : detections.to_sigmf(table)}
 
-        if self.run_parameter_optimization[0].lower() == 'y':
-            print('finding optimal paramters')
-            airview_beta_scale = findOptimalParams(spectrogram)
-            print(f"Optimal Beta and Scale: beta: {airview_beta_scale[0]}, scale: {airview_beta_scale[1]}")
+        # turn samples into 2d matrix from 1d array
+        spectrogram = cache.get_spectrogram(data_hash, fft_size) if use_cache else None
+        if spectrogram is None:
+            with span('airview.stft'):
+                spectrogram = computeSpectrogram(samples, fft_size, self.row_average)
+            if use_cache:
+                cache.put_spectrogram(data_hash, fft_size, spectrogram)
+
+        def coarse_for_scale(scale):
+            # findAvgAdjDiffCoarse depends only on the data and the scale, so it is shared across betas
+            coarse = cache.get_coarse(data_hash, fft_size, scale) if use_cache else None
+            if coarse is None:
+                with span('airview.regions'):
+                    coarse = findAvgAdjDiffCoarse(spectrogram, *coarseScales(spectrogram, scale))
+                if use_cache:
+                    cache.put_coarse(data_hash, fft_size, scale, coarse)
+            return coarse
+
+        logger.debug("Spectrogram shape %s", spectrogram.shape)
+
+        if optimize:
+            with span('airview.optimize'):
+                airview_beta_scale = findOptimalParams(spectrogram, coarse_for_scale)
+            logger.info("Optimal beta %s and scale %s", airview_beta_scale[0], airview_beta_scale[1])
+            if use_cache:
+                cache.put_optimal_params(data_hash, fft_size, airview_beta_scale)
         else:
-            detected = findTransmitters(spectrogram, self.scale, self.beta, jaccard_threshold, max_gap_rows, fft_size)
-            print("FOUND")
-            # When making a detector, for the return, make a list, then for each detected emission, add one of these dicts to the list:
-            annotations = []
-            for transmitter in detected:
-                # print('*** detected: ', transmitter)
-
-                start_row = transmitter.start_row
-                start_col = transmitter.start_col
-                end_row = transmitter.end_row
-                end_col = transmitter.end_col
-
-                # print('*** what java would output:')
-                print(f"{transmitter.start_col},{num_rows - transmitter.end_row},{transmitter.end_col - transmitter.start_col},{transmitter.end_row-transmitter.start_row}\n")
-
-                x = start_col
-                y = start_row
-                width = end_col - start_col
-                height = end_row - start_row
-                
-                if height > 0:
-                    an = {}
-                    an['core:freq_lower_edge'] = int(x / fft_size * self.sample_rate - (self.sample_rate / 2) + self.center_freq) # Hz
-                    an['core:freq_upper_edge'] = int((x + width) / fft_size * self.sample_rate - (self.sample_rate / 2) + self.center_freq) # Hz
-                    an['core:sample_start'] = int(y * fft_size)
-                    an['core:sample_count'] = int(height * fft_size)
-                    an["core:label"] = "Transmitter"# NOTE should we should set this to transmitters, since that is what AirView looks for?
-                    annotations.append(an)
-        
-        if self.run_parameter_optimization[0].lower() == 'y':
+            detected = findTransmitters(spectrogram, self.scale, self.beta, jaccard_threshold, max_gap_rows, fft_size,
+                                        coarse=coarse_for_scale(self.scale))
+            logger.info("AirVIEW found %d transmitter(s)", len(detected))
+            # What the Java implementation would output
+            if logger.isEnabledFor(logging.DEBUG):
+                for transmitter in detected:
+                    logger.debug("%s,%s,%s,%s", transmitter.start_col, num_rows - transmitter.end_row,
+                                 transmitter.end_col - transmitter.start_col, transmitter.end_row - transmitter.start_row)
+
+            table = detections.from_transmitters(detected, spectrogram, self.sample_rate, self.center_freq, row_samples)
+            if use_cache:
+                cache.put_detections(data_hash, fft_size, self.scale, self.beta, jaccard_threshold, max_gap_rows, table)
+
+        if optimize:
             return {
                 "data_output" : [],
                 "airview_beta_scale" : airview_beta_scale
@@ -102,10 +167,30 @@ class Plugin:
         else:
             return {
                 "data_output" : [],
-                "airview_annotations" : annotations
+                "airview_detections" : table,
+                "airview_annotations" : detections.to_sigmf(table)
             }
     
 
+def detect(samples, sample_rate, center_freq, auto_params=False, beta=Plugin.beta, scale=Plugin.scale, row_average=1,
+           cache=None, data_hash=None):
+    '''
+    Runs AirVIEW detection on a capture. With auto_params the optimal beta and scale
+    are found first and detection is run with them; the cache then shares the
+    spectrogram and coarse regions between the two runs.
+
+    return:
+    (detection table (see detections.py), beta used, scale used)
+    '''
+    if auto_params:
+        plugin = Plugin(sample_rate=sample_rate, center_freq=center_freq, run_parameter_optimization='y',
+                        row_average=row_average)
+        beta, scale = plugin.run(samples, cache=cache, data_hash=data_hash)["airview_beta_scale"]
+    plugin = Plugin(sample_rate=sample_rate, center_freq=center_freq, run_parameter_optimization='n',
+                    beta=beta, scale=scale, row_average=row_average)
+    return plugin.run(samples, cache=cache, data_hash=data_hash)["airview_detections"], beta, scale
+
+
 # MULTISCALE FUNCTIONS
 
 def adjacentOrOverlapping(edges, start, end):
@@ -244,14 +329,21 @@ def findTransmittersMultiScale(input, regions, jaccard_threshold, scale, alpha,
     # integer : list[edge[]]
     changes = {}
 
+    # Per-row thresholding and tracking times, summed and recorded once per run
+    threshold_seconds = tracking_seconds = 0.0
     for r, row in enumerate(input):
-        curr_edges = None
+        started = time.perf_counter()
         curr_edges = coarseDetection(row, regions[r], alpha)
+        detected = time.perf_counter()
 
         # add all of the changes to the map
         changes[r] = curr_edges
         updateTransmitters(changes, transmitters, r, jaccard_threshold, max_gap_rows)
+        threshold_seconds += detected - started
+        tracking_seconds += time.perf_counter() - detected
 
+    record('airview.threshold', threshold_seconds)
+    record('airview.tracking', tracking_seconds)
     return transmitters
 
 
@@ -560,6 +652,8 @@ def updateTransmitters(changes, t, r, jaccard_threshold, max_gap):
 
 
 class Transmitter:
+    __slots__ = ("start_row", "end_row", "start_col", "end_col", "mean", "sd", "found", "active", "priors")
+
     def __init__(self, start_row, end_row, start_col, end_col, mean=None, sd=None, found=False, active=False, priors=None):
         self.start_row = start_row
         self.end_row = end_row
@@ -634,16 +728,14 @@ def getTxsEdges(edges, row):
     return txs
 
 
-def learnBeta(scale, input, bs, rows):
-    # get scale 1
-    s1 = math.log2(input.shape[1]) - scale
-    # get scale 2
-    s2 = math.log2(input.shape[1]) - (scale + 1)
-
+def learnBeta(scale, input, bs, rows, coarse=None):
     # create a 2d array to hold alignment data
     # [0] contains alignment, [1] contains relevant beta
     tpsms = [[0.0, 0.0] for _ in range(len(bs))]
-    loc_params, regions = findAvgAdjDiffCoarse(input, s1, s2)
+    if coarse is None:
+        # get scale 1 and scale 2
+        coarse = findAvgAdjDiffCoarse(input, *coarseScales(input, scale))
+    loc_params, regions = coarse
 
     for i in range(len(bs)):
         # collect beta from beta array
@@ -701,9 +793,12 @@ def learnBeta(scale, input, bs, rows):
     return tpsms
 
 
-def findOptimalParams(spectogram):
+def findOptimalParams(spectogram, coarse_for_scale=None):
     '''
     Finds optimal beta and scale to run airview with.
+
+    coarse_for_scale: optional callable returning the findAvgAdjDiffCoarse
+    result for a scale, so cached regions can be reused
     '''
     minS=4 # min scale
     maxS=9 # max scale
@@ -728,7 +823,8 @@ def findOptimalParams(spectogram):
     # holds result of best alignment and scale
     res = [0.0, 0.0]
     for i in range(len(scales)):
-        tpsm = learnBeta(scales[i], input, bs, input.shape[0])
+        coarse = coarse_for_scale(scales[i]) if coarse_for_scale is not None else None
+        tpsm = learnBeta(scales[i], input, bs, input.shape[0], coarse)
 
         for j in range(len(tpsm)):
             if tpsm[j][0] > bestSim:
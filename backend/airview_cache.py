@@ -0,0 +1,201 @@
+"""
+CS-410: Persistent cache of AirVIEW intermediates and results keyed by data hash and parameters
+@file airview_cache.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import os
+import tempfile
+import numpy as np
+import detections
+from datetime import datetime, timedelta, timezone
+
+# Default location of the on-disk half of the cache
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "gc3_airview_cache")
+# _id of the document keeping the running size of all entries (entry keys always contain ':')
+TOTAL_ID = "total"
+# last_used of an entry is rewritten on a hit only once it is older than this
+TOUCH_INTERVAL = timedelta(minutes=1)
+
+
+class AirviewCache:
+    """
+    Two-level cache for Plugin.run. Large arrays (spectrograms and coarse regions)
+    live as .npy/.npz files on local disk; the airview_cache collection indexes them
+    and stores the small results (detection tables and optimal parameters) inline.
+    Entries are evicted least recently used first once their total size exceeds max_bytes;
+    the total is kept up to date on every put, so only an overflowing put scans the index.
+
+    Keys:
+        spectrogram:  (data hash, fft_size)
+        coarse:       (data hash, fft_size, scale)
+        detections:   (data hash, fft_size, scale, beta, jaccard_threshold, max_gap_rows)
+        optimal:      (data hash, fft_size)
+    """
+
+    def __init__(self, db, directory=DEFAULT_CACHE_DIR, max_bytes=2 << 30):
+        """
+        :param db: database holding the airview_cache collection
+        :param directory: where cached arrays are written
+        :param max_bytes: size budget over all entries before eviction kicks in
+        """
+        self.db = db
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.collection.create_index("last_used")
+        if self.collection.find_one({"_id": TOTAL_ID}) is None:
+            self.recount()
+
+    @property
+    def collection(self):
+        # Resolved on every use so a forked worker talks through its own client
+        return self.db.airview_cache
+
+    # SPECTROGRAM
+
+    def get_spectrogram(self, data_hash, fft_size):
+        path = self._get_path(f"spectrogram:{data_hash}:{fft_size}")
+        return np.load(path, mmap_mode='r') if path else None
+
+    def put_spectrogram(self, data_hash, fft_size, spectrogram):
+        key = f"spectrogram:{data_hash}:{fft_size}"
+        path = self._file_for(key, ".npy")
+        self._write(path, lambda f: np.save(f, spectrogram))
+        self._put(key, "spectrogram", path=path)
+
+    # COARSE REGIONS
+
+    def get_coarse(self, data_hash, fft_size, scale):
+        """Returns the cached findAvgAdjDiffCoarse result (params, regions) or None."""
+        path = self._get_path(f"coarse:{data_hash}:{fft_size}:{scale}")
+        if not path:
+            return None
+        with np.load(path) as stored:
+            params = stored["params"].tolist()
+            table = stored["regions"]
+            offsets = stored["offsets"]
+        # Rebuild the per-row [start, end, mean, sd, value] lists airview works on
+        regions = []
+        for r in range(len(offsets) - 1):
+            regions.append([[int(row[0]), int(row[1]), row[2], row[3], row[4]]
+                            for row in table[offsets[r]:offsets[r + 1]].tolist()])
+        return params, regions
+
+    def put_coarse(self, data_hash, fft_size, scale, coarse):
+        params, regions = coarse
+        # Flatten the ragged per-row region lists into one table plus row offsets
+        offsets = np.zeros(len(regions) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(row) for row in regions])
+        table = np.array([region for row in regions for region in row], dtype=np.float64).reshape(-1, 5)
+        key = f"coarse:{data_hash}:{fft_size}:{scale}"
+        path = self._file_for(key, ".npz")
+        self._write(path, lambda f: np.savez(f, params=np.array(params), regions=table, offsets=offsets))
+        self._put(key, "coarse", path=path)
+
+    # RESULTS
+
+    def get_detections(self, data_hash, fft_size, scale, beta, jaccard_threshold, max_gap_rows):
+        """
+        Returns the cached detection table (see detections.py) or None. Its Hz and sample
+        bounds are those of the run that stored it; callers reset them with set_bounds.
+        """
+        value = self._get_value(f"detections:{data_hash}:{fft_size}:{scale}:{beta!r}:{jaccard_threshold!r}:{max_gap_rows}")
+        return None if value is None else detections.deserialize(value)
+
+    def put_detections(self, data_hash, fft_size, scale, beta, jaccard_threshold, max_gap_rows, table):
+        key = f"detections:{data_hash}:{fft_size}:{scale}:{beta!r}:{jaccard_threshold!r}:{max_gap_rows}"
+        self._put(key, "detections", value=detections.serialize(table))
+
+    def get_optimal_params(self, data_hash, fft_size):
+        return self._get_value(f"optimal:{data_hash}:{fft_size}")
+
+    def put_optimal_params(self, data_hash, fft_size, beta_scale):
+        self._put(f"optimal:{data_hash}:{fft_size}", "optimal", value=list(beta_scale))
+
+    # BOOKKEEPING
+
+    def _file_for(self, key, extension):
+        return os.path.join(self.directory, key.replace(":", "_") + extension)
+
+    def _write(self, path, save):
+        # Write to a temporary file first so concurrent readers never see a partial array
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            save(f)
+        os.replace(tmp_path, path)
+
+    def _touch(self, entry):
+        # Recency only needs to be approximate, so hot entries are not rewritten on every hit
+        now = datetime.now(timezone.utc)
+        last_used = entry.get("last_used")
+        if last_used is not None and last_used.tzinfo is None:
+            last_used = last_used.replace(tzinfo=timezone.utc)
+        if last_used is None or now - last_used >= TOUCH_INTERVAL:
+            self.collection.update_one({"_id": entry["_id"]}, {"$set": {"last_used": now}})
+
+    def _get_path(self, key):
+        entry = self.collection.find_one({"_id": key}, {"path": 1, "last_used": 1})
+        # The index may be shared by several hosts; a missing file is just a local miss
+        if not entry or not os.path.exists(entry["path"]):
+            return None
+        self._touch(entry)
+        return entry["path"]
+
+    def _get_value(self, key):
+        entry = self.collection.find_one({"_id": key}, {"value": 1, "last_used": 1})
+        if not entry:
+            return None
+        self._touch(entry)
+        return entry["value"]
+
+    def _put(self, key, kind, path=None, value=None):
+        if path:
+            size = os.path.getsize(path)
+        else:
+            size = len(value) if isinstance(value, bytes) else len(repr(value))
+        entry = {"_id": key, "kind": kind, "bytes": size, "last_used": datetime.now(timezone.utc)}
+        if path:
+            entry["path"] = path
+        else:
+            entry["value"] = value
+        previous = self.collection.find_one_and_replace({"_id": key}, entry, {"bytes": 1}, upsert=True)
+        if self._add_bytes(size - (previous["bytes"] if previous else 0)) > self.max_bytes:
+            self.evict()
+
+    def _add_bytes(self, delta):
+        """Adds delta to the running total and returns the new total."""
+        from pymongo import ReturnDocument
+        total = self.collection.find_one_and_update({"_id": TOTAL_ID}, {"$inc": {"bytes": delta}},
+                                                    upsert=True, return_document=ReturnDocument.AFTER)
+        return total["bytes"]
+
+    def recount(self):
+        """Recomputes the running total from the entries, e.g. after a crash between a put and its $inc."""
+        total = sum(entry["bytes"] for entry in self.collection.find({"_id": {"$ne": TOTAL_ID}}, {"bytes": 1}))
+        self.collection.update_one({"_id": TOTAL_ID}, {"$set": {"bytes": total}}, upsert=True)
+        return total
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes."""
+        total = self.collection.find_one({"_id": TOTAL_ID}, {"bytes": 1})
+        total = total["bytes"] if total else self.recount()
+        if total <= self.max_bytes:
+            return
+        for entry in self.collection.find({"_id": {"$ne": TOTAL_ID}}, {"bytes": 1, "path": 1}).sort("last_used", 1):
+            # Another process may be evicting too; only the one that deletes an entry counts it
+            if self.collection.delete_one({"_id": entry["_id"]}).deleted_count:
+                total = self._add_bytes(-entry["bytes"])
+                if entry.get("path") and os.path.exists(entry["path"]):
+                    os.remove(entry["path"])
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """Removes every cache entry and its file."""
+        for entry in self.collection.find({"path": {"$exists": True}}, {"path": 1}):
+            if os.path.exists(entry["path"]):
+                os.remove(entry["path"])
+        self.collection.delete_many({"_id": {"$ne": TOTAL_ID}})
+        self.collection.update_one({"_id": TOTAL_ID}, {"$set": {"bytes": 0}}, upsert=True)
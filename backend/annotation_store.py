@@ -0,0 +1,170 @@
+"""
+CS-410: Per-annotation storage in the annotations collection, queried by time/frequency window
+@file annotation_store.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Every manual annotation and AirVIEW detection of a file is one document, so an edit
+rewrites only that document and a view loads only the annotations it shows. Bounds
+are stored in samples (sample_start inclusive, sample_end exclusive) and Hz, like
+SigMF annotations; the frontend's corners (seconds and Hz) are converted with the
+capture's sample rate.
+"""
+
+from datetime import datetime, timezone
+from bson import ObjectId
+
+# Where an annotation came from: drawn by a user or detected by AirVIEW
+SOURCES = ("manual", "airview")
+# Fields a client may set besides the bounds
+TEXT_FIELDS = ("label", "comment")
+
+
+def _number(body, key):
+    value = body[key]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{key} must be a number")
+    return value
+
+
+def bounds_from_request(body, sample_rate):
+    """
+    Reads an annotation's bounds given either as sample_start, sample_count,
+    freq_lower_edge and freq_upper_edge, or as the frontend's corners
+    {freq1, time1, freq2, time2} in Hz and seconds.
+    :return: dict of the stored bound fields, or {} if the body sets no bounds
+    :raises ValueError: if the bounds are incomplete or invalid
+    """
+    try:
+        if "corners" in body:
+            corners = body["corners"] or {}
+            time1, time2 = sorted((_number(corners, "time1"), _number(corners, "time2")))
+            freq1, freq2 = sorted((_number(corners, "freq1"), _number(corners, "freq2")))
+            if not sample_rate:
+                raise ValueError("The capture's sample rate is unknown, so corners cannot be converted to samples")
+            sample_start, sample_end = round(time1 * sample_rate), round(time2 * sample_rate)
+        elif any(key in body for key in ("sample_start", "sample_count", "freq_lower_edge", "freq_upper_edge")):
+            sample_start, sample_count = int(_number(body, "sample_start")), int(_number(body, "sample_count"))
+            freq1, freq2 = _number(body, "freq_lower_edge"), _number(body, "freq_upper_edge")
+            if sample_count < 0 or freq1 > freq2:
+                raise ValueError("sample_count must not be negative nor freq_lower_edge above freq_upper_edge")
+            sample_end = sample_start + sample_count
+        else:
+            return {}
+    except KeyError as e:
+        raise ValueError(f"Missing annotation bound {e.args[0]}")
+    return {"sample_start": sample_start, "sample_end": sample_end,
+            "freq_lower_edge": float(freq1), "freq_upper_edge": float(freq2)}
+
+
+def fields_from_request(body, sample_rate, partial=False):
+    """
+    Reads the stored fields of a created (or, with partial, an updated) annotation.
+    :raises ValueError: if a field is missing or invalid
+    """
+    fields = bounds_from_request(body, sample_rate)
+    if not fields and not partial:
+        raise ValueError("An annotation needs corners or sample_start, sample_count, freq_lower_edge and freq_upper_edge")
+    for key in TEXT_FIELDS:
+        if key in body:
+            fields[key] = str(body[key] or "").strip()
+    if "display" in body:
+        fields["display"] = bool(body["display"])
+    if not partial:
+        fields.setdefault("label", "")
+        fields.setdefault("comment", "")
+        fields.setdefault("display", True)
+    return fields
+
+
+def from_detections(table):
+    """Stored fields of every AirVIEW detection in a detection table (see detections.py)."""
+    columns = [table[name].tolist() for name in ("sample_start", "sample_count", "freq_lower_edge", "freq_upper_edge")]
+    return [{
+        "sample_start": start,
+        "sample_end": start + count,
+        "freq_lower_edge": float(lower),
+        "freq_upper_edge": float(upper),
+        "label": "Transmitter",
+        "comment": "",
+        "display": True,
+    } for start, count, lower, upper in zip(*columns)]
+
+
+def to_response(document, sample_rate):
+    """An annotation as returned by the API, with corners in seconds and Hz for the frontend."""
+    seconds = (lambda sample: sample / sample_rate) if sample_rate else (lambda sample: None)
+    return {
+        # Annotations saved through /save-file keep the id the frontend gave them
+        "id": document.get("client_id") or str(document["_id"]),
+        "annotation_id": str(document["_id"]),
+        "source": document["source"],
+        "sample_start": document["sample_start"],
+        "sample_count": document["sample_end"] - document["sample_start"],
+        "freq_lower_edge": document["freq_lower_edge"],
+        "freq_upper_edge": document["freq_upper_edge"],
+        "corners": {
+            "freq1": document["freq_lower_edge"], "time1": seconds(document["sample_start"]),
+            "freq2": document["freq_upper_edge"], "time2": seconds(document["sample_end"]),
+        },
+        "label": document.get("label", ""),
+        "comment": document.get("comment", ""),
+        "display": document.get("display", True),
+    }
+
+
+def insert_annotation(db, file_id, source, fields):
+    """:return: the inserted document"""
+    document = dict(fields, file_id=ObjectId(file_id), source=source, updated_at=datetime.now(timezone.utc))
+    document["_id"] = db.annotations.insert_one(document).inserted_id
+    return document
+
+
+def replace_annotations(db, file_id, source, annotations):
+    """
+    Replaces all of a file's annotations from one source, e.g. after AirVIEW is re-run.
+    :param annotations: stored fields of each annotation
+    """
+    db.annotations.delete_many({"file_id": ObjectId(file_id), "source": source})
+    now = datetime.now(timezone.utc)
+    documents = [dict(fields, file_id=ObjectId(file_id), source=source, updated_at=now) for fields in annotations]
+    if documents:
+        db.annotations.insert_many(documents)
+
+
+def update_annotation(db, file_id, annotation_id, fields):
+    """:return: the updated document, or None if the file has no such annotation"""
+    from pymongo import ReturnDocument
+    return db.annotations.find_one_and_update(
+        {"_id": ObjectId(annotation_id), "file_id": ObjectId(file_id)},
+        {"$set": dict(fields, updated_at=datetime.now(timezone.utc))},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def delete_annotation(db, file_id, annotation_id):
+    """:return: True if the annotation existed"""
+    return db.annotations.delete_one({"_id": ObjectId(annotation_id), "file_id": ObjectId(file_id)}).deleted_count > 0
+
+
+def delete_file_annotations(db, file_id):
+    db.annotations.delete_many({"file_id": ObjectId(file_id)})
+
+
+def find_annotations(db, file_id, sample_window=None, freq_window=None, source=None):
+    """
+    Annotations of a file intersecting a window, in order of their start.
+    :param sample_window: (first sample, last sample) or None for the whole capture
+    :param freq_window: (lowest Hz, highest Hz) or None for the whole band
+    :param source: one of SOURCES, or None for both
+    """
+    query = {"file_id": ObjectId(file_id)}
+    if source:
+        query["source"] = source
+    if sample_window:
+        query["sample_start"] = {"$lte": sample_window[1]}
+        query["sample_end"] = {"$gte": sample_window[0]}
+    if freq_window:
+        query["freq_lower_edge"] = {"$lte": freq_window[1]}
+        query["freq_upper_edge"] = {"$gte": freq_window[0]}
+    return list(db.annotations.find(query).sort([("sample_start", 1), ("_id", 1)]))
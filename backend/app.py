@@ -5,152 +5,650 @@ CS-410: Generates spectrograms from uploaded files and stores them in MongoDB
 @collaborators None
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
-import numpy as np
-import matplotlib.pyplot as plt
+from werkzeug.local import LocalProxy
 import io
 import base64
-from pymongo import MongoClient
-from bson import ObjectId
-from gridfs import GridFS
-from gridfs import errors as gridfs_errors
+import importlib
+from bson import ObjectId, json_util
+from mongo import MongoConnection
 from SigMF import SigMF
 from FileData import FileData
+from migrations import SORT_FIELDS, ensure_indexes, is_current, migrate_record
+from storage import (ARTIFACT_FIELDS, GarbageCollector, artifact_ids, clear_gridfs, release_references,
+                     content_key, claim_content, register_content, add_content_artifact, claim_pending,
+                     start_pending, release_pending)
 import csv
+import hashlib
 import os
+import re
 import json
-from airview import Plugin
-from matplotlib.colors import LinearSegmentedColormap, to_rgb
-
-import matplotlib
-# Use the Agg backend for Matplotlib to avoid using any X server
-matplotlib.use('Agg')
+import logging
+from datetime import datetime, timezone
+import time
+from jobs import JobRunner
+from instrumentation import METRICS, span, start_request, finish_request, server_timing
+from profiling import export_profile, profile_requested, run_profiled
+from memory_budget import MemoryBudget, MemoryBudgetError
+from singleflight import SingleFlight
+from render_cache import RenderCache
+from annotation_store import (SOURCES, delete_annotation, delete_file_annotations, fields_from_request,
+                              find_annotations, from_detections, insert_annotation, replace_annotations,
+                              to_response, update_annotation)
+
+# NumPy, Matplotlib (plots.py), AirVIEW (airview.py, which pulls in pydantic) and the
+# MongoDB driver are imported where they are first used rather than here, so importing
+# this module and creating the app stay fast; see startup_time.py
+# `except gridfs_errors.NoFile` only evaluates the attribute once an exception is raised
+gridfs_errors = LocalProxy(lambda: importlib.import_module('gridfs.errors'))
+
+logger = logging.getLogger(__name__)
+
+# Plots rendered for every upload, keyed by their '<plot_type>_file_id' record field
+PLOT_TYPES = ('spectrogram', 'time_domain', 'freq_domain', 'iq_plot')
+# File record fields served by /file/<id>/data
+DATA_FIELDS = ('max_time', 'min_freq', 'max_freq', 'airview_detections')
+# Sections that can be requested from /file/<id>/bundle
+BUNDLE_FIELDS = ('data', 'metadata', 'calculated_statistics', 'plots')
+# Uploaded captures are read and hashed in chunks of this many bytes
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Stored captures up to this size are re-analyzed inside the request, larger ones in a background job
+SYNC_REANALYSIS_MAX_BYTES = int(os.environ.get('SYNC_REANALYSIS_MAX_BYTES', 64 << 20))
+# Largest width or height of a re-rendered spectrogram
+MAX_RENDER_PIXELS = 8192
+# /generate request parameters mapped to synthetic.py arguments and their types
+GENERATE_PARAMS = {
+    'rows': ('rows', int),
+    'cols': ('cols', int),
+    'numTransmitters': ('num_transmitters', int),
+    'transmitterMean': ('transmitter_mean', float),
+    'transmitterSd': ('transmitter_sd', float),
+    'noiseMean': ('noise_mean', float),
+    'noiseSd': ('noise_sd', float),
+    'bandwidth': ('bandwidth', int),
+    'activeTime': ('active_time', int),
+    'placementMethod': ('placement_method', str),
+}
+# Formats a generated matrix can be fetched in, and the largest image rendered of it
+GENERATE_OUTPUTS = ('png', 'csv', 'npy')
+GENERATE_PREVIEW_SHAPE = (1000, 2000)
+# Largest generated matrix (rows * cols); a float32 .npy of this size is 1 GiB
+MAX_GENERATE_CELLS = int(os.environ.get('MAX_GENERATE_CELLS', 1 << 28))
+# Page size limits and the only record fields read by /files
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+LISTING_PROJECTION = {
+    "filename": 1,
+    "uploaded_at": 1,
+    "metadata.center_frequency": 1,
+    "metadata.sample_rate": 1,
+    "has_detections": 1,
+}
+
+def warm_up(app):
+    """
+    Loads the state the first request would otherwise pay for: NumPy's FFT,
+    Matplotlib's Agg renderer and fonts, the colormaps, AirVIEW, and this process's
+    MongoDB connection. Called by the production server after each worker forks.
+    """
+    import numpy as np
+    import plots
+    import airview
+    np.fft.fftshift(np.fft.fft(np.zeros(1024, dtype=np.complex64)))
+    plots.warm_up()
+    app.extensions['mongo'].get_db().command('ping')
 
 """
  * Creates and configures the Flask application.
+ * @param start_collector start the storage garbage collector thread in this process. A server
+ *        that forks workers after creating the app starts it in a worker instead (see gunicorn.conf.py).
  * @return The configured Flask application.
 """
-def create_app():
+def create_app(start_collector=True):
     # Initialize the Flask application
     app = Flask(__name__)
-    CORS(app)  # Enable CORS for all routes
-
-    # MongoDB setup using GridFS
-    client = MongoClient("mongodb://localhost:27017")
-    db = client['files_db']
-    fs = GridFS(db)
-
-    # NOTE: For those with deuteranopia, change cmap='viridis' to cmap='accessible_cmap' in
-    #       plot_spectrogram() and generate_data() to use a color palette that is more accessible 
-    #       for colorblind users.
-    SPEC_HEX_COLORS = ["#e4ff7a", "#ffe81a", "#ffbd00", "#ffa000", "#fc7f00"] # CITE: https://github.com/wistia/heatmap-palette
-    rgb_colors = [to_rgb(color) for color in SPEC_HEX_COLORS] # Convert hex to RGB
-    custom_cmap = LinearSegmentedColormap.from_list('accessible_cmap', rgb_colors, N=256) # Create a custom colormap
-    plt.register_cmap(cmap=custom_cmap) # Register the colormap with Matplotlib
+    # Enable CORS for all routes, letting the frontend read the headers describing PSD views
+    CORS(app, expose_headers=['X-Vmin', 'X-Vmax', 'X-Psd-Shape', 'X-Psd-Dtype', 'X-Psd-Scale', 'X-Psd-Offset',
+                              'X-Psd-Window', 'X-Render-Shape'])
+
+    # LOG_LEVEL=DEBUG also logs the detections and samples of each upload
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # Per-stage timings are added to responses as a Server-Timing header when enabled
+    send_server_timing = os.environ.get('SERVER_TIMING', 'false').lower() in ('1','true','yes','y')
+
+    # MongoDB setup using GridFS. The proxies resolve to this process's own client,
+    # so the app can be created before a server forks its workers.
+    # Nothing connects until the first request touches the database; the indexes are then
+    # ensured once per process.
+    mongo = MongoConnection.from_env(on_connect=ensure_indexes)
+    db = LocalProxy(mongo.get_db)
+    fs = LocalProxy(mongo.get_fs)
+    app.extensions['mongo'] = mongo
+
+    # Background removal of GridFS files no record references; interval 0 disables the thread
+    garbage_collector = GarbageCollector(
+        db,
+        interval_seconds=float(os.environ.get('GC_INTERVAL_SECONDS', 3600)),
+        grace_seconds=float(os.environ.get('GC_GRACE_SECONDS', 600)),
+    )
+    app.extensions['garbage_collector'] = garbage_collector
+    if start_collector and garbage_collector.interval_seconds > 0:
+        garbage_collector.start()
+
+    # Runs re-analysis of large captures off the request thread
+    job_runner = JobRunner(db, max_workers=int(os.environ.get('JOB_WORKERS', 2)))
+
+    # AirVIEW spectrograms, coarse regions and results, reused across uploads and parameter sweeps
+    # Built on first use, since it imports NumPy and creates its index
+    def make_airview_cache():
+        if 'airview_cache' not in app.extensions:
+            from airview_cache import AirviewCache, DEFAULT_CACHE_DIR
+            app.extensions['airview_cache'] = AirviewCache(
+                db,
+                directory=os.environ.get('AIRVIEW_CACHE_DIR', DEFAULT_CACHE_DIR),
+                max_bytes=int(os.environ.get('AIRVIEW_CACHE_MAX_BYTES', 2 << 30)),
+            )
+        return app.extensions['airview_cache']
+    airview_cache = LocalProxy(make_airview_cache)
+
+    # Memory the uploads and re-analyses running at once in this worker may use
+    memory_budget = MemoryBudget(int(os.environ.get('MEMORY_BUDGET_BYTES', 2 << 30)))
+
+    # In lazy mode an upload renders only the spectrogram; the other plots and the CSV
+    # are made on first request, once per artifact however many requests race for it
+    lazy_plots_default = os.environ.get('LAZY_PLOTS', 'false').lower() in ('1','true','yes','y')
+
+    # Loaded PSDs and spectrograms re-rendered from them with other colors and windows
+    render_cache = RenderCache(int(os.environ.get('RENDER_CACHE_MAX_BYTES', 256 << 20)))
+
+    # PNG encoding of the stored plots; lower compression levels encode faster but store larger files
+    png_options = {
+        "dpi": float(os.environ.get('PLOT_DPI', 100)),
+        "compress_level": int(os.environ.get('PLOT_PNG_COMPRESSION', 6)),
+    }
+    artifact_flights = SingleFlight()
+
+    @app.before_request
+    def start_timing():
+        g.request_started = time.perf_counter()
+        start_request()
+        start_pending()
+
+    @app.teardown_request
+    def release_artifacts(error):
+        # The request has written the records of the artifacts it stored, or failed
+        release_pending(db)
+
+    @app.after_request
+    def finish_timing(response):
+        spans = finish_request()
+        elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        METRICS.observe_request(endpoint, request.method, response.status_code, elapsed)
+        if send_server_timing:
+            response.headers['Server-Timing'] = server_timing(spans + [('total', elapsed)])
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Stage and request duration histograms of this worker in the Prometheus text format."""
+        return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        """Liveness check; answers without touching MongoDB or loading the analysis stack."""
+        return jsonify({"status": "ok"}), 200
 
     @app.route('/upload', methods=['POST'])
     def upload_file():
-        """Uploads files, generates plots, stores in MongoDB."""
+        """
+        Uploads files, generates plots, stores in MongoDB.
+        With a true 'profile' form field or X-Profile header the upload runs under
+        cProfile and the profile is stored with the new file record.
+        """
+        if not profile_requested(request.form.get('profile', request.headers.get('X-Profile', 'false'))):
+            return process_upload()
+        response, profiler = run_profiled(process_upload)
+        response = app.make_response(response)
+        if response.status_code == 200:
+            body = response.get_json()
+            body.update(store_profile(body['file_id'], 'upload', profiler))
+            response = jsonify(body)
+        return response
+
+    def process_upload():
+        """Handles an /upload request."""
+        import numpy as np
+        from airview import Plugin
         if 'cfile' not in request.files or 'metaFile' not in request.files:
             return jsonify({'error': 'Both .cfile and .sigmf-meta files are required'}), 400
         
         run_airview     = request.form.get('runAirview',  'true').lower()  in ('1','true','yes','y')
         run_download    = request.form.get('downloadCSV','false').lower() in ('1','true','yes','y')
         auto_params     = request.form.get('autoParams','false').lower()  in ('1','true','yes','y')
+        lazy_plots      = request.form.get('lazyPlots', str(lazy_plots_default)).lower() in ('1','true','yes','y')
         # pull manual overrides (fall back to Plugin defaults)
         beta_manual     = float(request.form.get('beta',     Plugin.beta))
         scale_manual    = int(  request.form.get('scale',    Plugin.scale))
-        print(f"[UPLOAD] runAirview={run_airview}, downloadCSV={run_download}, autoParams={auto_params}, beta={beta_manual}, scale={scale_manual}")
+        logger.info("Upload: runAirview=%s, downloadCSV=%s, autoParams=%s, beta=%s, scale=%s",
+                    run_airview, run_download, auto_params, beta_manual, scale_manual)
 
         cfile, metafile = request.files['cfile'], request.files['metaFile']
         original_name = cfile.filename.replace('.cfile', '')
 
+        meta_bytes = metafile.read()
         try:
-            # Pass the actual file object to SigMF, NOT a string
-            sigmf_metadata = SigMF(metafile)
+            with span('sigmf.parse'):
+                sigmf_metadata = SigMF(io.BytesIO(meta_bytes))
         except Exception as e:
             return jsonify({'error': f'Failed to parse metadata: {str(e)}'}), 400
 
-        # Read cfile contents once
-        cfile_bytes = cfile.read()
-        iq_data = np.frombuffer(cfile_bytes, dtype=np.complex64)
-
-        # instantiate Plugin with either auto‑opt or manual params
-        plugin = Plugin(
-            sample_rate=sigmf_metadata.sample_rate,
-            center_freq=sigmf_metadata.center_frequency,
-            run_parameter_optimization = 'y' if auto_params else 'n',
-            beta  = beta_manual,
-            scale = scale_manual
-        )
-        if run_airview:
-            result = plugin.run(iq_data)
-            if auto_params:
-                # AirVIEW returns the best [beta, scale]
-                trained_beta, trained_scale = result.get("airview_beta_scale", [beta_manual, scale_manual])
-                airview_annotations = []
-            else:
-                airview_annotations = result.get("airview_annotations", [])
-                trained_beta, trained_scale = beta_manual, scale_manual
-        else:
-            airview_annotations, trained_beta, trained_scale = [], beta_manual, scale_manual
-
-
-        plot_ids, Pxx, freqs, bins = generate_plots(original_name, iq_data, sigmf_metadata)
-        if run_download:
-            pxx_csv_file_id = save_pxx_csv(original_name, Pxx, freqs, bins)
-        else:
-            pxx_csv_file_id = None
+        # Reserve the upload's estimated peak memory before reading the capture; captures too
+        # large to process at full resolution within the budget are decimated
+        try:
+            with memory_budget.reserve(upload_size(cfile) // 8, run_airview=run_airview,
+                                       plot_types=('spectrogram',) if lazy_plots else PLOT_TYPES,
+                                       run_download=run_download and not lazy_plots) as budget:
+                # Read cfile contents once, hashing it as it streams in
+                with span('upload.read'):
+                    cfile_bytes, iq_sha256 = read_and_hash(cfile.stream, upload_size(cfile))
+                with span('iq.decode'):
+                    iq_data = np.frombuffer(cfile_bytes, dtype=np.complex64)
+                decimation, tracker = budget["decimation"], budget["tracker"]
+                tracker.checkpoint('upload.read')
+                key = content_key(iq_sha256, hashlib.sha256(meta_bytes).hexdigest())
+
+                # Reuse the artifacts of an identical earlier upload if there is one
+                wanted = list(PLOT_TYPES) + ["raw_data", "meta", "psd"] + (["csv"] if run_download else [])
+                entry = claim_content(db, key, wanted)
+
+                if run_airview:
+                    # instantiate Plugin with either auto‑opt or manual params
+                    plugin = Plugin(
+                        sample_rate=sigmf_metadata.sample_rate,
+                        center_freq=sigmf_metadata.center_frequency,
+                        run_parameter_optimization = 'y' if auto_params else 'n',
+                        beta  = beta_manual,
+                        scale = scale_manual,
+                        row_average = decimation
+                    )
+                    # The cache returns stored results for repeated parameters and shares intermediates across betas
+                    result = plugin.run(iq_data, cache=airview_cache, data_hash=iq_sha256)
+                    if auto_params:
+                        # AirVIEW returns the best [beta, scale]
+                        trained_beta, trained_scale = result.get("airview_beta_scale", [beta_manual, scale_manual])
+                        airview_detections, airview_annotations = None, []
+                    else:
+                        airview_detections, airview_annotations = result["airview_detections"], result["airview_annotations"]
+                        trained_beta, trained_scale = beta_manual, scale_manual
+                    tracker.checkpoint('airview')
+                else:
+                    airview_detections, airview_annotations = None, []
+                    trained_beta, trained_scale = beta_manual, scale_manual
+
+                if entry:
+                    artifacts = entry["artifacts"]
+                    # Entries made by lazy uploads lack the plots nobody has asked for yet
+                    plot_ids = {plot_type: artifacts.get(plot_type) for plot_type in PLOT_TYPES}
+                    plot_ids["psd"] = artifacts.get("psd")
+                    if "raw_data" in artifacts:
+                        plot_ids["raw_data"] = artifacts["raw_data"]
+                    else:
+                        # Entries from before raw captures were kept; store it now so the file can be re-analyzed
+                        plot_ids["raw_data"] = put_file(rewound(cfile.stream), f"{original_name}.cfile")
+                        add_content_artifact(db, key, "raw_data", plot_ids["raw_data"])
+                    meta_file_id = artifacts["meta"]
+                    plot_decimation = entry.get("decimation", 1)
+                    extent = entry["extent"]
+                    # Spectrogram extents are all FileData needs from freqs and bins
+                    freqs, bins = [extent["min_freq"], extent["max_freq"]], [extent["max_time"]]
+                    pxx_csv_file_id = None
+                    if run_download:
+                        pxx_csv_file_id = artifacts.get("csv")
+                        if pxx_csv_file_id is None and not lazy_plots:
+                            from plots import compute_psd
+                            with span('psd.compute'):
+                                Pxx, freqs, bins = compute_psd(iq_data, sigmf_metadata, decimation)
+                            pxx_csv_file_id = save_pxx_csv(original_name, Pxx, freqs, bins)
+                            add_content_artifact(db, key, "csv", pxx_csv_file_id)
+                else:
+                    plot_ids, Pxx, freqs, bins = generate_plots(original_name, iq_data, sigmf_metadata, decimation,
+                                                                ('spectrogram',) if lazy_plots else PLOT_TYPES)
+                    plot_decimation = decimation
+                    tracker.checkpoint('plots')
+                    # Keep the raw capture so AirVIEW can be re-run later without a re-upload
+                    plot_ids["raw_data"] = put_file(rewound(cfile.stream), f"{original_name}.cfile")
+                    if lazy_plots:
+                        # The CSV and later re-renders are made from the stored PSD
+                        plot_ids["psd"] = save_psd(original_name, Pxx, freqs, bins)
+                        pxx_csv_file_id = None
+                    elif run_download:
+                        pxx_csv_file_id = save_pxx_csv(original_name, Pxx, freqs, bins)
+                    else:
+                        pxx_csv_file_id = None
+
+                    # Save the metadata file in GridFS
+                    meta_file_id = put_file(meta_bytes, f"{original_name}.sigmf-meta")
+
+                    artifacts = {name: grid_id for name, grid_id in plot_ids.items() if grid_id is not None}
+                    artifacts["meta"] = meta_file_id
+                    if pxx_csv_file_id is not None:
+                        artifacts["csv"] = pxx_csv_file_id
+                    register_content(db, key, artifacts, {
+                        "max_time": float(bins[-1]), "min_freq": float(freqs[0]), "max_freq": float(freqs[-1]),
+                    }, decimation)
+                tracker.checkpoint('store')
+
+                # Store metadata file ID in file_records
+                file_data = FileData(original_name, sigmf_metadata, pxx_csv_file_id, plot_ids, freqs, bins, 1024, airview_detections)
+                file_data.meta_file_id = meta_file_id  # Save metadata file ID
+                file_data.iq_sha256 = iq_sha256
+                file_data.content_key = key
+                file_data.psd_file_id = str(plot_ids.get("psd"))
+                if run_airview:
+                    file_data.airview_params = {"auto_params": auto_params, "beta": trained_beta, "scale": trained_scale,
+                                                "row_average": decimation}
+                # Decimation of the stored plots, and the memory estimated and seen for this upload
+                file_data.processing = {
+                    "decimation": plot_decimation,
+                    "estimated_bytes": budget["estimated_bytes"],
+                    "observed_peak_bytes": tracker.peak_growth,
+                }
+                with span('mongo.insert'):
+                    file_record_id = db.file_records.insert_one(file_data.__dict__).inserted_id
+                    if airview_detections is not None:
+                        replace_annotations(db, file_record_id, "airview", from_detections(airview_detections))
+
+                encoded_spectrogram = base64.b64encode(fs.get(plot_ids["spectrogram"]).read()).decode('utf-8')
+                logger.info("Uploaded %s as %s with %d AirVIEW detection(s)", original_name, file_record_id,
+                            len(airview_annotations))
+                logger.debug("AirVIEW annotations: %s", airview_annotations)
+
+                return jsonify({
+                    'spectrogram': encoded_spectrogram,
+                    'file_id':    str(file_record_id),
+                    'message':    'All files uploaded and saved successfully',
+                    'airview_annotations':       airview_annotations,
+                    'beta_used':         trained_beta,
+                    'scale_used':        trained_scale, 
+                    'max_time': file_data.max_time,
+                    'min_freq': file_data.min_freq,
+                    'max_freq': file_data.max_freq,
+                    'processing': file_data.processing,
+                })
+        except MemoryBudgetError as e:
+            return jsonify({'error': str(e)}), e.status
+    
             
-        # Save the metadata file in GridFS
-        metafile.seek(0)  # Reset file pointer before saving
-        meta_file_id = fs.put(metafile.read(), filename=f"{original_name}.sigmf-meta")
-
-        # Store metadata file ID in file_records
-        file_data = FileData(original_name, sigmf_metadata, pxx_csv_file_id, plot_ids, freqs, bins, 1024, airview_annotations)
-        file_data.meta_file_id = meta_file_id  # Save metadata file ID
-        file_data.airview_annotations = airview_annotations  # Save airview annotations
-        file_record_id = db.file_records.insert_one(file_data.__dict__).inserted_id
+    def store_profile(file_id, kind, profiler):
+        """
+        Saves a request's profile in GridFS, replacing the file record's previous one.
+        :param kind: what was profiled, e.g. 'upload' or 'reanalysis'
+        :return: dict with the profile download URL and its summary
+        """
+        data, report, summary = export_profile(profiler)
+        profile_file_id = put_file(data, f"{file_id}_{kind}.prof")
+        summary_file_id = put_file(report.encode(), f"{file_id}_{kind}_profile.txt")
+        previous = db.file_records.find_one_and_update({"_id": ObjectId(file_id)}, {"$set": {
+            "profile_file_id": profile_file_id,
+            "profile_summary_file_id": summary_file_id,
+            "profile": dict(summary, kind=kind, created_at=datetime.now(timezone.utc)),
+        }}, projection={"profile_file_id": 1, "profile_summary_file_id": 1})
+        if previous:
+            release_references(db, artifact_ids({field: previous.get(field) for field in
+                                                 ("profile_file_id", "profile_summary_file_id")}))
+        return {'profile_url': f"/file/{file_id}/profile", 'profile': summary}
+
+    def reanalyze_record(file_id, raw_data_file_id, iq_sha256, sample_rate, center_frequency, auto_params, beta, scale,
+                         profile=False):
+        """
+        Re-runs AirVIEW on a stored capture and saves the detections on its file record.
+        With auto_params the optimal beta and scale are found first and detection is run with them.
+        :param profile: run under cProfile and store the profile with the file record
+        :return: dict with the new annotations and the parameters used
+        """
+        if profile:
+            result, profiler = run_profiled(reanalyze_record, file_id, raw_data_file_id, iq_sha256, sample_rate,
+                                            center_frequency, auto_params, beta, scale)
+            result.update(store_profile(file_id, 'reanalysis', profiler))
+            return result
+
+        import numpy as np
+        import detections
+        from airview import detect
+        grid_out = fs.get(ObjectId(raw_data_file_id))
+        # Large captures are analyzed with averaged spectrogram rows to stay within the memory budget
+        with memory_budget.reserve(grid_out.length // 8, plot_types=()) as budget:
+            row_average = budget["decimation"]
+            iq_bytes = grid_out.read()
+            if iq_sha256 is None:
+                iq_sha256 = hashlib.sha256(iq_bytes).hexdigest()
+            iq_data = np.frombuffer(iq_bytes, dtype=np.complex64)
+
+            # Spectrogram and coarse regions come from the cache when this capture was analyzed before
+            table, beta, scale = detect(iq_data, sample_rate, center_frequency, auto_params, beta, scale, row_average,
+                                        cache=airview_cache, data_hash=iq_sha256)
+
+        airview_params = {"auto_params": auto_params, "beta": beta, "scale": scale, "row_average": row_average}
+        db.file_records.update_one({"_id": ObjectId(file_id)}, {"$set": {
+            **detections.record_fields(table),
+            "airview_params": airview_params,
+            "iq_sha256": iq_sha256,
+        }})
+        replace_annotations(db, file_id, "airview", from_detections(table))
+        return {
+            'file_id': file_id,
+            'airview_annotations': detections.to_sigmf(table),
+            'beta_used': beta,
+            'scale_used': scale,
+        }
 
-        encoded_spectrogram = base64.b64encode(fs.get(plot_ids["spectrogram"]).read()).decode('utf-8')
-        
-        print("sending json to frontend")
-        print("AIRVIEW ANNOTATIONS: ")
-        print(airview_annotations)
+    @app.route('/file/<file_id>/airview', methods=['POST'])
+    def reanalyze_file(file_id):
+        """
+        Re-runs AirVIEW on an already stored capture with new parameters.
+        Small captures are processed in the request; larger ones run as a
+        background job whose status is polled at /jobs/<job_id>.
+        """
+        from airview import Plugin
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
 
-        return jsonify({
-            'spectrogram': encoded_spectrogram,
-            'file_id':    str(file_record_id),
-            'message':    'All files uploaded and saved successfully',
-            'airview_annotations':       airview_annotations,
-            'beta_used':         trained_beta,
-            'scale_used':        trained_scale, 
-            'max_time': file_data.max_time,
-            'min_freq': file_data.min_freq,
-            'max_freq': file_data.max_freq,
-            'airview_annotations': file_data.airview_annotations,
+        data = request.json or {}
+        try:
+            auto_params = str(data.get('autoParams', 'false')).lower() in ('1','true','yes','y')
+            beta = float(data.get('beta', Plugin.beta))
+            scale = int(data.get('scale', Plugin.scale))
+            profile = profile_requested(data.get('profile', request.headers.get('X-Profile', 'false')))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'beta must be a number and scale an integer'}), 400
+
+        file_record = db.file_records.find_one({"_id": ObjectId(file_id)}, {
+            "raw_data_file_id": 1, "iq_sha256": 1, "metadata": 1, "schema_version": 1, "meta_file_id": 1,
         })
-    
-            
+        if not file_record:
+            return jsonify({'error': 'File not found'}), 404
+        error = ensure_current(file_record)
+        if error:
+            return error
+
+        raw_data_file_id = file_record.get("raw_data_file_id")
+        if not raw_data_file_id or not ObjectId.is_valid(raw_data_file_id):
+            return jsonify({'error': 'The raw capture of this file was not stored; upload it again to re-analyze it'}), 409
+        raw_data = db.fs.files.find_one({"_id": ObjectId(raw_data_file_id)}, {"length": 1})
+        if not raw_data:
+            return jsonify({'error': 'Raw capture does not exist in GridFS'}), 404
+
+        def job():
+            return reanalyze_record(
+                file_id, raw_data_file_id, file_record.get("iq_sha256"),
+                file_record["metadata"]["sample_rate"], file_record["metadata"]["center_frequency"],
+                auto_params, beta, scale, profile,
+            )
+
+        if raw_data["length"] <= SYNC_REANALYSIS_MAX_BYTES:
+            try:
+                return jsonify(job())
+            except MemoryBudgetError as e:
+                return jsonify({'error': str(e)}), e.status
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+
+        def claimed_job():
+            # A job thread claims the artifacts it stores (e.g. profiles) like a request does
+            start_pending()
+            try:
+                return job()
+            finally:
+                release_pending(db)
+
+        job_id = job_runner.submit("airview", claimed_job, file_id=file_id)
+        return jsonify({'job_id': str(job_id), 'status_url': f"/jobs/{job_id}"}), 202
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Reports the status of a background job, including its result once done."""
+        job = job_runner.get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        job["_id"] = str(job["_id"])
+        return jsonify(job)
+
     @app.route('/save-file', methods=['POST'])
     def save_file():
+        """
+        Replaces all of a file's manual annotations. Clients editing one annotation
+        at a time should use the /file/<file_id>/annotations endpoints instead.
+        """
         try:
             data = request.json
             file_id = data.get('file_id')
             annotations = data.get('annotations', [])
             if not file_id:
                 return jsonify({"error": "File ID is required"}), 400
-            # Update the file record with annotations
-            db.file_records.update_one(
-                {"_id": ObjectId(file_id)},
-                {"$set": {"annotations": annotations}}
-            )
+            file_record, error = load_annotated_record(file_id)
+            if error:
+                return error
+            try:
+                manual = []
+                for annotation in annotations:
+                    fields = fields_from_request(annotation, file_record["metadata"]["sample_rate"])
+                    if annotation.get("id"):
+                        fields["client_id"] = str(annotation["id"])
+                    manual.append(fields)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            replace_annotations(db, file_id, "manual", manual)
             return jsonify({"message": "File saved successfully"})
         except Exception as e:
-            print(f"Error saving file: {e}")
+            logger.exception("Error saving file")
             return jsonify({"error": str(e)}), 500
 
+    def load_annotated_record(file_id):
+        """
+        Loads the sample rate and schema fields of a file record, migrating its annotations
+        to the annotations collection first if the record predates it.
+        :return: (file record, None) or (None, error response)
+        """
+        if not ObjectId.is_valid(file_id):
+            return None, (jsonify({'error': 'Invalid file ID format'}), 400)
+        file_record = db.file_records.find_one({"_id": ObjectId(file_id)},
+                                               {"metadata": 1, "schema_version": 1, "meta_file_id": 1})
+        if not file_record:
+            return None, (jsonify({'error': 'File not found'}), 404)
+        error = ensure_current(file_record)
+        if error:
+            return None, error
+        return file_record, None
+
+    def airview_annotations_of(file_record):
+        """The AirVIEW detections of a current file record as SigMF annotations."""
+        if not file_record.get("airview_detections"):
+            return []
+        import detections
+        return detections.to_sigmf(detections.deserialize(file_record["airview_detections"]))
+
+    def manual_annotations(file_record):
+        """All manual annotations of a current file record, as the frontend loads them."""
+        sample_rate = file_record["metadata"]["sample_rate"]
+        return [to_response(annotation, sample_rate)
+                for annotation in find_annotations(db, file_record["_id"], source="manual")]
+
+    @app.route('/file/<file_id>/annotations', methods=['GET'])
+    def list_annotations(file_id):
+        """
+        Lists the annotations of a file that intersect a time/frequency window, so a view only
+        loads what it shows. Optional query parameters: tmin and tmax in seconds, fmin and fmax
+        in Hz, and source (manual or airview).
+        """
+        file_record, error = load_annotated_record(file_id)
+        if error:
+            return error
+        try:
+            window = {name: float(request.args[name]) for name in ('tmin', 'tmax', 'fmin', 'fmax')
+                      if request.args.get(name) not in (None, '')}
+        except ValueError:
+            return jsonify({'error': 'tmin, tmax, fmin and fmax must be numbers'}), 400
+        source = request.args.get('source')
+        if source is not None and source not in SOURCES:
+            return jsonify({'error': f"source must be one of {', '.join(SOURCES)}"}), 400
+
+        sample_rate = file_record["metadata"]["sample_rate"]
+        sample_window = freq_window = None
+        if 'tmin' in window or 'tmax' in window:
+            sample_window = (window.get('tmin', float('-inf')) * sample_rate, window.get('tmax', float('inf')) * sample_rate)
+        if 'fmin' in window or 'fmax' in window:
+            freq_window = (window.get('fmin', float('-inf')), window.get('fmax', float('inf')))
+        annotations = find_annotations(db, file_id, sample_window, freq_window, source)
+        return jsonify({'annotations': [to_response(annotation, sample_rate) for annotation in annotations]})
+
+    @app.route('/file/<file_id>/annotations', methods=['POST'])
+    def create_annotation(file_id):
+        """
+        Adds one manual annotation. The body gives its bounds as corners {freq1, time1, freq2, time2}
+        in Hz and seconds, or as sample_start, sample_count, freq_lower_edge and freq_upper_edge,
+        plus an optional label, comment and display flag.
+        """
+        file_record, error = load_annotated_record(file_id)
+        if error:
+            return error
+        sample_rate = file_record["metadata"]["sample_rate"]
+        try:
+            fields = fields_from_request(request.json or {}, sample_rate)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        annotation = insert_annotation(db, file_id, "manual", fields)
+        return jsonify(to_response(annotation, sample_rate)), 201
+
+    @app.route('/file/<file_id>/annotations/<annotation_id>', methods=['PATCH'])
+    def edit_annotation(file_id, annotation_id):
+        """Changes the label, comment, display flag or bounds (given as on creation) of one annotation."""
+        file_record, error = load_annotated_record(file_id)
+        if error:
+            return error
+        if not ObjectId.is_valid(annotation_id):
+            return jsonify({'error': 'Invalid annotation ID format'}), 400
+        sample_rate = file_record["metadata"]["sample_rate"]
+        try:
+            fields = fields_from_request(request.json or {}, sample_rate, partial=True)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        annotation = update_annotation(db, file_id, annotation_id, fields)
+        if not annotation:
+            return jsonify({'error': 'Annotation not found'}), 404
+        return jsonify(to_response(annotation, sample_rate))
+
+    @app.route('/file/<file_id>/annotations/<annotation_id>', methods=['DELETE'])
+    def remove_annotation(file_id, annotation_id):
+        """Deletes one annotation."""
+        if not ObjectId.is_valid(file_id) or not ObjectId.is_valid(annotation_id):
+            return jsonify({'error': 'Invalid file or annotation ID format'}), 400
+        if not delete_annotation(db, file_id, annotation_id):
+            return jsonify({'error': 'Annotation not found'}), 404
+        return jsonify({'message': f"Annotation {annotation_id} deleted"})
+
     @app.route('/<file_id>/rename_file', methods=['PUT'])
     def rename_file(file_id):
         """Renames file that is displayed under 'Saved Files'"""
@@ -173,25 +671,32 @@ def create_app():
             return jsonify({"message": "File renamed successfully"})
 
         except Exception as e:
-            print(f"Error renaming file: {e}")
+            logger.exception("Error renaming file")
             return jsonify({"error": str(e)}), 500
 
 
     @app.route('/file/<file_id>/csv', methods=['GET'])
     def download_pxx_csv(file_id):
-        """Serves the Pxx CSV as a downloadable file."""
-        from bson import ObjectId
-        # find our record
-        rec = db.file_records.find_one({"_id": ObjectId(file_id)})
-        if not rec or "csv_file_id" not in rec:
+        """Serves the Pxx CSV as a downloadable file, making it first if it was not requested at upload."""
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
+        try:
+            csv_file_id = ensure_artifact(file_id, "csv", render_record_csv)
+        except MemoryBudgetError as e:
+            return jsonify({'error': str(e)}), e.status
+        if csv_file_id is None:
             return jsonify({"error":"CSV not found"}), 404
 
         try:
-            grid_out = fs.get(ObjectId(rec["csv_file_id"]))
+            grid_out = fs.get(csv_file_id)
             csv_bytes = grid_out.read()
         except gridfs_errors.NoFile:
             return jsonify({"error":"CSV missing in GridFS"}), 404
 
+        rec = db.file_records.find_one({"_id": ObjectId(file_id)}, {"filename": 1})
+        if not rec:
+            return jsonify({"error": "File not found"}), 404
+
         fname = f"{rec['filename']}_pxx.csv"
         return Response(
             csv_bytes,
@@ -201,184 +706,385 @@ def create_app():
             }
         )
 
-    def generate_plots(original_name, iq_data, sigmf_metadata):
-        """Generates and stores plots in GridFS."""
-        plots = {}
+    @app.route('/file/<file_id>/profile', methods=['GET'])
+    def download_profile(file_id):
+        """
+        Serves the last profile stored for a file: the pstats dump by default,
+        or the text report with ?format=txt.
+        """
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
+        output = request.args.get('format', 'prof')
+        if output not in ('prof', 'txt'):
+            return jsonify({'error': 'format must be prof or txt'}), 400
+        field = "profile_file_id" if output == 'prof' else "profile_summary_file_id"
+
+        rec = db.file_records.find_one({"_id": ObjectId(file_id)}, {"filename": 1, "profile": 1, field: 1})
+        if not rec or field not in rec:
+            return jsonify({"error": "Profile not found"}), 404
+        try:
+            profile_bytes = fs.get(ObjectId(rec[field])).read()
+        except gridfs_errors.NoFile:
+            return jsonify({"error": "Profile missing in GridFS"}), 404
+
+        fname = f"{rec['filename']}_{rec['profile']['kind']}"
+        fname += ".prof" if output == 'prof' else "_profile.txt"
+        return Response(
+            profile_bytes,
+            mimetype="application/octet-stream" if output == 'prof' else "text/plain",
+            headers={
+                "Content-Disposition": f"attachment; filename={fname}"
+            }
+        )
 
-        # Debug: Starting plot generation
-        print(f"Generating plots for {original_name}...")
+    def generate_plots(original_name, iq_data, sigmf_metadata, decimation=1, plot_types=PLOT_TYPES):
+        """
+        Generates and stores plots in GridFS.
+        :param decimation: averaging applied to the spectrogram and frequency plots of large captures
+        :param plot_types: plots to make besides the spectrogram, which is always made
+        """
+        renderer = plot_renderer()
+        plots = {}
+        logger.info("Generating plots for %s", original_name)
 
         # Generate spectrogram and get Pxx, freqs, bins
-        fig, Pxx, freqs, bins = plot_spectrogram(iq_data, sigmf_metadata)
-        spectrogram_file_id = save_plot(fig, f"{original_name}_spectrogram.png")
-        plots["spectrogram"] = spectrogram_file_id
-        print(f"Saved Spectrogram: {spectrogram_file_id}")
+        with span('plot.spectrogram'):
+            png, Pxx, freqs, bins = renderer.spectrogram(iq_data, sigmf_metadata, decimation)
+        plots["spectrogram"] = put_file(png, f"{original_name}_spectrogram.png")
 
         # Generate time domain plot
-        fig = plot_time_domain(iq_data, sigmf_metadata)
-        plots["time_domain"] = save_plot(fig, f"{original_name}_time_domain.png")
-        print(f"Saved Time Domain Plot: {plots['time_domain']}")
+        if 'time_domain' in plot_types:
+            with span('plot.time_domain'):
+                png = renderer.time_domain(iq_data, sigmf_metadata)
+            plots["time_domain"] = put_file(png, f"{original_name}_time_domain.png")
 
         # Generate frequency domain (FFT) plot
-        fig = plot_freq_domain(iq_data, sigmf_metadata)
-        plots["freq_domain"] = save_plot(fig, f"{original_name}_freq_domain.png")
-        print(f"Saved Frequency Domain Plot: {plots['freq_domain']}")
+        if 'freq_domain' in plot_types:
+            with span('plot.freq_domain'):
+                png = renderer.freq_domain(iq_data, sigmf_metadata, decimation)
+            plots["freq_domain"] = put_file(png, f"{original_name}_freq_domain.png")
 
         # Generate IQ plot (Constellation Diagram)
-        fig = plot_iq(iq_data)
-        plots["iq_plot"] = save_plot(fig, f"{original_name}_iq_plot.png")
-        print(f"Saved IQ Plot: {plots['iq_plot']}")
-
-        # Debug: Finished plot generation
-        print(f"All plots generated and saved for {original_name}.")
+        if 'iq_plot' in plot_types:
+            with span('plot.iq_plot'):
+                png = renderer.iq_plot(iq_data)
+            plots["iq_plot"] = put_file(png, f"{original_name}_iq_plot.png")
 
+        logger.debug("Saved plots for %s: %s", original_name, plots)
         return plots, Pxx, freqs, bins
 
-    def save_plot(fig, filename):
-        """Saves a given Matplotlib figure to GridFS."""
+    def render_plot(fig):
+        """Encodes a given Matplotlib figure as PNG bytes."""
+        import plots
+        return plots.render_png(fig, **png_options)
+
+    def plot_renderer():
+        """This thread's renderer of the stored plots, which reuses its figures between captures."""
+        import plots
+        return plots.renderer(**png_options)
+
+    def put_file(data, filename):
+        """Stores bytes in GridFS, timing the write. The file stays claimed until the request or job ends."""
+        grid_id = ObjectId()
+        claim_pending(db, grid_id)
+        with span('gridfs.put'):
+            return fs.put(data, _id=grid_id, filename=filename)
+
+    def save_psd(original_name, Pxx, freqs, bins):
+        """
+        Saves the spectrogram's PSD in GridFS as a compressed .npz, so the CSV can be made
+        later without reading the raw capture again.
+        """
+        import numpy as np
         buf = io.BytesIO()
-        fig.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        return fs.put(buf.getvalue(), filename=filename)
-
-    def plot_time_domain(iq_data, sigmf_metadata):
-        """Generates the time-domain plot."""
-        fig, ax = plt.subplots(figsize=(8, 4))
-        time_axis = np.arange(len(iq_data)) / sigmf_metadata.sample_rate
-        ax.plot(time_axis[:1000], iq_data[:1000].real, label="Real")
-        ax.plot(time_axis[:1000], iq_data[:1000].imag, label="Imaginary", linestyle='dashed')
-        ax.set_title("Time Domain Signal")
-        ax.set_xlabel("Time [s]")
-        ax.set_ylabel("Amplitude")
-        ax.legend()
-        return fig
-
-    def plot_freq_domain(iq_data, sigmf_metadata):
-        """Generates the frequency-domain (FFT) plot."""
-        fig, ax = plt.subplots(figsize=(8, 4))
-        fft_spectrum = np.fft.fftshift(np.fft.fft(iq_data))
-        freq_axis = np.fft.fftshift(np.fft.fftfreq(len(iq_data), 1 / sigmf_metadata.sample_rate))
-        ax.plot(freq_axis, 20 * np.log10(np.abs(fft_spectrum)), color='red')
-        ax.set_title("Frequency Domain (FFT)")
-        ax.set_xlabel("Frequency [Hz]")
-        ax.set_ylabel("Power [dB]")
-        return fig
-
-    def plot_iq(iq_data):
-        """Generates the IQ plot (constellation diagram)."""
-        fig, ax = plt.subplots(figsize=(8, 8))
-        ax.scatter(iq_data[:5000].real, iq_data[:5000].imag, alpha=0.5, s=2)
-        ax.set_title("IQ Plot (Constellation Diagram)")
-        ax.set_xlabel("In-phase")
-        ax.set_ylabel("Quadrature")
-        return fig
-
-    def plot_spectrogram(iq_data, sigmf_metadata):
-        """Generates the spectrogram and returns Pxx, freqs, bins."""
-        fig, ax = plt.subplots(figsize=(8, 4.8))
-        # Generate the spectrogram
-        Pxx, freqs, bins, im = ax.specgram(
-            iq_data,
-            Fs=sigmf_metadata.sample_rate,
-            Fc=sigmf_metadata.center_frequency,
-        )
-        # Overlay image representation of Pxx (Power Spectral Density)
-        ax.imshow(10 * np.log10(Pxx.T), aspect='auto', extent=[freqs[0], freqs[-1], bins[-1], 0], cmap='viridis')
-        # Set plot labels
-        ax.set_xlabel("Frequency [Hz]")
-        ax.set_ylabel("Time [s]")
-        ax.set_title("Spectrogram")
-        return fig, Pxx, freqs, bins
+        np.savez_compressed(buf, Pxx=Pxx.astype(np.float32), freqs=freqs, bins=bins)
+        return put_file(buf.getvalue(), f"{original_name}_psd.npz")
+
+    def load_psd(psd_file_id):
+        """:return: (Pxx, freqs, bins) saved by save_psd"""
+        import numpy as np
+        with np.load(io.BytesIO(fs.get(ObjectId(psd_file_id)).read())) as psd:
+            return psd["Pxx"], psd["freqs"], psd["bins"]
+
+    def ensure_artifact(file_id, name, render):
+        """
+        Returns the GridFS id of a file record's artifact, making it first if the upload was lazy.
+        Concurrent requests for the same artifact in this process wait for one render; across
+        processes the first record update wins and the other copies are released.
+        :param name: artifact name, stored on the record as <name>_file_id
+        :param render: function of the file record that stores the artifact and returns its id,
+                       or None if it cannot be made
+        :return: the artifact's ObjectId, or None if the record or the artifact does not exist
+        """
+        field = f"{name}_file_id"
+
+        def produce():
+            file_record = db.file_records.find_one({"_id": ObjectId(file_id)}, {
+                field: 1, "filename": 1, "content_key": 1, "meta_file_id": 1, "raw_data_file_id": 1, "psd_file_id": 1,
+            })
+            if not file_record:
+                return None
+            if ObjectId.is_valid(file_record.get(field) or ""):
+                return ObjectId(file_record[field])
+
+            # Another record with the same content may have made it already
+            key = file_record.get("content_key")
+            entry = claim_content(db, key, [name]) if key else None
+            grid_id = entry["artifacts"].get(name) if entry else None
+            rendered = grid_id is None
+            if rendered:
+                grid_id = render(file_record)
+                if grid_id is None:
+                    return None
+
+            # Only fill the field if it is still empty, in case another process got there first
+            updated = db.file_records.update_one({"_id": ObjectId(file_id), field: {"$in": [None, "None"]}},
+                                                 {"$set": {field: str(grid_id)}})
+            if not updated.matched_count:
+                release_references(db, [grid_id])
+                current = db.file_records.find_one({"_id": ObjectId(file_id)}, {field: 1})
+                return ObjectId(current[field]) if current and ObjectId.is_valid(current.get(field) or "") else None
+            if rendered and key:
+                add_content_artifact(db, key, name, grid_id)
+            return grid_id
+
+        return artifact_flights.do((file_id, name), produce)
+
+    def read_raw_capture(file_record, max_bytes=None):
+        """
+        Loads a stored capture's samples and metadata.
+        :param max_bytes: read only this many bytes from the start of the capture
+        :return: (iq_data, SigMF) or None if the raw capture was not stored
+        """
+        import numpy as np
+        raw_data_file_id = file_record.get("raw_data_file_id")
+        if not ObjectId.is_valid(raw_data_file_id or "") or not ObjectId.is_valid(file_record.get("meta_file_id") or ""):
+            return None
+        sigmf_metadata = SigMF(fs.get(ObjectId(file_record["meta_file_id"])))
+        grid_out = fs.get(ObjectId(raw_data_file_id))
+        iq_bytes = grid_out.read(max_bytes - max_bytes % 8) if max_bytes else grid_out.read()
+        return np.frombuffer(iq_bytes, dtype=np.complex64), sigmf_metadata
+
+    def raw_capture_samples(file_record):
+        """Number of samples in a stored capture, for reserving memory before reading it."""
+        return db.fs.files.find_one({"_id": ObjectId(file_record["raw_data_file_id"])}, {"length": 1})["length"] // 8
+
+    def render_record_plot(file_record, plot_type):
+        """Makes one plot of a stored capture and saves it in GridFS, returning its id."""
+        from plots import TIME_DOMAIN_SAMPLES
+        renderer = plot_renderer()
+        if plot_type == 'time_domain':
+            # Only the first samples are drawn
+            capture = read_raw_capture(file_record, max_bytes=8 * TIME_DOMAIN_SAMPLES)
+            if capture is None:
+                return None
+            with span('plot.time_domain'):
+                png = renderer.time_domain(*capture)
+            return put_file(png, f"{file_record['filename']}_time_domain.png")
+
+        if not ObjectId.is_valid(file_record.get("raw_data_file_id") or ""):
+            return None
+        with memory_budget.reserve(raw_capture_samples(file_record), run_airview=False,
+                                   plot_types=(plot_type,)) as budget:
+            iq_data, sigmf_metadata = read_raw_capture(file_record)
+            decimation = budget["decimation"]
+            with span(f'plot.{plot_type}'):
+                if plot_type == 'spectrogram':
+                    png = renderer.spectrogram(iq_data, sigmf_metadata, decimation)[0]
+                elif plot_type == 'freq_domain':
+                    png = renderer.freq_domain(iq_data, sigmf_metadata, decimation)
+                else:
+                    png = renderer.iq_plot(iq_data)
+        logger.info("Rendered %s of %s on demand", plot_type, file_record["filename"])
+        return put_file(png, f"{file_record['filename']}_{plot_type}.png")
+
+    def render_record_psd(file_record):
+        """Computes a stored capture's PSD from its raw samples and saves it in GridFS, returning its id."""
+        from plots import compute_psd
+        if not ObjectId.is_valid(file_record.get("raw_data_file_id") or ""):
+            return None
+        with memory_budget.reserve(raw_capture_samples(file_record), run_airview=False, plot_types=(),
+                                   run_download=True) as budget:
+            iq_data, sigmf_metadata = read_raw_capture(file_record)
+            with span('psd.compute'):
+                Pxx, freqs, bins = compute_psd(iq_data, sigmf_metadata, budget["decimation"])
+            return save_psd(file_record["filename"], Pxx, freqs, bins)
+
+    def load_spectrogram_db(psd_file_id):
+        """:return: (the stored PSD in dB as time rows by frequency columns, freqs, bins), cached per worker"""
+        key = f"psd:{psd_file_id}"
+        cached = render_cache.get(key)
+        if cached is None:
+            from psd_window import psd_to_db
+            Pxx, freqs, bins = load_psd(psd_file_id)
+            cached = (psd_to_db(Pxx), freqs, bins)
+            render_cache.put(key, cached)
+        return cached
+
+    def render_record_csv(file_record):
+        """Makes a stored capture's Pxx CSV from its saved PSD, or from the raw capture if there is none."""
+        from plots import compute_psd
+        if ObjectId.is_valid(file_record.get("psd_file_id") or ""):
+            return save_pxx_csv(file_record["filename"], *load_psd(file_record["psd_file_id"]))
+        if not ObjectId.is_valid(file_record.get("raw_data_file_id") or ""):
+            return None
+        with memory_budget.reserve(raw_capture_samples(file_record), run_airview=False, plot_types=(),
+                                   run_download=True) as budget:
+            iq_data, sigmf_metadata = read_raw_capture(file_record)
+            with span('psd.compute'):
+                Pxx, freqs, bins = compute_psd(iq_data, sigmf_metadata, budget["decimation"])
+            return save_pxx_csv(file_record["filename"], Pxx, freqs, bins)
+
+    def read_and_hash(stream, size):
+        """
+        Reads an uploaded stream in chunks into one buffer of its size, so the capture
+        is held only once, returning the buffer and its SHA-256 hex digest.
+        """
+        digest = hashlib.sha256()
+        data = bytearray(size)
+        filled = 0
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            data[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+        if filled != size:
+            raise ValueError(f"Read {filled} bytes of an upload of {size}")
+        return data, digest.hexdigest()
+
+    def upload_size(file_storage):
+        """Size in bytes of an uploaded file, which the server has already spooled."""
+        stream = file_storage.stream
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(position)
+        return size
+
+    def rewound(stream):
+        """The stream moved back to its start, so GridFS can copy it chunk by chunk."""
+        stream.seek(0)
+        return stream
 
     def save_pxx_csv(original_name, Pxx, freqs, bins):
-        """Saves the Pxx matrix as a CSV in GridFS."""
-        pxx_csv_data = io.StringIO()
-        csv_writer = csv.writer(pxx_csv_data)
-        
-        csv_writer.writerow(["Frequency (Hz)"] + bins.tolist())
-        for i, freq in enumerate(freqs):
-            csv_writer.writerow([freq] + Pxx[i].tolist())
-
-        pxx_csv_data.seek(0)
-        print("Generated csv")
-
-        return fs.put(pxx_csv_data.getvalue().encode(), filename=f"{original_name}_pxx.csv")
+        """Saves the Pxx matrix as a CSV in GridFS, writing it out in chunks rather than building it whole."""
+        with span('csv.generate'), fs.new_file(filename=f"{original_name}_pxx.csv") as grid_in:
+            pxx_csv_data = io.StringIO()
+            csv_writer = csv.writer(pxx_csv_data)
+
+            csv_writer.writerow(["Frequency (Hz)"] + bins.tolist())
+            for i, freq in enumerate(freqs):
+                csv_writer.writerow([freq] + Pxx[i].tolist())
+                if pxx_csv_data.tell() >= UPLOAD_CHUNK_SIZE:
+                    grid_in.write(pxx_csv_data.getvalue().encode())
+                    pxx_csv_data.seek(0)
+                    pxx_csv_data.truncate()
+            grid_in.write(pxx_csv_data.getvalue().encode())
+        return grid_in._id
     
     @app.route('/file/<file_id>', methods=['DELETE'])
     def delete_file(file_id):
         """Deletes a file and its associated data (plots, Pxx file, metadata)."""
         try:
-            print("DELETING.....")
-            
-            # Retrieve the file record from the database
-            file_record = db.file_records.find_one({"_id": ObjectId(file_id)})
+            if not ObjectId.is_valid(file_id):
+                return jsonify({'error': 'Invalid file ID format'}), 400
+
+            # Retrieve only the artifact ids from the file record
+            file_record = db.file_records.find_one(
+                {"_id": ObjectId(file_id)},
+                {field: 1 for field in ARTIFACT_FIELDS}
+            )
             if not file_record:
-                print("file not found")
                 return jsonify({"error": "File not found"}), 404
-            
-            print("File Record Attributes:")
-            for key, value in file_record.items():
-                print(f"{key}: {value}")
-
-            # Delete PXX file
-            try:
-                print("Attempting to delete associated files...")
-                if file_record['csv_file_id'] != "None":
-                    print(f"Deleting CSV file: {file_record['csv_file_id']}")
-                    fs.delete(ObjectId(file_record["csv_file_id"]))
-                    print("CSV file deleted")
-                
-                if file_record['raw_data_file_id'] is not None:
-                    print(f"Deleting raw data file: {file_record['raw_data_file_id']}")
-                    fs.delete(ObjectId(file_record["iq_plot_file_id"]))
-                    print("IQ plot file deleted")
-
-                if "iq_plot_file_id" in file_record:
-                    print(f"Deleting IQ plot file: {file_record['iq_plot_file_id']}")
-                    fs.delete(ObjectId(file_record["iq_plot_file_id"]))
-                    print("IQ plot file deleted")
-                
-                if "spectrogram_file_id" in file_record:
-                    print(f"Deleting Spectrogram file: {file_record['spectrogram_file_id']}")
-                    fs.delete(ObjectId(file_record["spectrogram_file_id"]))
-                    print("Spectrogram file deleted")
-                
-                if "time_domain_file_id" in file_record:
-                    print(f"Deleting Time Domain file: {file_record['time_domain_file_id']}")
-                    fs.delete(ObjectId(file_record["time_domain_file_id"]))
-                    print("Time Domain file deleted")
-                
-                if "freq_domain_file_id" in file_record:
-                    print(f"Deleting Frequency Domain file: {file_record['freq_domain_file_id']}")
-                    fs.delete(ObjectId(file_record["freq_domain_file_id"]))
-                    print("Frequency Domain file deleted")
-                
-                if "meta_file_id" in file_record:
-                    print(f"Deleting Metadata file: {file_record['meta_file_id']}")
-                    fs.delete(ObjectId(file_record["meta_file_id"]))
-                    print("Metadata file deleted")
-                
-            except gridfs_errors.NoFile:
-                print(f"file not found.")
-
 
+            # Drop the record first: if the artifact delete fails, the garbage collector reclaims them
             db.file_records.delete_one({"_id": ObjectId(file_id)})
+            delete_file_annotations(db, file_id)
+            # Artifacts shared with deduplicated uploads are only freed by their last user
+            release_references(db, artifact_ids(file_record))
 
             return jsonify({"message": f"File with ID {file_id} and its associated data deleted successfully."})
 
         except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            return jsonify({'error': str(e)}), 500
+
+    def encode_cursor(file_record, sort_field):
+        """Encodes the sort value and id of the last listed record as an opaque page cursor."""
+        value = file_record
+        for part in sort_field.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        raw = json_util.dumps({"v": value, "id": file_record["_id"]})
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(cursor):
+        """Inverse of encode_cursor. Raises ValueError on a malformed cursor."""
+        try:
+            decoded = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            return decoded["v"], ObjectId(decoded["id"])
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def parse_bool(value):
+        """Interprets a form or query string flag."""
+        return value.lower() in ('1', 'true', 'yes', 'y')
 
     @app.route('/files', methods=['GET'])
     def get_files():
-        """Lists all stored filenames."""
+        """
+        Lists stored files one page at a time, sorted on an indexed field.
+        Query parameters: limit, cursor (from the previous page's next_cursor),
+        sort (one of SORT_FIELDS), order (asc/desc), q (filename search),
+        has_detections, and min_/max_ bounds on center_frequency and sample_rate.
+        """
         try:
-            print("GETTING FILES")
-            files = list(db.file_records.find({}, {"filename": 1}))
-            print(files)
-            file_list = [{"_id": str(file["_id"]), "filename": file["filename"]} for file in files]
-            return jsonify({"files": file_list})
+            sort = request.args.get('sort', 'uploaded_at')
+            if sort not in SORT_FIELDS:
+                return jsonify({'error': f"Unknown sort field {sort}"}), 400
+            sort_field = SORT_FIELDS[sort]
+            descending = request.args.get('order', 'desc' if sort == 'uploaded_at' else 'asc').lower() == 'desc'
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+
+            filters = []
+            if request.args.get('q'):
+                filters.append({"filename": {"$regex": re.escape(request.args['q']), "$options": "i"}})
+            if request.args.get('has_detections'):
+                filters.append({"has_detections": parse_bool(request.args['has_detections'])})
+            for name in ('center_frequency', 'sample_rate'):
+                bounds = {}
+                if request.args.get(f'min_{name}'):
+                    bounds["$gte"] = float(request.args[f'min_{name}'])
+                if request.args.get(f'max_{name}'):
+                    bounds["$lte"] = float(request.args[f'max_{name}'])
+                if bounds:
+                    filters.append({f"metadata.{name}": bounds})
+
+            if request.args.get('cursor'):
+                # Keyset pagination: resume strictly after the last (sort value, _id) pair
+                last_value, last_id = decode_cursor(request.args['cursor'])
+                op = "$lt" if descending else "$gt"
+                filters.append({"$or": [
+                    {sort_field: {op: last_value}},
+                    {sort_field: last_value, "_id": {op: last_id}},
+                ]})
+
+            from pymongo import ASCENDING, DESCENDING
+            direction = DESCENDING if descending else ASCENDING
+            files = list(
+                db.file_records.find({"$and": filters} if filters else {}, LISTING_PROJECTION)
+                .sort([(sort_field, direction), ("_id", direction)])
+                .limit(limit + 1)
+            )
+            next_cursor = encode_cursor(files[limit - 1], sort_field) if len(files) > limit else None
+
+            file_list = [{
+                "_id": str(file["_id"]),
+                "filename": file["filename"],
+                "uploaded_at": file.get("uploaded_at"),
+                "center_frequency": file.get("metadata", {}).get("center_frequency"),
+                "sample_rate": file.get("metadata", {}).get("sample_rate"),
+                "has_detections": file.get("has_detections", False),
+            } for file in files[:limit]]
+            return jsonify({"files": file_list, "next_cursor": next_cursor})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -409,6 +1115,9 @@ def create_app():
             file_record = db.file_records.find_one({"_id": ObjectId(file_id)})
             if not file_record:
                 return jsonify({'error': 'File not found'}), 404
+            error = ensure_current(file_record)
+            if error:
+                return error
             
             if "max_time" not in file_record:
                 return jsonify({'error': 'max_time not found in record'}), 400
@@ -417,21 +1126,21 @@ def create_app():
             if "max_freq" not in file_record:
                 return jsonify({'error': 'max_freq not found in record'}), 400
             
-            print(f"max time: {file_record.get('max_time')}")
-            print(f"min freq: {file_record.get('min_freq')}")
-            print(f"max freq: {file_record.get('max_freq')}")
-            print(f"annotations: {file_record.get('annotations', [])}")
+            annotations = manual_annotations(file_record)
+            logger.debug("File %s: max time %s, min freq %s, max freq %s, annotations %s", file_id,
+                         file_record.get('max_time'), file_record.get('min_freq'), file_record.get('max_freq'),
+                         annotations)
             
             # Return relevant fields from fileData
             return jsonify({
                 'max_time': file_record.get('max_time'),
                 'min_freq': file_record.get('min_freq'),
                 'max_freq': file_record.get('max_freq'),
-                'annotations': file_record.get('annotations', []), 
-                'airview_annotations': file_record.get("airview_annotations", [])
+                'annotations': annotations, 
+                'airview_annotations': airview_annotations_of(file_record)
             })
         except Exception as e:
-            print(f"Error fetching file data: {str(e)}")
+            logger.exception("Error fetching file data")
             return jsonify({'error': str(e)}), 500
 
     @app.route('/refresh', methods=['POST'])
@@ -439,239 +1148,504 @@ def create_app():
         """Clears all saved files and metadata."""
         try:
             db.file_records.delete_many({})
-            for file in fs.find():
-                fs.delete(file._id)
+            db.annotations.delete_many({})
+            clear_gridfs(db)
+            airview_cache.clear()
+            render_cache.clear()
             return jsonify({'message': 'All files have been cleared.'})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/gc', methods=['GET'])
+    def get_gc_metrics():
+        """Reports orphaned GridFS files and bytes reclaimed by the garbage collector."""
+        return jsonify(garbage_collector.metrics)
+
+    @app.route('/gc', methods=['POST'])
+    def run_gc():
+        """Runs a garbage collection pass immediately and returns the updated metrics."""
+        metrics = garbage_collector.run_once()
+        if metrics["last_error"]:
+            return jsonify(metrics), 500
+        return jsonify(metrics)
+
     @app.route('/file/<file_id>/<plot_type>', methods=['GET'])
     def get_file_plot(file_id, plot_type):
-        """Retrieves a requested plot (spectrogram, time domain, frequency domain, or IQ plot) from GridFS."""
+        """
+        Retrieves a requested plot (spectrogram, time domain, frequency domain, or IQ plot) from GridFS,
+        rendering it first if the upload was lazy.
+        """
         try:
             if not ObjectId.is_valid(file_id):
                 return jsonify({'error': 'Invalid file ID format'}), 400  
+            if plot_type not in PLOT_TYPES:
+                return jsonify({'error': f'{plot_type} file not found'}), 404
 
-            file_record = db.file_records.find_one({"_id": ObjectId(file_id)})
-            if not file_record or f"{plot_type}_file_id" not in file_record:
+            grid_id = ensure_artifact(file_id, plot_type, lambda rec: render_record_plot(rec, plot_type))
+            if grid_id is None:
                 return jsonify({'error': f'{plot_type} file not found'}), 404
 
             # Fetch the file from GridFS
-            plot_file = fs.get(ObjectId(file_record[f"{plot_type}_file_id"]))
+            plot_file = fs.get(grid_id)
             return jsonify({'image': base64.b64encode(plot_file.read()).decode('utf-8')})
 
+        except MemoryBudgetError as e:
+            return jsonify({'error': str(e)}), e.status
         except gridfs_errors.NoFile:
             return jsonify({'error': f'{plot_type} file does not exist in GridFS'}), 404
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
 
-    import json
-
-    @app.route('/metadata/<file_id>', methods=['GET'])
-    def get_metadata(file_id):
-        """Fetch metadata for a given file."""
-        if not ObjectId.is_valid(file_id):
-            return jsonify({'error': 'Invalid file ID format'}), 400  
-
-        file_record = db.file_records.find_one({"_id": ObjectId(file_id)})
-        if not file_record:
-            return jsonify({'error': 'File not found'}), 404
+    def ensure_current(file_record):
+        """
+        Migrates a projected file record in place if it predates the current schema.
+        The projection must include schema_version and meta_file_id.
+        :return: None on success or an error response on failure
+        """
+        if is_current(file_record):
+            return None
 
         # Ensure meta_file_id exists in file_record
         if "meta_file_id" not in file_record:
             return jsonify({'error': 'meta_file_id not found in record'}), 400
 
         try:
-            # Fetch the metadata file from GridFS
-            meta_file = fs.get(ObjectId(file_record["meta_file_id"]))
-
-            # Read and decode metadata
-            meta_content = meta_file.read().decode('utf-8')  # Keep this as a string!
-
-            # Pass the JSON string to SigMF (not a dict!)
-            sigmf_metadata = SigMF(io.StringIO(meta_content))
-
+            file_record.update(migrate_record(db, fs, file_record))
         except gridfs_errors.NoFile:
             return jsonify({'error': 'Metadata file not found in GridFS'}), 404
         except json.JSONDecodeError:
             return jsonify({'error': 'Failed to parse metadata JSON'}), 400
         except Exception as e:
             return jsonify({'error': f'Error processing SigMF: {str(e)}'}), 500
-
-        # Return extracted metadata
-        metadata = {
-            "datatype": sigmf_metadata.datatype,
-            "sample_rate": sigmf_metadata.sample_rate,
-            "author": sigmf_metadata.author,
-            "hardware": sigmf_metadata.hardware,
-            "offset": sigmf_metadata.offset,
-            "recorder": sigmf_metadata.recorder,
-            "datetime": sigmf_metadata.datetime,
-            "center_frequency": sigmf_metadata.center_frequency,
-            "sample_start": sigmf_metadata.sample_start,
-        }
-
-        return jsonify(metadata)
-    
-    # NOTE: Visualization Limitation
-    # The spectrogram visualization may not visibly reflect changes to noise_mean due to 
-    # matplotlib's automatic color scaling. plt.imshow() automatically rescales the colormap
-    # to fit the full range of data in the matrix. This means that changing noise_mean shifts
-    # all values in the matrix but the colors are automatically rescaled to use the same 
-    # visual range regardless of the absolute values. Hoever,the CSV data contains the 
-    # correct numerical values with the specified noise_mean.
-    def generate_data(rows, cols, num_transmitters, transmitter_mean, transmitter_sd, noise_mean, noise_sd, bandwidth, active_time, placement_method):
-        matrix = np.random.normal(loc=noise_mean, scale=noise_sd, size=(rows, cols))
-        """Generate a syntehtic data matrix with Gaussian noise and inject transmitter signals."""
-
-        transmitters = []
-        center_freq = cols // 2  # Center frequency bin
-
-        def is_overlapping(start_time, start_freq):
-            """Check if the new transmitter overlaps with existing ones."""
-            for t_start, f_start in transmitters:
-                if (start_time < t_start + active_time and start_time + active_time > t_start and
-                    start_freq < f_start + bandwidth and start_freq + bandwidth > f_start):
-                    return True
-            return False
-
-        if placement_method == "random":
-            for _ in range(num_transmitters):
-                while True:
-                    start_time = np.random.randint(0, rows - active_time + 1)
-                    start_freq = center_freq - (bandwidth // 2)  # Center the transmitter around the middle frequency
-                    if not is_overlapping(start_time, start_freq):
-                        transmitters.append((start_time, start_freq))
-                        break
-
-        elif placement_method == "equally_spaced":
-            if num_transmitters == 1:
-                # Handle single transmitter case - place it randomly
-                start_time = np.random.randint(0, rows - active_time + 1)
-                start_freq = center_freq - (bandwidth // 2)
-                transmitters.append((start_time, start_freq))
-            else:
-                # Place the first transmitter randomly in the top third of the matrix
-                # NOTE: Change as needed
-                top_third = (rows - active_time) // 3
-                min_position = max(0, top_third // 2)  # Ensure some margin from the very top
-                first_transmitter_pos = np.random.randint(min_position, min_position + top_third)
-                
-                # Add the first transmitter
-                transmitters.append((first_transmitter_pos, center_freq - (bandwidth // 2)))
-                
-                # Calculate available space from first transmitter to bottom of matrix
-                available_space = rows - first_transmitter_pos - active_time
-                
-                # Calculate total number of gaps needed
-                total_gaps = num_transmitters
-                
-                # Calculate the size of each gap to ensure equal spacing
-                gap_size = available_space // total_gaps
-                
-                # Place remaining transmitters with equal gaps
-                for i in range(1, num_transmitters):
-                    start_time = first_transmitter_pos + active_time + (i * gap_size)
-                    start_freq = center_freq - (bandwidth // 2)
-                    transmitters.append((start_time, start_freq))
-
-        # Inject the transmitter signal
-        for start_time, start_freq in transmitters:
-            for t in range(start_time, start_time + active_time):
-                for f in range(start_freq, start_freq + bandwidth):
-                    if 0 <= t < rows and 0 <= f < cols:  # Ensure we're within matrix bounds
-                        signal = np.random.normal(loc=transmitter_mean, scale=transmitter_sd)
-                        matrix[t][f] += signal
-
-        # Generate plot as base64
-        plt.figure(figsize=(10, 6))
-        plt.imshow(matrix, aspect='auto', cmap='viridis')
-        plt.title('Generated Data Matrix')
-        plt.xlabel("Frequency")
-        plt.ylabel("Time")
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close()
-        buf.seek(0)
-        plot_data = base64.b64encode(buf.getvalue()).decode('utf-8')
-        
-        # Generate CSV data
-        csv_data = io.StringIO()
-        csv_writer = csv.writer(csv_data)
-        
-        # Add header row with column indices
-        header = ['Row/Col'] + [str(i) for i in range(cols)]
-        csv_writer.writerow(header)
-        
-        # Add data rows
-        for i in range(rows):
-            row_data = [str(i)] + [str(float(x)) for x in matrix[i]]
-            csv_writer.writerow(row_data)
-        
-        csv_data.seek(0)
-        csv_string = csv_data.getvalue()
-        
-        return plot_data, csv_string
-    
-    @app.route('/file/<file_id>/calculated_statistics', methods=['GET'])
-    def get_calculated_statistics(file_id):
-        """Calculate and return FFT size, sampling frequency, frequency resolution, and row duration."""
+        return None
+
+    def load_record_field(file_id, field):
+        """
+        Fetches one persisted field of a file record with a projected lookup,
+        migrating the record first if it predates the current schema.
+        :return: (value, None) on success or (None, error response) on failure
+        """
+        file_record = db.file_records.find_one(
+            {"_id": ObjectId(file_id)},
+            {field: 1, "schema_version": 1, "meta_file_id": 1}
+        )
+        if not file_record:
+            return None, (jsonify({'error': 'File not found'}), 404)
+
+        error = ensure_current(file_record)
+        if error:
+            return None, error
+        return file_record[field], None
+
+    @app.route('/file/<file_id>/bundle', methods=['GET'])
+    def get_file_bundle(file_id):
+        """
+        Returns everything a tab needs to render a saved file in one response.
+        The optional 'fields' query parameter is a comma separated subset of
+        BUNDLE_FIELDS. Plots are returned as image URLs rather than inline base64.
+        """
         if not ObjectId.is_valid(file_id):
             return jsonify({'error': 'Invalid file ID format'}), 400
 
-        file_record = db.file_records.find_one({"_id": ObjectId(file_id)})
+        fields = [f for f in request.args.get('fields', ','.join(BUNDLE_FIELDS)).split(',') if f]
+        unknown = [f for f in fields if f not in BUNDLE_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Unknown bundle fields: {', '.join(unknown)}"}), 400
+
+        projection = {"schema_version": 1, "meta_file_id": 1}
+        if 'data' in fields:
+            projection.update({k: 1 for k in DATA_FIELDS})
+            # The sample rate converts the annotations' samples to seconds
+            projection["metadata"] = 1
+        if 'metadata' in fields:
+            projection["metadata"] = 1
+        if 'calculated_statistics' in fields:
+            projection["calculated_statistics"] = 1
+        if 'plots' in fields:
+            projection.update({f"{plot_type}_file_id": 1 for plot_type in PLOT_TYPES})
+            projection["raw_data_file_id"] = 1
+
+        file_record = db.file_records.find_one({"_id": ObjectId(file_id)}, projection)
         if not file_record:
             return jsonify({'error': 'File not found'}), 404
 
+        if 'data' in fields or 'metadata' in fields or 'calculated_statistics' in fields:
+            error = ensure_current(file_record)
+            if error:
+                return error
+
+        bundle = {'file_id': file_id}
+        if 'data' in fields:
+            bundle['data'] = {
+                'max_time': file_record.get('max_time'),
+                'min_freq': file_record.get('min_freq'),
+                'max_freq': file_record.get('max_freq'),
+                'annotations': manual_annotations(file_record),
+                'airview_annotations': airview_annotations_of(file_record),
+            }
+        if 'metadata' in fields:
+            bundle['metadata'] = file_record['metadata']
+        if 'calculated_statistics' in fields:
+            bundle['calculated_statistics'] = file_record['calculated_statistics']
+        if 'plots' in fields:
+            # One batched lookup against fs.files confirms which plots actually exist
+            plot_ids = {
+                plot_type: ObjectId(file_record[f"{plot_type}_file_id"])
+                for plot_type in PLOT_TYPES
+                if ObjectId.is_valid(file_record.get(f"{plot_type}_file_id", ""))
+            }
+            stored = {
+                grid_file["_id"]: grid_file["length"]
+                for grid_file in db.fs.files.find({"_id": {"$in": list(plot_ids.values())}}, {"length": 1})
+            }
+            bundle['plots'] = {
+                plot_type: {'url': f"/file/{file_id}/{plot_type}/image", 'length': stored[grid_id]}
+                for plot_type, grid_id in plot_ids.items()
+                if grid_id in stored
+            }
+            # Plots of lazy uploads not rendered yet are made when their URL is first loaded
+            if ObjectId.is_valid(file_record.get("raw_data_file_id") or ""):
+                for plot_type in PLOT_TYPES:
+                    if plot_type not in plot_ids:
+                        bundle['plots'][plot_type] = {'url': f"/file/{file_id}/{plot_type}/image", 'length': None}
+
+        return jsonify(bundle)
+
+    @app.route('/file/<file_id>/<plot_type>/image', methods=['GET'])
+    def get_file_plot_image(file_id, plot_type):
+        """
+        Streams a stored plot as a raw PNG so browsers can load and cache it directly,
+        rendering it first if the upload was lazy.
+        """
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
+        if plot_type not in PLOT_TYPES:
+            return jsonify({'error': f'Unknown plot type {plot_type}'}), 404
+
         try:
-            # Load the metadata
-            meta_file = fs.get(ObjectId(file_record["meta_file_id"]))
-            meta_content = meta_file.read().decode('utf-8')
-            sigmf_metadata = SigMF(io.StringIO(meta_content))
+            grid_id = ensure_artifact(file_id, plot_type, lambda rec: render_record_plot(rec, plot_type))
+        except MemoryBudgetError as e:
+            return jsonify({'error': str(e)}), e.status
+        if grid_id is None:
+            return jsonify({'error': f'{plot_type} file not found'}), 404
 
-            # Parameters
-            sample_rate = sigmf_metadata.sample_rate
-            N = 256
-            freq_resolution = sample_rate / N
-            row_duration = N / sample_rate
+        try:
+            plot_file = fs.get(grid_id)
+        except gridfs_errors.NoFile:
+            return jsonify({'error': f'{plot_type} file does not exist in GridFS'}), 404
 
-            
-            return jsonify({
-                "fft_size": N,
-                "sampling_frequency": sample_rate,
-                "frequency_resolution": freq_resolution,
-                "row_duration": row_duration
-            })
+        # Stored plots never change in place, so the GridFS id doubles as the ETag
+        response = Response(plot_file.read(), mimetype="image/png")
+        response.set_etag(str(grid_id))
+        response.cache_control.private = True
+        response.cache_control.max_age = 3600
+        return response.make_conditional(request)
+
+    def parse_psd_window(args):
+        """
+        Reads the dB range, time/frequency window and size shared by the PSD view endpoints.
+        :return: (dict of the numeric parameters given, None) or (None, error response)
+        """
+        try:
+            window = {name: float(args[name]) for name in ('vmin', 'vmax', 'tmin', 'tmax', 'fmin', 'fmax')
+                      if args.get(name) not in (None, '')}
+            window.update({name: int(args[name]) for name in ('width', 'height')
+                           if args.get(name) not in (None, '')})
+        except ValueError:
+            return None, (jsonify({'error': 'vmin, vmax, tmin, tmax, fmin and fmax must be numbers '
+                                            'and width and height integers'}), 400)
+        if any(not 0 < window[name] <= MAX_RENDER_PIXELS for name in ('width', 'height') if name in window):
+            return None, (jsonify({'error': f'width and height must be between 1 and {MAX_RENDER_PIXELS}'}), 400)
+        return window, None
+
+    def load_psd_window(file_id, window):
+        """
+        Loads a file's PSD in dB, computing and storing it first if the upload did not,
+        and finds the rows and columns inside the requested window.
+        :return: ((PSD GridFS id, dB matrix, freqs, bins, (r0, r1, c0, c1)), None) or (None, error response)
+        """
+        from psd_window import window_indices
+        try:
+            psd_file_id = ensure_artifact(file_id, "psd", render_record_psd)
+        except MemoryBudgetError as e:
+            return None, (jsonify({'error': str(e)}), e.status)
+        if psd_file_id is None:
+            return None, (jsonify({'error': 'The PSD of this file was not stored and its raw capture is unavailable'}), 404)
+        db_matrix, freqs, bins = load_spectrogram_db(psd_file_id)
+        bounds = window_indices(freqs, bins, window.get('tmin'), window.get('tmax'),
+                                window.get('fmin'), window.get('fmax'))
+        r0, r1, c0, c1 = bounds
+        if r0 >= r1 or c0 >= c1:
+            return None, (jsonify({'error': 'The requested window holds no PSD values'}), 400)
+        return (psd_file_id, db_matrix, freqs, bins, bounds), None
+
+    def cacheable(response, key):
+        """Marks a response derived only from a stored PSD and the request parameters as cacheable."""
+        # The response only depends on the stored PSD and the parameters, so their key is the ETag
+        response.set_etag(hashlib.sha1(key.encode()).hexdigest())
+        response.cache_control.private = True
+        response.cache_control.max_age = 3600
+        return response.make_conditional(request)
+
+    @app.route('/file/<file_id>/spectrogram/render', methods=['GET'])
+    def render_spectrogram(file_id):
+        """
+        Re-renders a capture's spectrogram from its stored PSD as a bare image (no axes) with
+        a chosen dB range, colormap and window, without re-running the pipeline. The PSD of
+        a capture uploaded without one is computed from the raw capture on first use.
+        Optional query parameters:
+            vmin, vmax: dB range spread over the colormap (default: the range of the window)
+            cmap: a registered colormap, e.g. accessible_cmap (default: viridis)
+            tmin, tmax: time window in seconds; fmin, fmax: frequency window in Hz
+            width, height: image size in pixels (default: one pixel per PSD value, up to
+                           MAX_RENDER_PIXELS, keeping the strongest value of each block beyond it)
+        The dB range used is returned in the X-Vmin and X-Vmax headers and the image size in
+        X-Render-Shape (height,width).
+        """
+        import matplotlib
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
+        window, error = parse_psd_window(request.args)
+        if error:
+            return error
+        import plots
+        # accessible_cmap exists only once registered, which a fresh worker may not have done yet
+        plots.register_colormaps()
+        cmap = request.args.get('cmap', 'viridis')
+        if cmap not in matplotlib.colormaps:
+            return jsonify({'error': f'Unknown colormap {cmap}'}), 400
+
+        psd, error = load_psd_window(file_id, window)
+        if error:
+            return error
+        psd_file_id, db_matrix, _, _, (r0, r1, c0, c1) = psd
+        height = window.get('height', min(r1 - r0, MAX_RENDER_PIXELS))
+        width = window.get('width', min(c1 - c0, MAX_RENDER_PIXELS))
+        key = (f"render:{psd_file_id}:{r0}:{r1}:{c0}:{c1}:{height}:{width}:{cmap}:"
+               f"{window.get('vmin')}:{window.get('vmax')}:{png_options['compress_level']}")
+
+        cached = render_cache.get(key)
+        if cached is None:
+            from psd_window import db_range, max_pool, resample_nearest
+            with span('plot.rerender'):
+                # Windows too large to draw one pixel per value keep the strongest value of each block
+                region = max_pool(db_matrix[r0:r1, c0:c1], MAX_RENDER_PIXELS, MAX_RENDER_PIXELS)
+                if (height, width) != region.shape:
+                    region = resample_nearest(region, height, width)
+                low, high = db_range(region)
+                vmin, vmax = window.get('vmin', low), window.get('vmax', high)
+                png = plots.render_db_png(region, vmin, vmax, cmap, png_options['compress_level'])
+            cached = (png, vmin, vmax)
+            render_cache.put(key, cached)
+        png, vmin, vmax = cached
+
+        response = Response(png, mimetype="image/png")
+        response.headers['X-Vmin'] = str(vmin)
+        response.headers['X-Vmax'] = str(vmax)
+        response.headers['X-Render-Shape'] = f"{height},{width}"
+        return cacheable(response, key)
+
+    @app.route('/file/<file_id>/psd', methods=['GET'])
+    def get_psd_window(file_id):
+        """
+        Returns a time/frequency window of a capture's stored PSD as a compact binary array for
+        the client to draw and recolor itself: row-major, one row per time bin (earliest first)
+        and one column per frequency bin (lowest first), quantized to dB levels.
+        Optional query parameters:
+            dtype: uint8 (default) or uint16 (little endian)
+            vmin, vmax: dB range the levels span (default: the range of the window)
+            tmin, tmax: time window in seconds; fmin, fmax: frequency window in Hz
+            width, height: largest number of columns and rows (default: MAX_RENDER_PIXELS); larger
+                           windows are reduced by keeping the strongest value of each block
+        Headers describe the payload: X-Psd-Shape (rows,columns), X-Psd-Dtype, X-Psd-Scale and
+        X-Psd-Offset (a level q > 0 is q * scale + offset dB; 0 means no power) and X-Psd-Window
+        (tmin,tmax,fmin,fmax of the first and last bins returned).
+        """
+        from psd_window import QUANTIZED_DTYPES, db_range, max_pool, quantize
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
+        window, error = parse_psd_window(request.args)
+        if error:
+            return error
+        dtype = request.args.get('dtype', 'uint8')
+        if dtype not in QUANTIZED_DTYPES:
+            return jsonify({'error': f"dtype must be one of {', '.join(QUANTIZED_DTYPES)}"}), 400
+
+        psd, error = load_psd_window(file_id, window)
+        if error:
+            return error
+        psd_file_id, db_matrix, freqs, bins, (r0, r1, c0, c1) = psd
+        height = window.get('height', min(r1 - r0, MAX_RENDER_PIXELS))
+        width = window.get('width', min(c1 - c0, MAX_RENDER_PIXELS))
+        key = f"window:{psd_file_id}:{r0}:{r1}:{c0}:{c1}:{height}:{width}:{dtype}:{window.get('vmin')}:{window.get('vmax')}"
+
+        cached = render_cache.get(key)
+        if cached is None:
+            with span('psd.window'):
+                region = max_pool(db_matrix[r0:r1, c0:c1], height, width)
+                low, high = db_range(region)
+                levels, scale, offset = quantize(region, QUANTIZED_DTYPES[dtype],
+                                                 window.get('vmin', low), window.get('vmax', high))
+            cached = (levels.tobytes(), levels.shape, scale, offset)
+            render_cache.put(key, cached)
+        payload, shape, scale, offset = cached
+
+        response = Response(payload, mimetype="application/octet-stream")
+        response.headers['X-Psd-Shape'] = f"{shape[0]},{shape[1]}"
+        response.headers['X-Psd-Dtype'] = dtype
+        response.headers['X-Psd-Scale'] = repr(scale)
+        response.headers['X-Psd-Offset'] = repr(offset)
+        response.headers['X-Psd-Window'] = ",".join(repr(float(edge)) for edge in (bins[r0], bins[r1 - 1], freqs[c0], freqs[c1 - 1]))
+        return cacheable(response, key)
 
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+    @app.route('/metadata/<file_id>', methods=['GET'])
+    def get_metadata(file_id):
+        """Fetch metadata for a given file."""
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400  
+
+        metadata, error = load_record_field(file_id, "metadata")
+        if error:
+            return error
+        return jsonify(metadata)
+    
+    @app.route('/file/<file_id>/calculated_statistics', methods=['GET'])
+    def get_calculated_statistics(file_id):
+        """Return the persisted FFT size, sampling frequency, frequency resolution, and row duration."""
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'error': 'Invalid file ID format'}), 400
+
+        calculated_statistics, error = load_record_field(file_id, "calculated_statistics")
+        if error:
+            return error
+        return jsonify(calculated_statistics)
+
+    def parse_generate_spec(data):
+        """
+        Reads the /generate parameters into generator arguments.
+        Raises KeyError for a missing parameter and TypeError/ValueError for a bad one.
+        """
+        spec = {name: cast(data[key]) for key, (name, cast) in GENERATE_PARAMS.items()}
+        spec['frequency_positions'] = [int(p) for p in data.get('frequencyPositions') or []] or None
+        # An unseeded request gets a fresh seed, returned so the matrix can be regenerated
+        from synthetic import MAX_SEED, new_seed
+        spec['seed'] = new_seed() if data.get('seed') is None else int(data['seed'])
+        if not 0 <= spec['seed'] <= MAX_SEED:
+            raise ValueError(f"Seed must be between 0 and {MAX_SEED}")
+        check_generate_size(spec)
+        return spec
+
+    def check_generate_size(spec):
+        """Raises ValueError if the matrix is larger than MAX_GENERATE_CELLS."""
+        if spec['rows'] * spec['cols'] > MAX_GENERATE_CELLS:
+            raise ValueError(f"The matrix may have at most {MAX_GENERATE_CELLS} cells (rows * cols)")
+
+    def encode_spec(spec):
+        """Encodes generator arguments as the token the /generate/<output> URLs carry."""
+        return base64.urlsafe_b64encode(json.dumps(spec).encode()).decode()
+
+    def decode_spec(token):
+        """Inverse of encode_spec. Raises ValueError on a malformed token."""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            spec = {name: cast(data[name]) for name, cast in GENERATE_PARAMS.values()}
+            spec['frequency_positions'] = data.get('frequency_positions')
+            spec['seed'] = int(data['seed'])
+        except Exception:
+            raise ValueError("Invalid spec")
+        # Tokens are client-controlled, so they are held to the same limit as /generate
+        check_generate_size(spec)
+        return spec
+
+    def generated_filename(spec, extension):
+        return f"{spec['placement_method']}_transmitters_{spec['num_transmitters']}_{spec['seed']}.{extension}"
+
+    def stream_matrix_csv(spec):
+        """Yields the matrix as CSV text one block of rows at a time."""
+        from synthetic import iter_matrix_rows
+        # Add header row with column indices
+        yield ','.join(['Row/Col'] + [str(i) for i in range(spec['cols'])]) + '\r\n'
+        for r0, block in iter_matrix_rows(**spec):
+            # repr() of a Python float matches the str(float(x)) formatting of the old CSV
+            yield ''.join(f"{r0 + i},{','.join(map(repr, row))}\r\n" for i, row in enumerate(block.tolist()))
+
+    def stream_matrix_npy(spec):
+        """Yields the matrix as a float32 .npy file one block of rows at a time."""
+        import numpy as np
+        from synthetic import iter_matrix_rows
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype('<f4')),
+            'fortran_order': False,
+            'shape': (spec['rows'], spec['cols']),
+        })
+        yield header.getvalue()
+        for _, block in iter_matrix_rows(**spec):
+            yield block.astype('<f4').tobytes()
 
     @app.route('/generate', methods=['POST'])
     def generate_data_endpoint():
-        """High level function for generating spectrogram"""
-        data = request.json
-        rows = data['rows']
-        cols = data['cols']
-        num_transmitters = data['numTransmitters']
-        transmitter_mean = data['transmitterMean']
-        transmitter_sd = data['transmitterSd']
-        noise_mean = data['noiseMean']
-        noise_sd = data['noiseSd']
-        bandwidth = data['bandwidth']
-        active_time = data['activeTime']
-        placement_method = data['placementMethod']
+        """
+        Places the transmitters of a synthetic data matrix and returns them along with the
+        seed and URLs of the matrix as a PNG, a streamed CSV and a float32 .npy file. The
+        matrix itself is only produced, block by block, when one of those URLs is fetched.
+        """
+        from synthetic import place_transmitters
+        data = request.json or {}
+        try:
+            spec = parse_generate_spec(data)
+            transmitters = place_transmitters(spec['rows'], spec['cols'], spec['num_transmitters'],
+                                              spec['bandwidth'], spec['active_time'], spec['placement_method'],
+                                              spec['frequency_positions'], spec['seed'])
+        except KeyError as e:
+            return jsonify({'error': f"Missing parameter {e.args[0]}"}), 400
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        token = encode_spec(spec)
+        return jsonify({
+            'seed': spec['seed'],
+            'rows': spec['rows'],
+            'cols': spec['cols'],
+            'transmitters': [{
+                'start_time': start_time,
+                'end_time': start_time + spec['active_time'],
+                'start_freq': start_freq,
+                'end_freq': start_freq + spec['bandwidth'],
+            } for start_time, start_freq in transmitters],
+            **{f'{output}_url': f'/generate/{output}?spec={token}' for output in GENERATE_OUTPUTS},
+        })
 
+    @app.route('/generate/<output>', methods=['GET'])
+    def get_generated_output(output):
+        """Regenerates a matrix from its spec token and returns it as a PNG, CSV or .npy file."""
+        from synthetic import place_transmitters
+        if output not in GENERATE_OUTPUTS:
+            return jsonify({'error': f"Unknown output {output}"}), 400
         try:
-            plot_data, csv_data = generate_data(rows, cols, num_transmitters, transmitter_mean, transmitter_sd, noise_mean, noise_sd,
-                                    bandwidth, active_time, placement_method)
-            return jsonify({
-                'plot': plot_data,
-                'csv': csv_data
-            })
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-        
+            spec = decode_spec(request.args.get('spec', ''))
+            # The CSV and .npy are streamed, so the spec is checked before the response starts
+            place_transmitters(spec['rows'], spec['cols'], spec['num_transmitters'], spec['bandwidth'],
+                               spec['active_time'], spec['placement_method'], spec['frequency_positions'],
+                               spec['seed'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if output == 'png':
+            import plots
+            from synthetic import preview_matrix
+            try:
+                matrix = preview_matrix(*GENERATE_PREVIEW_SHAPE, **spec)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return Response(render_plot(plots.plot_matrix(matrix)), mimetype='image/png')
+
+        disposition = {'Content-Disposition': f"attachment; filename={generated_filename(spec, output)}"}
+        if output == 'csv':
+            return Response(stream_matrix_csv(spec), mimetype='text/csv', headers=disposition)
+        return Response(stream_matrix_npy(spec), mimetype='application/octet-stream', headers=disposition)
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,353 @@
+"""
+CS-410: Batch AirVIEW detection over many captures with a process pool
+@file batch_airview.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Usage: python batch_airview.py [CAPTURE ...] [--file-ids ID ...] [--all-files]
+           [--auto-params | --beta B --scale S] [--row-average N] [--workers N]
+           [--output {sidecar,records}] [--output-dir DIR] [--manifest FILE] [--force]
+Each CAPTURE is a directory, a glob or a .sigmf-meta file; its samples are read from the
+.sigmf-data or .cfile (cf32_le) next to it. --file-ids and --all-files pick captures
+uploaded to the app instead, read from MongoDB (MONGO_URI, MONGO_DB).
+
+Every capture is analyzed in its own task on a pool of one process per core, with the
+samples memory-mapped rather than read into each worker. Detections of local captures
+replace the AirVIEW annotations of their .sigmf-meta (or of a copy in --output-dir, under
+the captures' directories relative to the one they share); those of uploaded captures are
+saved on their file records like a re-analysis from the app, or written to --output-dir as
+FILENAME.FILE_ID.sigmf-meta with --output sidecar. Two captures never write the same file.
+
+Each finished capture is appended to the manifest as a JSON line, so an interrupted
+run picks up where it stopped; captures already done with the same parameters (and,
+for local captures, unchanged samples) are skipped unless --force is given.
+"""
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+# Extensions of the sample file next to a .sigmf-meta, in order of preference
+DATA_EXTENSIONS = (".sigmf-data", ".cfile")
+# Marks the annotations written by this command so a re-run replaces them
+GENERATOR = "AirVIEW"
+DEFAULT_MANIFEST = "airview_batch_manifest.jsonl"
+# Captures are spooled from GridFS and hashed in chunks of this many bytes
+CHUNK_SIZE = 1 << 20
+
+# Per-process MongoDB connection of the workers, opened on first use
+_mongo = None
+
+
+def mongo():
+    global _mongo
+    if _mongo is None:
+        from mongo import MongoConnection
+        _mongo = MongoConnection.from_env()
+    return _mongo
+
+
+def local_captures(patterns):
+    """
+    The captures named by directories, globs or .sigmf-meta paths, as (meta path, data path) pairs.
+    :raises FileNotFoundError: if a pattern matches nothing or a capture has no sample file
+    """
+    captures = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(glob.escape(pattern), "**", "*.sigmf-meta"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        if not matches:
+            raise FileNotFoundError(f"No captures match {pattern}")
+        for path in matches:
+            base = os.path.abspath(path)
+            for extension in (".sigmf-meta",) + DATA_EXTENSIONS:
+                if base.endswith(extension):
+                    base = base[:-len(extension)]
+                    break
+            else:
+                continue
+            data_path = next((base + ext for ext in DATA_EXTENSIONS if os.path.exists(base + ext)), None)
+            if data_path is None:
+                raise FileNotFoundError(f"No {' or '.join(DATA_EXTENSIONS)} file next to {base}.sigmf-meta")
+            captures[base + ".sigmf-meta"] = data_path
+    return sorted(captures.items())
+
+
+def make_jobs(args):
+    """
+    One job per capture, largest first so the pool does not finish on a single long capture.
+    :raises FileNotFoundError: if a capture or file id does not exist
+    :raises ValueError: if two captures would write the same .sigmf-meta
+    """
+    params = {"auto_params": args.auto_params, "beta": args.beta, "scale": args.scale,
+              "row_average": args.row_average}
+    jobs = []
+    captures = local_captures(args.captures)
+    # Copies in --output-dir keep the captures' directories below the deepest one they share
+    root = os.path.commonpath([os.path.dirname(meta_path) for meta_path, _ in captures]) if captures else None
+    for meta_path, data_path in captures:
+        stat = os.stat(data_path)
+        output_path = meta_path
+        if args.output_dir:
+            output_path = os.path.join(args.output_dir, os.path.relpath(meta_path, root))
+        jobs.append({
+            "key": f"path:{meta_path}", "meta_path": meta_path, "data_path": data_path,
+            "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "output": "sidecar", "output_path": output_path,
+            "params": params, "cache": args.cache,
+        })
+
+    if args.file_ids or args.all_files:
+        from bson import ObjectId
+        invalid = [file_id for file_id in args.file_ids if not ObjectId.is_valid(file_id)]
+        if invalid:
+            raise FileNotFoundError(f"Invalid file id {', '.join(invalid)}")
+        query = {} if args.all_files else {"_id": {"$in": [ObjectId(file_id) for file_id in args.file_ids]}}
+        db = mongo().get_db()
+        # Files uploaded before raw captures were kept cannot be re-analyzed
+        records = [record for record in db.file_records.find(query, {"filename": 1, "raw_data_file_id": 1})
+                   if ObjectId.is_valid(record.get("raw_data_file_id") or "")]
+        missing = set(args.file_ids) - {str(record["_id"]) for record in records}
+        if missing:
+            raise FileNotFoundError(f"No uploaded file with a stored capture has id {', '.join(sorted(missing))}")
+        for record in records:
+            raw = db.fs.files.find_one({"_id": ObjectId(record["raw_data_file_id"])}, {"length": 1})
+            file_id = str(record["_id"])
+            output_path = None
+            if args.output == "sidecar":
+                # Uploads may share a filename, so the name also carries the file id
+                name = f"{record['filename']}.{file_id}" if record.get("filename") else file_id
+                output_path = os.path.join(args.output_dir, f"{name}.sigmf-meta")
+            jobs.append({
+                "key": f"file:{file_id}", "file_id": file_id, "size": raw["length"] if raw else 0,
+                "output": args.output, "output_path": output_path, "params": params, "cache": args.cache,
+                "scratch_dir": args.scratch_dir,
+            })
+
+    outputs = {}
+    for job in jobs:
+        if job["output_path"] is None:
+            continue
+        output_path = os.path.abspath(job["output_path"])
+        if output_path in outputs:
+            raise ValueError(f"{outputs[output_path]} and {job['key']} would both write {output_path}")
+        outputs[output_path] = job["key"]
+    return sorted(jobs, key=lambda job: -job["size"])
+
+
+def read_manifest(path):
+    """The last manifest entry of every capture key."""
+    entries = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    entries[entry["key"]] = entry
+    return entries
+
+
+def is_done(job, entry):
+    """True if the manifest entry records this job finishing with the same parameters and samples."""
+    return (entry is not None and entry["status"] == "done" and entry["params"] == job["params"]
+            and entry.get("size") == job["size"] and entry.get("mtime_ns") == job.get("mtime_ns"))
+
+
+def write_sidecar(meta, table, path):
+    """Writes the metadata with its AirVIEW annotations replaced by the detections."""
+    import detections
+    kept = [annotation for annotation in meta.get("annotations", []) if annotation.get("core:generator") != GENERATOR]
+    found = [dict(annotation, **{"core:generator": GENERATOR}) for annotation in detections.to_sigmf(table)]
+    meta = dict(meta, annotations=kept + found)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Write to a temporary file first so an interrupted run never leaves a truncated .sigmf-meta
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def spool_capture(grid_out, scratch_dir):
+    """
+    Copies a stored capture to a local file so it can be memory-mapped.
+    :return: (path of the copy, SHA-256 of the samples)
+    """
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix=".cfile", dir=scratch_dir)
+    with os.fdopen(fd, "wb") as f:
+        for chunk in iter(lambda: grid_out.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    return path, digest.hexdigest()
+
+
+def map_samples(path):
+    """The cf32_le samples of a file, memory-mapped read-only."""
+    import numpy as np
+    num_samples = os.path.getsize(path) // 8
+    if not num_samples:
+        return np.empty(0, dtype=np.complex64)
+    return np.memmap(path, dtype=np.complex64, mode="r", shape=(num_samples,))
+
+
+def analyze(samples, sample_rate, center_frequency, params, data_hash=None, use_cache=False):
+    """:return: (detection table, beta used, scale used)"""
+    from airview import detect
+    cache = None
+    if use_cache:
+        from airview_cache import AirviewCache, DEFAULT_CACHE_DIR
+        cache = AirviewCache(mongo().get_db(), directory=os.environ.get("AIRVIEW_CACHE_DIR", DEFAULT_CACHE_DIR),
+                             max_bytes=int(os.environ.get("AIRVIEW_CACHE_MAX_BYTES", 2 << 30)))
+    return detect(samples, sample_rate, center_frequency, params["auto_params"], params["beta"], params["scale"],
+                  params["row_average"], cache=cache, data_hash=data_hash)
+
+
+def process_local(job):
+    from SigMF import SigMF
+    with open(job["meta_path"]) as f:
+        meta_text = f.read()
+    sigmf_metadata = SigMF(io.StringIO(meta_text))
+    if sigmf_metadata.datatype not in (None, "cf32_le"):
+        raise ValueError(f"Unsupported datatype {sigmf_metadata.datatype}; only cf32_le captures can be analyzed")
+    data_hash = file_sha256(job["data_path"]) if job["cache"] else None
+    table, beta, scale = analyze(map_samples(job["data_path"]), sigmf_metadata.sample_rate,
+                                 sigmf_metadata.center_frequency, job["params"], data_hash, job["cache"])
+    write_sidecar(json.loads(meta_text), table, job["output_path"])
+    return table, beta, scale
+
+
+def process_stored(job):
+    import detections
+    from bson import ObjectId
+    from annotation_store import from_detections, replace_annotations
+    from SigMF import SigMF
+    db, fs = mongo().get_db(), mongo().get_fs()
+    record = db.file_records.find_one({"_id": ObjectId(job["file_id"])},
+                                      {"raw_data_file_id": 1, "meta_file_id": 1, "iq_sha256": 1})
+    if record is None:
+        raise LookupError("File not found")
+    meta_bytes = fs.get(ObjectId(record["meta_file_id"])).read()
+    sigmf_metadata = SigMF(io.BytesIO(meta_bytes))
+
+    path, iq_sha256 = spool_capture(fs.get(ObjectId(record["raw_data_file_id"])), job["scratch_dir"])
+    try:
+        table, beta, scale = analyze(map_samples(path), sigmf_metadata.sample_rate, sigmf_metadata.center_frequency,
+                                     job["params"], iq_sha256, job["cache"])
+    finally:
+        os.remove(path)
+
+    if job["output"] == "sidecar":
+        write_sidecar(json.loads(meta_bytes), table, job["output_path"])
+    else:
+        params = job["params"]
+        airview_params = {"auto_params": params["auto_params"], "beta": beta, "scale": scale,
+                          "row_average": params["row_average"]}
+        db.file_records.update_one({"_id": record["_id"]}, {"$set": {
+            **detections.record_fields(table),
+            "airview_params": airview_params,
+            "iq_sha256": iq_sha256,
+        }})
+        replace_annotations(db, record["_id"], "airview", from_detections(table))
+    return table, beta, scale
+
+
+def process_capture(job):
+    """
+    Runs in a pool worker. Failures are reported in the result rather than raised,
+    so one bad capture does not stop the batch.
+    :return: the manifest entry of the job
+    """
+    start = time.perf_counter()
+    entry = {key: job.get(key) for key in ("key", "size", "mtime_ns", "params", "output_path")}
+    try:
+        table, beta, scale = (process_stored if "file_id" in job else process_local)(job)
+        entry.update(status="done", detections=len(table), beta_used=beta, scale_used=scale)
+    except Exception as e:
+        entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    entry["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return entry
+
+
+def run(jobs, workers, manifest_path):
+    """
+    Processes the jobs on a pool of worker processes, appending each result to the manifest.
+    :return: number of failed jobs
+    """
+    failed = 0
+    with open(manifest_path, "a") as manifest, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_capture, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            # Flushed and synced per capture so a crash loses at most the captures still running
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            if entry["status"] == "done":
+                print(f"[{done}/{len(jobs)}] {entry['key']}: {entry['detections']} detection(s) with beta "
+                      f"{entry['beta_used']} scale {entry['scale_used']} in {entry['seconds']:.1f}s")
+            else:
+                failed += 1
+                print(f"[{done}/{len(jobs)}] {entry['key']}: {entry['error']}", file=sys.stderr)
+    return failed
+
+
+if __name__ == "__main__":
+    from airview import Plugin
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captures", nargs="*", help="directories, globs or .sigmf-meta files of local captures")
+    parser.add_argument("--file-ids", nargs="+", default=[], help="ids of uploaded files to analyze")
+    parser.add_argument("--all-files", action="store_true", help="analyze every uploaded file with a stored capture")
+    parser.add_argument("--auto-params", action="store_true", help="find the optimal beta and scale of each capture")
+    parser.add_argument("--beta", type=float, default=Plugin.beta)
+    parser.add_argument("--scale", type=int, default=Plugin.scale)
+    parser.add_argument("--row-average", type=int, default=1, help="FFTs averaged into each spectrogram row")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per core)")
+    parser.add_argument("--output", choices=("records", "sidecar"), default="records",
+                        help="where detections of uploaded files go; local captures always get .sigmf-meta files")
+    parser.add_argument("--output-dir", help="write .sigmf-meta files here instead of updating them in place")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="checkpoint manifest (JSON lines)")
+    parser.add_argument("--force", action="store_true", help="re-run captures the manifest lists as done")
+    parser.add_argument("--cache", action="store_true",
+                        help="share spectrograms and results through the app's AirVIEW cache (needs MongoDB)")
+    parser.add_argument("--scratch-dir", default=tempfile.gettempdir(),
+                        help="where uploaded captures are copied to be memory-mapped")
+    args = parser.parse_args()
+
+    if not (args.captures or args.file_ids or args.all_files):
+        parser.error("give captures, --file-ids or --all-files")
+    if (args.file_ids or args.all_files) and args.output == "sidecar" and not args.output_dir:
+        parser.error("--output sidecar needs --output-dir for uploaded files")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    try:
+        jobs = make_jobs(args)
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+    finished = read_manifest(args.manifest)
+    pending = [job for job in jobs if args.force or not is_done(job, finished.get(job["key"]))]
+    print(f"{len(jobs)} capture(s), {len(jobs) - len(pending)} already done, {len(pending)} to analyze "
+          f"on {min(args.workers, len(pending))} worker(s)")
+    failed = run(pending, min(args.workers, len(pending)), args.manifest) if pending else 0
+    if failed:
+        print(f"{failed} capture(s) failed; re-run the same command to retry them", file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,193 @@
+"""
+CS-410: AirVIEW throughput and detection quality benchmark over synthetic workloads
+@file benchmark_airview.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Usage: python benchmark_airview.py [--rows N ...] [--fft-sizes N ...] [--densities N ...]
+           [--snrs DB ...] [--repeat N] [--optimize] [--output FILE] [--baseline FILE]
+Runs findTransmitters (and with --optimize, findOptimalParams) on every combination of
+the given spectrogram rows, FFT sizes, transmitter densities and SNRs. Each workload runs
+in its own process so its peak memory is measured in isolation. With --baseline, prints
+how each workload changed against an earlier --output file.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import numpy as np
+
+import airview
+import synthetic_iq
+from instrumentation import finish_request, start_request
+
+SAMPLE_RATE = 8e6
+CENTER_FREQUENCY = 915e6
+JACCARD_THRESHOLD = 0.5
+MAX_GAP_ROWS = 0
+# Spans recorded by findTransmittersMultiScale and the stage each one is reported as
+STAGE_SPANS = {"airview.threshold": "threshold", "airview.tracking": "tracking"}
+
+
+def workload_emitters(rng, duration, density, snr_db):
+    """Bursty QPSK transmitters at the given SNR spread over the band and the capture."""
+    emitters = synthetic_iq.random_emitters(rng, SAMPLE_RATE, duration, num_tones=0, num_bursts=density)
+    for emitter in emitters:
+        emitter["snr_db"] = snr_db
+    return emitters
+
+
+def ground_truth(emitters, num_samples, fft_size):
+    """The emitters' annotations as Transmitters in spectrogram rows and columns."""
+    transmitters = []
+    for annotation in synthetic_iq.annotations(emitters, SAMPLE_RATE, CENTER_FREQUENCY, num_samples):
+        # Inverse of the column to frequency mapping in Plugin.run
+        cols = [int(np.clip((annotation[edge] - CENTER_FREQUENCY + SAMPLE_RATE / 2) / SAMPLE_RATE * fft_size,
+                            0, fft_size - 1))
+                for edge in ("core:freq_lower_edge", "core:freq_upper_edge")]
+        start = annotation["core:sample_start"]
+        end = start + annotation["core:sample_count"] - 1
+        transmitters.append(airview.Transmitter(start // fft_size, end // fft_size, *cols))
+    return transmitters
+
+
+def find_transmitters_timed(spectrogram, coarse, scale, beta, stage_seconds):
+    """
+    findTransmitters with its per-row thresholding (coarseDetection) and tracking
+    (updateTransmitters) times read from the spans findTransmittersMultiScale records.
+    """
+    start_request()
+    try:
+        transmitters = airview.findTransmitters(spectrogram, scale, beta, JACCARD_THRESHOLD, MAX_GAP_ROWS,
+                                                spectrogram.shape[1], coarse=coarse)
+    finally:
+        spans = finish_request()
+    for stage, seconds in spans:
+        if stage in STAGE_SPANS:
+            stage_seconds[STAGE_SPANS[stage]] += seconds
+    return transmitters
+
+
+def run_workload(workload):
+    """Runs one workload and returns its measurements. Meant to run in a fresh process."""
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rows, fft_size = workload["rows"], workload["fft_size"]
+    num_samples = rows * fft_size
+    rng = np.random.default_rng(workload["seed"])
+    emitters = workload_emitters(rng, num_samples / SAMPLE_RATE, workload["density"], workload["snr_db"])
+    samples = np.concatenate(list(synthetic_iq.iter_iq(emitters, SAMPLE_RATE, num_samples, synthetic_iq.NOISE_POWER,
+                                                       workload["seed"])))
+    truth = ground_truth(emitters, num_samples, fft_size)
+
+    # Keep the fastest of the repeats, the one least disturbed by the rest of the machine
+    stage_seconds = None
+    for _ in range(workload["repeat"]):
+        seconds = {"transform": 0.0, "regions": 0.0, "threshold": 0.0, "tracking": 0.0}
+        started = time.perf_counter()
+        spectrogram = airview.computeSpectrogram(samples, fft_size)
+        seconds["transform"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        coarse = airview.findAvgAdjDiffCoarse(spectrogram, *airview.coarseScales(spectrogram, workload["scale"]))
+        seconds["regions"] = time.perf_counter() - started
+
+        detected = find_transmitters_timed(spectrogram, coarse, workload["scale"], workload["beta"], seconds)
+        if stage_seconds is None or sum(seconds.values()) < sum(stage_seconds.values()):
+            stage_seconds = seconds
+
+    # Plugin.run drops transmitters that only span a single row
+    detected = [tx for tx in detected if tx.end_row > tx.start_row]
+    detection_seconds = sum(stage_seconds.values())
+
+    result = dict(workload)
+    result.update({
+        "seconds": detection_seconds,
+        "rows_per_second": rows / detection_seconds,
+        "stage_seconds": stage_seconds,
+        "truth_count": len(truth),
+        "detected_count": len(detected),
+        # Mean best frequency overlap of each detection with the truth, and of each true transmission with a detection
+        "jaccard_detected": airview.avgJS(detected, truth),
+        "jaccard_truth": airview.avgJS(truth, detected),
+    })
+
+    if workload["optimize"]:
+        started = time.perf_counter()
+        beta, scale = airview.findOptimalParams(spectrogram)
+        result["optimize_seconds"] = time.perf_counter() - started
+        result["optimal_beta_scale"] = [beta, scale]
+
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = peak_rss / 1024
+    result["rss_growth_mb"] = (peak_rss - baseline_rss) / 1024
+    return result
+
+
+def workload_key(result):
+    return (result["rows"], result["fft_size"], result["density"], result["snr_db"])
+
+
+def compare(results, baseline_path):
+    """Prints rows/s and quality changes against a previous run's results."""
+    with open(baseline_path) as f:
+        baseline = {workload_key(r): r for r in json.load(f)["results"]}
+    print(f"\nAgainst {baseline_path}:")
+    for result in results:
+        before = baseline.get(workload_key(result))
+        if before is None:
+            continue
+        print(f"  rows={result['rows']:>5} fft={result['fft_size']:>5} density={result['density']:>3} "
+              f"snr={result['snr_db']:>5}: speed x{result['rows_per_second'] / before['rows_per_second']:.2f}, "
+              f"jaccard {result['jaccard_detected'] - before['jaccard_detected']:+.3f} / "
+              f"{result['jaccard_truth'] - before['jaccard_truth']:+.3f}, "
+              f"detections {before['detected_count']} -> {result['detected_count']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[256, 1024], help="spectrogram rows")
+    parser.add_argument("--fft-sizes", type=int, nargs="+", default=[1024], help="spectrogram columns")
+    parser.add_argument("--densities", type=int, nargs="+", default=[2, 8], help="burst transmitters per capture")
+    parser.add_argument("--snrs", type=float, nargs="+", default=[0.0, 10.0], help="per-sample SNR in dB")
+    parser.add_argument("--beta", type=float, default=airview.Plugin.beta)
+    parser.add_argument("--scale", type=int, default=airview.Plugin.scale)
+    parser.add_argument("--repeat", type=int, default=1, help="time each workload this many times and keep the fastest")
+    parser.add_argument("--optimize", action="store_true", help="also time findOptimalParams")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    workloads = [{
+        "rows": rows, "fft_size": fft_size, "density": density, "snr_db": snr_db,
+        "beta": args.beta, "scale": args.scale, "optimize": args.optimize, "seed": args.seed,
+        "repeat": max(args.repeat, 1),
+    } for rows, fft_size, density, snr_db in itertools.product(args.rows, args.fft_sizes, args.densities, args.snrs)]
+
+    results = []
+    # One process per workload so memory peaks do not carry over between workloads
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_workload, workloads):
+            results.append(result)
+            print(f"rows={result['rows']:>5} fft={result['fft_size']:>5} density={result['density']:>3} "
+                  f"snr={result['snr_db']:>5}: {result['rows_per_second']:8.1f} rows/s "
+                  f"({', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in result['stage_seconds'].items())}), "
+                  f"peak {result['peak_rss_mb']:.0f} MB, detected {result['detected_count']}/{result['truth_count']}, "
+                  f"jaccard {result['jaccard_detected']:.2f}/{result['jaccard_truth']:.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "machine": platform.platform(),
+                "results": results,
+            }, f, indent=4)
+    if args.baseline:
+        compare(results, args.baseline)
@@ -0,0 +1,118 @@
+"""
+CS-410: Columnar table of AirVIEW detections backed by a NumPy structured array
+@file detections.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+One row per detected transmitter, holding its spectrogram box (rows are FFTs, end
+exclusive), the matching Hz and sample bounds and the mean and standard deviation of
+its power in dB. The table is stored on file records and in the AirVIEW cache as
+.npy bytes, about 56 bytes per detection, and converted to SigMF annotation dicts
+column by column only when an API response needs them.
+"""
+
+import io
+import numpy as np
+
+DETECTION_DTYPE = np.dtype([
+    ("start_row", "<i4"),
+    ("end_row", "<i4"),
+    ("start_col", "<i4"),
+    ("end_col", "<i4"),
+    ("freq_lower_edge", "<i8"),   # Hz
+    ("freq_upper_edge", "<i8"),   # Hz
+    ("sample_start", "<i8"),
+    ("sample_count", "<i8"),
+    ("mean", "<f4"),              # dB; NaN if unknown
+    ("sd", "<f4"),                # dB; NaN if unknown
+])
+
+# Label of every AirVIEW detection in its SigMF annotation
+DETECTION_LABEL = "Transmitter"
+
+
+def empty_table():
+    return np.zeros(0, dtype=DETECTION_DTYPE)
+
+
+def from_transmitters(transmitters, spectrogram, sample_rate, center_freq, row_samples):
+    """
+    Builds the table of the transmitters that span at least one spectrogram row.
+    :param spectrogram: the dB matrix the transmitters were found in, for their mean and sd
+    :param row_samples: capture samples covered by one spectrogram row
+    """
+    boxes = np.array([(tx.start_row, tx.end_row, tx.start_col, tx.end_col) for tx in transmitters],
+                     dtype=np.int64).reshape(-1, 4)
+    boxes = boxes[boxes[:, 1] > boxes[:, 0]]
+    table = np.zeros(len(boxes), dtype=DETECTION_DTYPE)
+    table["start_row"], table["end_row"], table["start_col"], table["end_col"] = boxes.T
+    set_bounds(table, spectrogram.shape[1], sample_rate, center_freq, row_samples)
+
+    for i, (r0, r1, c0, c1) in enumerate(boxes.tolist()):
+        power = spectrogram[r0:r1, c0:c1]
+        if power.size:
+            table["mean"][i] = power.mean()
+            table["sd"][i] = power.std()
+        else:
+            table["mean"][i] = table["sd"][i] = np.nan
+    return table
+
+
+def set_bounds(table, fft_size, sample_rate, center_freq, row_samples):
+    """
+    Fills in the Hz and sample bounds of every detection from its spectrogram box. The
+    boxes depend only on the samples, the bounds also on the capture's metadata.
+    :return: the table
+    """
+    # Same arithmetic and truncation as int(col / fft_size * sample_rate - sample_rate / 2 + center_freq)
+    for edge, col in (("freq_lower_edge", "start_col"), ("freq_upper_edge", "end_col")):
+        table[edge] = np.trunc(table[col] / fft_size * float(sample_rate) - (sample_rate / 2) + float(center_freq))
+    table["sample_start"] = table["start_row"].astype(np.int64) * row_samples
+    table["sample_count"] = (table["end_row"].astype(np.int64) - table["start_row"]) * row_samples
+    return table
+
+
+def from_sigmf(annotations):
+    """Table of SigMF annotation dicts; the spectrogram box and power are unknown (-1 and NaN)."""
+    table = np.zeros(len(annotations), dtype=DETECTION_DTYPE)
+    for name in ("start_row", "end_row", "start_col", "end_col"):
+        table[name] = -1
+    table["mean"] = table["sd"] = np.nan
+    for name in ("freq_lower_edge", "freq_upper_edge", "sample_start", "sample_count"):
+        table[name] = [annotation[f"core:{name}"] for annotation in annotations]
+    return table
+
+
+def to_sigmf(table):
+    """The SigMF annotation dicts of every detection, as AirVIEW has always reported them."""
+    columns = [table[name].tolist() for name in ("freq_lower_edge", "freq_upper_edge", "sample_start", "sample_count")]
+    return [{
+        "core:freq_lower_edge": lower,
+        "core:freq_upper_edge": upper,
+        "core:sample_start": start,
+        "core:sample_count": count,
+        "core:label": DETECTION_LABEL,
+    } for lower, upper, start, count in zip(*columns)]
+
+
+def record_fields(table):
+    """File record fields holding a detection table."""
+    return {
+        "airview_detections": serialize(table) if len(table) else None,
+        "detection_count": len(table),
+        "has_detections": len(table) > 0,
+    }
+
+
+def serialize(table):
+    """The table as self-describing .npy bytes."""
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(table, dtype=DETECTION_DTYPE), allow_pickle=False)
+    return buf.getvalue()
+
+
+def deserialize(data):
+    """Inverse of serialize; None or empty data gives an empty table."""
+    if not data:
+        return empty_table()
+    return np.load(io.BytesIO(bytes(data)), allow_pickle=False)
@@ -0,0 +1,50 @@
+"""
+CS-410: Gunicorn settings for the production serving mode
+@file gunicorn.conf.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Every setting can be overridden through the environment variable in brackets.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get("GC3_BIND", "127.0.0.1:5000")
+
+# One process per core for the NumPy/Matplotlib work, with threads to overlap MongoDB I/O
+workers = int(os.environ.get("GC3_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("GC3_THREADS", 4))
+
+# Uploads of large captures and AirVIEW runs can legitimately take minutes
+timeout = int(os.environ.get("GC3_TIMEOUT", 600))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so memory fragmented by huge uploads is returned to the OS
+max_requests = int(os.environ.get("GC3_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+
+# Import the app once in the master; each worker then opens its own MongoClient lazily
+preload_app = True
+
+# Workers take turns at holding this lock; the holder runs the storage garbage collector
+gc_lock_file = os.environ.get("GC3_GC_LOCK_FILE", os.path.join(tempfile.gettempdir(), "gc3_gridfs_gc.lock"))
+
+
+def post_fork(server, worker):
+    """Warms up the freshly forked worker before it accepts requests and starts its garbage collector."""
+    from app import warm_up
+    from wsgi import app
+
+    garbage_collector = app.extensions['garbage_collector']
+    if garbage_collector.interval_seconds > 0:
+        garbage_collector.start(lock_path=gc_lock_file)
+
+    try:
+        warm_up(app)
+    except Exception as e:
+        # A worker that cannot reach MongoDB yet can still serve once it comes up
+        server.log.warning(f"Worker {worker.pid} warm-up incomplete: {e}")
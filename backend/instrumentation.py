@@ -0,0 +1,119 @@
+"""
+CS-410: Timing spans for the processing pipeline, kept as Prometheus-style histograms
+@file instrumentation.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Every span is added to this process's histograms and, while a request is being
+handled on the current thread, to that request's list of spans (used for the
+Server-Timing header). Each gunicorn worker keeps its own histograms.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed durations."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name, labels):
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+        lines = [f'{name}_bucket{{{label_text},le="{bound}"}} {count}' for bound, count in zip(BUCKETS, self.buckets)]
+        lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{label_text}}} {self.sum}')
+        lines.append(f'{name}_count{{{label_text}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Stage and request duration histograms of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            self._stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self._lock:
+            self._requests.setdefault((endpoint, method, str(status)), Histogram()).observe(seconds)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP gc3_stage_duration_seconds Time spent in each processing stage.",
+            "# TYPE gc3_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                lines += histogram.render("gc3_stage_duration_seconds", [("stage", stage)])
+            lines += [
+                "# HELP gc3_request_duration_seconds Time to handle a request, by route, method and status.",
+                "# TYPE gc3_request_duration_seconds histogram",
+            ]
+            for (endpoint, method, status), histogram in sorted(self._requests.items()):
+                lines += histogram.render("gc3_request_duration_seconds",
+                                          [("endpoint", endpoint), ("method", method), ("status", status)])
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+_request = threading.local()
+
+
+def start_request():
+    """Starts collecting the spans of the request handled on this thread."""
+    _request.spans = []
+
+
+def finish_request():
+    """Stops collecting and returns the request's spans as (stage, seconds) pairs."""
+    spans = getattr(_request, "spans", None) or []
+    _request.spans = None
+    return spans
+
+
+def record(stage, seconds):
+    """Records a duration measured elsewhere (e.g. accumulated over a loop)."""
+    METRICS.observe_stage(stage, seconds)
+    spans = getattr(_request, "spans", None)
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as one observation of stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def server_timing(spans):
+    """Server-Timing header value; repeated stages (e.g. several GridFS puts) are summed."""
+    totals = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
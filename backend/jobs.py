@@ -0,0 +1,67 @@
+"""
+CS-410: Background jobs for work too slow to finish inside a request
+@file jobs.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """
+    Runs callables on a thread pool and tracks their progress in the jobs
+    collection so any worker can report a job's status.
+    """
+
+    def __init__(self, db, max_workers=2):
+        """
+        :param db: database holding the jobs collection
+        :param max_workers: number of jobs run at the same time
+        """
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gc3-job")
+
+    @property
+    def collection(self):
+        # Resolved on every use so a forked worker talks through its own client
+        return self.db.jobs
+
+    def submit(self, kind, func, **details):
+        """
+        Queues func() and returns the new job's id. The job document stores
+        func's return value as its result, or the error message if it raises.
+        :param kind: short job type, e.g. 'airview'
+        :param details: extra fields stored on the job document (e.g. file_id)
+        """
+        job_id = self.collection.insert_one(dict(
+            details,
+            kind=kind,
+            status="queued",
+            created_at=datetime.now(timezone.utc),
+        )).inserted_id
+        self.executor.submit(self._run, job_id, func)
+        return job_id
+
+    def _run(self, job_id, func):
+        self.collection.update_one({"_id": job_id}, {"$set": {
+            "status": "running", "started_at": datetime.now(timezone.utc),
+        }})
+        try:
+            update = {"status": "done", "result": func()}
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            update = {"status": "failed", "error": str(e)}
+        update["finished_at"] = datetime.now(timezone.utc)
+        self.collection.update_one({"_id": job_id}, {"$set": update})
+
+    def get(self, job_id):
+        """Returns the job document, or None if there is no such job."""
+        if not ObjectId.is_valid(job_id):
+            return None
+        return self.collection.find_one({"_id": ObjectId(job_id)})
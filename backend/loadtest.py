@@ -0,0 +1,434 @@
+"""
+CS-410: Concurrent load test of the backend with synthetic captures
+@file loadtest.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Usage: python loadtest.py [--clients N] [--duration SECONDS] [--mix upload=1,plot=8,...]
+           [--mongo memory|URI | --mongod PATH] [--gunicorn [--workers N] | --server URL [--server-pid PID]]
+           [--output FILE]
+Starts the app in a separate process, on Flask's threaded development server or with --gunicorn
+under `gunicorn -c gunicorn.conf.py wsgi:app` (unless --server points at a running one), and replays
+a weighted mix of operations from N concurrent clients:
+    upload    POST /upload with a generated capture
+    plot      GET /file/<id>/<plot_type>
+    image     GET /file/<id>/<plot_type>/image
+    list      GET /files
+    rename    PUT /<id>/rename_file
+    annotate  POST /save-file
+Reports throughput, p50/p95/p99 latency per operation and the server's RSS over time (summed
+over the gunicorn master and its workers).
+
+The database is an in-memory stand-in by default (requires `pip install mongomock`), a
+MongoDB server given by --mongo URI, or a throwaway mongod started from --mongod PATH. The
+stand-in lives inside one server process, so under gunicorn it needs a single worker.
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import numpy as np
+
+import synthetic_iq
+
+OPERATIONS = ('upload', 'plot', 'image', 'list', 'rename', 'annotate')
+DEFAULT_MIX = 'upload=1,plot=8,image=8,list=2,rename=1,annotate=2'
+PLOT_TYPES = ('spectrogram', 'time_domain', 'freq_domain', 'iq_plot')
+SAMPLE_RATE = 8e6
+CENTER_FREQUENCY = 915e6
+
+
+# SERVER
+
+_memory_client = None
+
+
+def memory_client(uri=None, **client_options):
+    """
+    MONGO_CLIENT_FACTORY of the in-memory database: one shared mongomock client per
+    process, like a real mongod, for every connection the app opens.
+    """
+    global _memory_client
+    if _memory_client is None:
+        import mongomock
+        import mongomock.gridfs
+        mongomock.gridfs.enable_gridfs_integration()
+        _memory_client = mongomock.MongoClient()
+    return _memory_client
+
+
+def server_env(mongo, workdir):
+    """Environment of the server process, selecting its database."""
+    env = dict(os.environ, AIRVIEW_CACHE_DIR=os.path.join(workdir, 'airview_cache'), GC_INTERVAL_SECONDS='0')
+    if mongo == 'memory':
+        env['MONGO_CLIENT_FACTORY'] = 'loadtest:memory_client'
+    else:
+        env['MONGO_URI'] = mongo
+    return env
+
+
+def serve(port):
+    """Runs the app on a threaded development server; used as the server process."""
+    from werkzeug.serving import make_server
+    from app import create_app, warm_up
+    app = create_app()
+    warm_up(app)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=60):
+    """Polls /healthz until the server answers."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = Client(url).request('GET', '/healthz')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def start_mongod(binary, workdir):
+    """Starts a throwaway mongod on a free port and returns (process, URI)."""
+    port = free_port()
+    dbpath = os.path.join(workdir, 'db')
+    os.makedirs(dbpath)
+    process = subprocess.Popen([binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f"mongodb://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("mongod did not start")
+
+
+def rss_bytes(pid):
+    """Resident memory of a process plus its direct children (e.g. gunicorn workers), from /proc."""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The ppid is the 2nd field after the parenthesized command name
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    total = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Samples the server's RSS at a fixed interval while the test runs."""
+
+    def __init__(self, pid, interval):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        started = time.perf_counter()
+        while not self.stopped.is_set():
+            self.samples.append((time.perf_counter() - started, rss_bytes(self.pid)))
+            self.stopped.wait(self.interval)
+
+
+# CLIENTS
+
+class Client:
+    """One keep-alive HTTP connection to the server."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Sends a request and returns (status, body bytes); reconnects once if the connection dropped."""
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=600)
+            try:
+                self.connection.request(method, path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+    def json(self, method, path, payload):
+        return self.request(method, path, json.dumps(payload), {'Content-Type': 'application/json'})
+
+
+def multipart(files, fields):
+    """Encodes a multipart/form-data body; files maps field name to (filename, bytes)."""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+class Workload:
+    """Shared state of the clients: the capture to upload and the ids of uploaded files."""
+
+    def __init__(self, capture_seconds, run_airview, seed):
+        num_samples = int(capture_seconds * SAMPLE_RATE)
+        emitters = synthetic_iq.random_emitters(np.random.default_rng(seed), SAMPLE_RATE, capture_seconds)
+        self.samples = np.concatenate(list(synthetic_iq.iter_iq(emitters, SAMPLE_RATE, num_samples, seed=seed)))
+        self.meta = json.dumps(synthetic_iq.sigmf_metadata(emitters, SAMPLE_RATE, CENTER_FREQUENCY, num_samples,
+                                                           None, "load test capture")).encode()
+        self.run_airview = run_airview
+        self.file_ids = []
+        self.lock = threading.Lock()
+        self.uploads = 0
+
+    def capture(self):
+        """The capture with its first sample changed, so every upload is new to the deduplication index."""
+        with self.lock:
+            self.uploads += 1
+            n = self.uploads
+        samples = self.samples.copy()
+        samples[0] = n
+        return n, samples.tobytes()
+
+    def random_file(self, rng):
+        with self.lock:
+            return self.file_ids[rng.integers(len(self.file_ids))] if self.file_ids else None
+
+    def run(self, client, operation, rng):
+        """Performs one operation; returns the HTTP status, or None when it had nothing to act on."""
+        if operation == 'upload':
+            n, data = self.capture()
+            body, headers = multipart(
+                {'cfile': (f'load{n}.cfile', data), 'metaFile': (f'load{n}.sigmf-meta', self.meta)},
+                {'runAirview': str(self.run_airview).lower(), 'downloadCSV': 'false'},
+            )
+            status, response = client.request('POST', '/upload', body, headers)
+            if status == 200:
+                with self.lock:
+                    self.file_ids.append(json.loads(response)['file_id'])
+            return status
+        if operation == 'list':
+            return client.request('GET', '/files?limit=100')[0]
+
+        file_id = self.random_file(rng)
+        if file_id is None:
+            return None
+        plot_type = PLOT_TYPES[rng.integers(len(PLOT_TYPES))]
+        if operation == 'plot':
+            return client.request('GET', f'/file/{file_id}/{plot_type}')[0]
+        if operation == 'image':
+            return client.request('GET', f'/file/{file_id}/{plot_type}/image')[0]
+        if operation == 'rename':
+            return client.json('PUT', f'/{file_id}/rename_file', {'filename': f'renamed-{rng.integers(1 << 30)}'})[0]
+        start = int(rng.integers(0, len(self.samples)))
+        return client.json('POST', '/save-file', {'file_id': file_id, 'annotations': [{
+            'sample_start': start, 'sample_count': 1024,
+            'freq_lower_edge': CENTER_FREQUENCY - 1e5, 'freq_upper_edge': CENTER_FREQUENCY + 1e5,
+            'label': 'load test', 'comment': '',
+        }]})[0]
+
+
+def client_loop(url, workload, operations, weights, deadline, seed, records):
+    client = Client(url)
+    rng = np.random.default_rng(seed)
+    while time.perf_counter() < deadline:
+        operation = operations[rng.choice(len(operations), p=weights)]
+        started = time.perf_counter()
+        try:
+            status = workload.run(client, operation, rng)
+        except OSError:
+            status = 'error'
+        if status is not None:
+            records.append((operation, started, time.perf_counter() - started, status))
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name}; choose from {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def summarize(records, elapsed):
+    """Per-operation counts, errors, throughput and latency percentiles in milliseconds."""
+    summary = {}
+    for operation in OPERATIONS + ('all',):
+        selected = [r for r in records if operation in ('all', r[0])]
+        if not selected:
+            continue
+        latencies = np.array([r[2] for r in selected]) * 1000
+        summary[operation] = {
+            'requests': len(selected),
+            'errors': sum(1 for r in selected if r[3] == 'error' or r[3] >= 400),
+            'throughput_per_second': len(selected) / elapsed,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'max_ms': float(latencies.max()),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run the mix for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. upload=1,plot=8")
+    parser.add_argument("--capture-seconds", type=float, default=0.05, help="length of each uploaded capture")
+    parser.add_argument("--airview", action="store_true", help="run AirVIEW on every upload")
+    parser.add_argument("--seed-files", type=int, default=4, help="files uploaded before the clients start")
+    parser.add_argument("--mongo", default="memory", help="'memory' for the in-memory stand-in, or a MongoDB URI")
+    parser.add_argument("--mongod", help="start a throwaway mongod from this binary instead")
+    parser.add_argument("--gunicorn", action="store_true", help="serve with gunicorn -c gunicorn.conf.py wsgi:app")
+    parser.add_argument("--workers", type=int, help="gunicorn workers (default: GC3_WORKERS or gunicorn.conf.py's)")
+    parser.add_argument("--server", help="load an already running server at this URL instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid of the --server process, to sample its RSS")
+    parser.add_argument("--rss-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the summary and RSS samples to this JSON file")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        sys.exit(0)
+    if args.server is None and args.mongo == 'memory' and not args.mongod:
+        try:
+            import mongomock  # noqa: F401
+        except ImportError:
+            sys.exit("The in-memory database needs mongomock: pip install mongomock")
+    if args.gunicorn:
+        import importlib.util
+        if importlib.util.find_spec('gunicorn') is None:
+            sys.exit("--gunicorn needs gunicorn: pip install gunicorn")
+        if args.mongo == 'memory' and not args.mongod and (args.workers or 1) > 1:
+            parser.error("the in-memory database lives in one process; use --workers 1 or --mongo/--mongod")
+
+    weights = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="gc3-loadtest-")
+    processes = []
+    try:
+        url, server_pid = args.server, args.server_pid
+        if url is None:
+            mongo = args.mongo
+            if args.mongod:
+                mongod, mongo = start_mongod(args.mongod, workdir)
+                processes.append(mongod)
+            port = free_port()
+            log_path = os.path.join(workdir, 'server.log')
+            env = server_env(mongo, workdir)
+            if args.gunicorn:
+                env.update(GC3_BIND=f'127.0.0.1:{port}', GC3_GC_LOCK_FILE=os.path.join(workdir, 'gc.lock'))
+                if args.workers or mongo == 'memory':
+                    env['GC3_WORKERS'] = str(args.workers or 1)
+                command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+            else:
+                command = [sys.executable, os.path.abspath(__file__), '--serve', str(port)]
+            with open(log_path, 'w') as log:
+                server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                          stdout=log, stderr=log)
+            processes.append(server)
+            url, server_pid = f"http://127.0.0.1:{port}", server.pid
+            print(f"Server log: {log_path}")
+        wait_for(url)
+
+        workload = Workload(args.capture_seconds, args.airview, args.seed)
+        seed_client = Client(url)
+        rng = np.random.default_rng(args.seed)
+        for _ in range(args.seed_files):
+            workload.run(seed_client, 'upload', rng)
+
+        sampler = None
+        if server_pid:
+            sampler = RssSampler(server_pid, args.rss_interval)
+            sampler.start()
+        records = []
+        operations = list(weights)
+        probabilities = np.array(list(weights.values())) / sum(weights.values())
+        started = time.perf_counter()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=client_loop,
+                                    args=(url, workload, operations, probabilities, deadline, args.seed + i + 1, records))
+                   for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if sampler:
+            sampler.stopped.set()
+            sampler.join()
+
+        summary = summarize(records, elapsed)
+        print(f"{args.clients} clients for {elapsed:.1f}s against {url}")
+        print(f"{'operation':<10}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for operation, stats in summary.items():
+            print(f"{operation:<10}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_per_second']:>9.1f}"
+                  f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+        rss = [sample for _, sample in sampler.samples] if sampler else []
+        if rss:
+            print(f"server RSS: start {rss[0] / 2**20:.0f} MB, peak {max(rss) / 2**20:.0f} MB, end {rss[-1] / 2**20:.0f} MB")
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    'server': 'external' if args.server else 'gunicorn' if args.gunicorn else 'development',
+                    'clients': args.clients,
+                    'duration_seconds': elapsed,
+                    'mix': weights,
+                    'capture_seconds': args.capture_seconds,
+                    'airview': args.airview,
+                    'summary': summary,
+                    'rss_samples': [{'seconds': t, 'bytes': b} for t, b in sampler.samples] if sampler else [],
+                }, f, indent=4)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,156 @@
+"""
+CS-410: Per-process memory budget for uploads and re-analysis, with automatic decimation
+@file memory_budget.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Every upload reserves its estimated peak memory from the budget of the worker
+process before reading the capture. A capture whose full-resolution processing
+would not fit is processed decimated: AirVIEW averages FFT rows and the plots use
+a time-averaged PSD and a Welch spectrum, all computed in bounded blocks. A
+capture that does not fit even then is rejected.
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Bytes per capture sample at full resolution, measured with tracemalloc
+RAW_BYTES_PER_SAMPLE = 8                # the cf32 samples, held once for the whole request
+AIRVIEW_BYTES_PER_SAMPLE = 40           # spectrogram, wavelet transforms and region lists
+PSD_BYTES_PER_SAMPLE = 32               # PSD kept from the spectrogram plot to the CSV
+SPECTROGRAM_PLOT_BYTES_PER_SAMPLE = 134  # computing the PSD and rendering its image
+FREQ_PLOT_BYTES_PER_SAMPLE = 72         # full-length FFT of the frequency domain plot
+# Figure rendering, a cold worker's first plots and other costs of every request that tracemalloc does not see
+BASE_BYTES = 96 << 20
+# Allocator overhead and fragmentation on top of the tracemalloc figures. Calibrated against
+# the peak RSS growth of uploads of 0.8M to 4M samples, which reached 202 MiB for 0.8M samples
+SAFETY_FACTOR = 1.25
+# Plots whose memory grows with the capture; the time domain and IQ plots use bounded buffers
+SPECTROGRAM_PLOTS = ("spectrogram",)
+FREQ_PLOTS = ("freq_domain",)
+# Temporaries of the decimated stages, which work in blocks of about a million samples
+DECIMATED_OVERHEAD_BYTES = 64 << 20
+
+# Largest decimation tried before an upload is rejected
+MAX_DECIMATION = 1 << 12
+
+
+class MemoryBudgetError(Exception):
+    """Raised when a request cannot be processed within the memory budget."""
+
+    def __init__(self, message, status):
+        """
+        :param status: HTTP status to answer with: 413 if the request can never fit,
+                       503 if it only does not fit next to the requests in progress
+        """
+        super().__init__(message)
+        self.status = status
+
+
+def estimate_bytes(num_samples, run_airview, plot_types, run_download, decimation=1):
+    """
+    Estimated peak memory of processing a capture.
+    :param plot_types: the plots that will be rendered, e.g. only the spectrogram for lazy uploads
+    :return: (peak bytes, dict of each stage's bytes on top of the raw samples)
+    """
+    reduced = num_samples / decimation
+    spectrogram = any(plot_type in SPECTROGRAM_PLOTS for plot_type in plot_types)
+    freq_domain = any(plot_type in FREQ_PLOTS for plot_type in plot_types)
+    stages = {}
+    if run_airview:
+        stages["airview"] = AIRVIEW_BYTES_PER_SAMPLE * reduced
+    if spectrogram or freq_domain or run_download:
+        psd = PSD_BYTES_PER_SAMPLE * reduced
+        stages["spectrogram"] = SPECTROGRAM_PLOT_BYTES_PER_SAMPLE * reduced
+        if freq_domain:
+            stages["freq_domain"] = psd + (FREQ_PLOT_BYTES_PER_SAMPLE * num_samples if decimation == 1 else 0)
+        if run_download:
+            # Written to GridFS one row at a time
+            stages["csv"] = psd
+    overhead = BASE_BYTES + (DECIMATED_OVERHEAD_BYTES if decimation > 1 else 0)
+    peak = SAFETY_FACTOR * (RAW_BYTES_PER_SAMPLE * num_samples + max(stages.values(), default=0)) + overhead
+    return int(peak), {stage: int(nbytes) for stage, nbytes in stages.items()}
+
+
+def plan(num_samples, available_bytes, run_airview, plot_types, run_download):
+    """
+    Smallest power of two decimation whose estimated peak fits in available_bytes.
+    :return: (decimation, estimated peak bytes), or None if nothing fits
+    """
+    decimation = 1
+    while decimation <= MAX_DECIMATION:
+        peak, _ = estimate_bytes(num_samples, run_airview, plot_types, run_download, decimation)
+        if peak <= available_bytes:
+            return decimation, peak
+        decimation *= 2
+    return None
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class MemoryTracker:
+    """Samples the process RSS at stage boundaries and keeps the largest growth seen."""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.baseline = current_rss()
+        self.peak_growth = 0
+
+    def checkpoint(self, stage):
+        rss = current_rss()
+        if rss is None or self.baseline is None:
+            return
+        growth = rss - self.baseline
+        self.peak_growth = max(self.peak_growth, growth)
+        if growth > self.budget_bytes:
+            # RSS is process wide, so concurrent requests in this worker count too
+            logger.warning("Memory grew by %d MiB by the end of %s, over the %d MiB reserved",
+                           growth >> 20, stage, self.budget_bytes >> 20)
+
+
+class MemoryBudget:
+    """Memory shared by the requests running in one worker process."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def reserve(self, num_samples, run_airview=True, plot_types=("spectrogram", "freq_domain"), run_download=False):
+        """
+        Reserves the memory for processing a capture until the block exits.
+        :param plot_types: the plots that will be rendered (see estimate_bytes)
+        :return: dict with the decimation to process at, the estimated peak bytes and a MemoryTracker
+        :raises MemoryBudgetError: if the capture does not fit
+        """
+        with self._lock:
+            fits = plan(num_samples, self.max_bytes - self.reserved, run_airview, plot_types, run_download)
+            if fits is None:
+                minimum, _ = estimate_bytes(num_samples, run_airview, plot_types, run_download, MAX_DECIMATION)
+                if plan(num_samples, self.max_bytes, run_airview, plot_types, run_download) is None:
+                    raise MemoryBudgetError(
+                        f"A capture of {num_samples} samples needs at least {minimum >> 20} MiB to process, "
+                        f"more than this server's budget of {self.max_bytes >> 20} MiB", 413)
+                raise MemoryBudgetError("The server is busy processing other captures; try again shortly", 503)
+            decimation, estimate = fits
+            self.reserved += estimate
+        if decimation > 1:
+            logger.info("Processing %d samples decimated by %d to fit an estimated %d MiB",
+                        num_samples, decimation, estimate >> 20)
+        try:
+            yield {"decimation": decimation, "estimated_bytes": estimate, "tracker": MemoryTracker(estimate)}
+        finally:
+            with self._lock:
+                self.reserved -= estimate
@@ -0,0 +1,146 @@
+"""
+CS-410: Keeps file_records on the current schema and maintains their indexes
+@file migrations.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import io
+from bson import ObjectId
+from SigMF import SigMF
+from FileData import SCHEMA_VERSION
+from annotation_store import fields_from_request, from_detections, replace_annotations
+from storage import PENDING_TTL_SECONDS
+
+# Matches every record written before the current schema version (including unversioned ones)
+OUTDATED_QUERY = {"schema_version": {"$not": {"$gte": SCHEMA_VERSION}}}
+
+
+# Sortable /files columns mapped to their file record field
+SORT_FIELDS = {
+    "filename": "filename",
+    "uploaded_at": "uploaded_at",
+    "center_frequency": "metadata.center_frequency",
+    "sample_rate": "metadata.sample_rate",
+    "has_detections": "has_detections",
+}
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes file_records queries rely on and fills in the listing fields they
+    are keyed on. Safe to call on every startup.
+    """
+    backfill_uploaded_at(db)
+    db.file_records.create_index("schema_version")
+    # Each listing sort key is paired with _id so keyset pagination stays on the index
+    for field in SORT_FIELDS.values():
+        db.file_records.create_index([(field, 1), ("_id", 1)])
+    # Claims of artifacts whose uploads crashed expire on their own
+    db.pending_artifacts.create_index("claimed_at", expireAfterSeconds=PENDING_TTL_SECONDS)
+    # Lets release_references find the content index entries of deleted artifacts
+    db.content_index.create_index("artifact_ids")
+    # Viewport queries narrow a file's annotations by time or by frequency
+    db.annotations.create_index([("file_id", 1), ("sample_start", 1), ("sample_end", 1)])
+    db.annotations.create_index([("file_id", 1), ("freq_lower_edge", 1), ("freq_upper_edge", 1)])
+
+
+def backfill_uploaded_at(db):
+    """
+    Gives records written before uploaded_at existed their ObjectId creation time, so
+    keyset pagination of the default /files order reaches them past the first page.
+    :return: the number of records updated
+    """
+    updated = 0
+    for record in db.file_records.find({"uploaded_at": None}, {"_id": 1}):
+        db.file_records.update_one({"_id": record["_id"], "uploaded_at": None},
+                                   {"$set": {"uploaded_at": record["_id"].generation_time}})
+        updated += 1
+    return updated
+
+
+def is_current(record):
+    """True when the record already carries the fields of the current schema."""
+    return record.get("schema_version", 0) >= SCHEMA_VERSION
+
+
+def migrate_record(db, fs, record):
+    """
+    Re-parses the stored .sigmf-meta blob of a single record and persists the
+    normalized metadata, calculated statistics and listing fields on it. Annotations
+    kept in arrays on the record move to the annotations collection, and AirVIEW
+    detections kept as SigMF annotation arrays become a detection table.
+    :param record: file record, must include meta_file_id
+    :return: the fields that were written
+    """
+    meta_file = fs.get(ObjectId(record["meta_file_id"]))
+    sigmf_metadata = SigMF(io.StringIO(meta_file.read().decode('utf-8')))
+    import detections
+    stored = db.file_records.find_one({"_id": record["_id"]}, {
+        "airview_annotations": 1, "airview_detections": 1, "annotations": 1, "uploaded_at": 1,
+    })
+
+    # Before schema version 3 each save rewrote the whole annotations array of the record. Later
+    # records keep theirs in the annotations collection only, which must then be left alone
+    if "annotations" in stored:
+        sample_rate = sigmf_metadata.sample_rate
+        manual = []
+        for annotation in stored["annotations"] or []:
+            fields = fields_from_request(annotation, sample_rate)
+            if annotation.get("id"):
+                fields["client_id"] = str(annotation["id"])
+            manual.append(fields)
+        replace_annotations(db, record["_id"], "manual", manual)
+    # Before schema version 4 AirVIEW detections were stored as an array of SigMF annotations
+    if stored.get("airview_detections"):
+        table = detections.deserialize(stored["airview_detections"])
+    else:
+        table = detections.from_sigmf(stored.get("airview_annotations") or [])
+    if "airview_annotations" in stored:
+        replace_annotations(db, record["_id"], "airview", from_detections(table))
+
+    fields = {
+        "metadata": sigmf_metadata.metadata(),
+        "calculated_statistics": sigmf_metadata.calculated_statistics(),
+        "sigmf": sigmf_metadata.to_dict(),
+        **detections.record_fields(table),
+        # Records written before uploaded_at existed fall back to the ObjectId creation time
+        "uploaded_at": stored.get("uploaded_at", record["_id"].generation_time),
+        "schema_version": SCHEMA_VERSION,
+    }
+    db.file_records.update_one({"_id": record["_id"]}, {"$set": fields,
+                                                         "$unset": {"annotations": "", "airview_annotations": ""}})
+    return fields
+
+
+def backfill(db, fs):
+    """
+    Migrates every outdated record. Records whose metadata cannot be loaded are
+    left untouched and reported back.
+    :return: (number of migrated records, list of (record id, error) pairs)
+    """
+    migrated = 0
+    failed = []
+    for record in db.file_records.find(OUTDATED_QUERY, {"meta_file_id": 1}):
+        if "meta_file_id" not in record:
+            failed.append((str(record["_id"]), "meta_file_id not found in record"))
+            continue
+        try:
+            migrate_record(db, fs, record)
+            migrated += 1
+        except Exception as e:
+            failed.append((str(record["_id"]), str(e)))
+    return migrated, failed
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from gridfs import GridFS
+
+    client = MongoClient("mongodb://localhost:27017")
+    db = client['files_db']
+    ensure_indexes(db)
+    migrated, failed = backfill(db, GridFS(db))
+    print(f"Migrated {migrated} record(s) to schema version {SCHEMA_VERSION}")
+    for record_id, error in failed:
+        print(f"  {record_id}: {error}")
@@ -0,0 +1,107 @@
+"""
+CS-410: Per-process MongoDB/GridFS connections that are safe to use across forked workers
+@file mongo.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import os
+import threading
+
+
+def load_factory(path):
+    """The callable a "module:callable" path names."""
+    import importlib
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class MongoConnection:
+    """
+    Lazily opens one MongoClient per process. A MongoClient must not be shared
+    across fork(), so a worker forked from a parent that already connected
+    transparently opens its own client on first use.
+    """
+
+    def __init__(self, uri="mongodb://localhost:27017", database="files_db", on_connect=None, client_factory=None,
+                 **client_options):
+        """
+        :param uri: MongoDB connection string
+        :param database: name of the application database
+        :param on_connect: called with the database once per process after connecting (e.g. to ensure indexes)
+        :param client_factory: called like MongoClient to open the client (default: pymongo.MongoClient)
+        :param client_options: passed to MongoClient (pool sizes, timeouts, ...)
+        """
+        self.uri = uri
+        self.database = database
+        self.on_connect = on_connect
+        self.client_factory = client_factory
+        self.client_options = client_options
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._db = None
+        self._fs = None
+
+    @classmethod
+    def from_env(cls, on_connect=None):
+        """
+        Builds a connection from MONGO_* environment variables, leaving pymongo defaults for unset ones.
+        MONGO_CLIENT_FACTORY names a "module:callable" to open the client with instead of MongoClient,
+        e.g. an in-memory stand-in for load tests.
+        """
+        options = {}
+        for env_name, option in (
+            ("MONGO_MAX_POOL_SIZE", "maxPoolSize"),
+            ("MONGO_MIN_POOL_SIZE", "minPoolSize"),
+            ("MONGO_CONNECT_TIMEOUT_MS", "connectTimeoutMS"),
+            ("MONGO_SERVER_SELECTION_TIMEOUT_MS", "serverSelectionTimeoutMS"),
+            ("MONGO_SOCKET_TIMEOUT_MS", "socketTimeoutMS"),
+            ("MONGO_WAIT_QUEUE_TIMEOUT_MS", "waitQueueTimeoutMS"),
+        ):
+            if os.environ.get(env_name):
+                options[option] = int(os.environ[env_name])
+        factory = os.environ.get("MONGO_CLIENT_FACTORY")
+        return cls(
+            uri=os.environ.get("MONGO_URI", "mongodb://localhost:27017"),
+            database=os.environ.get("MONGO_DB", "files_db"),
+            on_connect=on_connect,
+            client_factory=load_factory(factory) if factory else None,
+            **options,
+        )
+
+    def _connect(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # The driver is imported here rather than at module level to keep app startup fast
+            from pymongo import MongoClient
+            from gridfs import GridFS
+            # The parent's client (if any) is simply abandoned; closing it here would
+            # tear down sockets the parent process may still be using
+            self._client = (self.client_factory or MongoClient)(self.uri, **self.client_options)
+            self._db = self._client[self.database]
+            self._fs = GridFS(self._db)
+            if self.on_connect is not None:
+                self.on_connect(self._db)
+            self._pid = pid
+
+    def get_db(self):
+        """The application database for the current process."""
+        self._connect()
+        return self._db
+
+    def get_fs(self):
+        """The GridFS bucket for the current process."""
+        self._connect()
+        return self._fs
+
+    def close(self):
+        """Closes this process's client; the next access reconnects."""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._pid = self._client = self._db = self._fs = None
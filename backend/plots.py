@@ -0,0 +1,394 @@
+"""
+CS-410: Matplotlib rendering of the plots stored for each upload
+@file plots.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Importing this module loads Matplotlib, so the app only imports it once a plot
+is actually needed (or from the warm-up hook).
+"""
+
+import io
+import threading
+import numpy as np
+import matplotlib
+# Use the Agg backend for Matplotlib to avoid using any X server
+matplotlib.use('Agg')
+from matplotlib import mlab
+from matplotlib.colors import LinearSegmentedColormap, LogNorm, to_rgb
+# Figures are built with matplotlib's object-oriented API rather than pyplot, whose
+# global figure registry is not safe to use from the threads of a threaded worker
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from SigMF import PSD_FFT_SIZE
+
+# Window overlap of matplotlib's specgram, which the decimated PSD reproduces block by block
+PSD_NOVERLAP = PSD_FFT_SIZE // 2
+# Samples processed at a time by the decimated PSD and the Welch spectrum
+BLOCK_SAMPLES = 1 << 20
+# FFT length of the Welch spectrum drawn instead of a full-length FFT for decimated captures
+WELCH_SEGMENT = 1 << 14
+# Bins per axis of the IQ density plot, and the samples its axis range is estimated from
+IQ_BINS = 512
+IQ_RANGE_SAMPLES = 1 << 16
+# The IQ density plot spans this quantile of the sampled magnitudes plus a margin;
+# samples beyond it are counted in the edge bins
+IQ_RANGE_QUANTILE = 0.999
+IQ_RANGE_MARGIN = 1.25
+# Samples drawn by the time domain plot
+TIME_DOMAIN_SAMPLES = 1000
+# PNG encoding defaults: Matplotlib's figure resolution and zlib's default compression level
+DEFAULT_DPI = 100
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+def register_colormaps():
+    """Registers the custom colormaps with Matplotlib. Safe to call more than once."""
+    # NOTE: For those with deuteranopia, change cmap='viridis' to cmap='accessible_cmap' in
+    #       plot_spectrogram() and generate_data() to use a color palette that is more accessible 
+    #       for colorblind users.
+    if 'accessible_cmap' in matplotlib.colormaps:
+        return
+    SPEC_HEX_COLORS = ["#e4ff7a", "#ffe81a", "#ffbd00", "#ffa000", "#fc7f00"] # CITE: https://github.com/wistia/heatmap-palette
+    rgb_colors = [to_rgb(color) for color in SPEC_HEX_COLORS] # Convert hex to RGB
+    custom_cmap = LinearSegmentedColormap.from_list('accessible_cmap', rgb_colors, N=256) # Create a custom colormap
+    matplotlib.colormaps.register(cmap=custom_cmap) # Register the colormap with Matplotlib
+
+
+# FIGURE TEMPLATES
+# Each plot is built once by a _*_figure function (axes, labels, legend, empty data
+# artists) and filled in by a _draw_* function, which swaps only the data, limits
+# and titles. plot_* build a new figure per call; PlotRenderer keeps one per plot type.
+
+def _time_domain_figure():
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+    ax.plot([], [], label="Real")
+    ax.plot([], [], label="Imaginary", linestyle='dashed')
+    ax.set_title("Time Domain Signal")
+    ax.set_xlabel("Time [s]")
+    ax.set_ylabel("Amplitude")
+    ax.legend()
+    return fig
+
+
+def _draw_time_domain(fig, iq_data, sigmf_metadata):
+    ax = fig.axes[0]
+    samples = np.asarray(iq_data[:TIME_DOMAIN_SAMPLES])
+    time_axis = np.arange(len(samples)) / sigmf_metadata.sample_rate
+    real, imaginary = ax.lines
+    real.set_data(time_axis, samples.real)
+    imaginary.set_data(time_axis, samples.imag)
+    _rescale(ax)
+
+
+def plot_time_domain(iq_data, sigmf_metadata):
+    """Generates the time-domain plot."""
+    fig = _time_domain_figure()
+    _draw_time_domain(fig, iq_data, sigmf_metadata)
+    return fig
+
+
+def _freq_domain_figure():
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+    ax.plot([], [], color='red')
+    ax.set_title("Frequency Domain (FFT)")
+    ax.set_xlabel("Frequency [Hz]")
+    ax.set_ylabel("Power [dB]")
+    return fig
+
+
+def _draw_freq_domain(fig, iq_data, sigmf_metadata, decimation=1):
+    ax = fig.axes[0]
+    if decimation > 1:
+        freq_axis, power = welch_spectrum(iq_data, sigmf_metadata.sample_rate)
+        ax.lines[0].set_data(freq_axis, 10 * np.log10(power))
+        ax.set_title("Frequency Domain (Welch average)")
+    else:
+        fft_spectrum = np.fft.fftshift(np.fft.fft(iq_data))
+        freq_axis = np.fft.fftshift(np.fft.fftfreq(len(iq_data), 1 / sigmf_metadata.sample_rate))
+        ax.lines[0].set_data(freq_axis, 20 * np.log10(np.abs(fft_spectrum)))
+        ax.set_title("Frequency Domain (FFT)")
+    _rescale(ax)
+
+
+def plot_freq_domain(iq_data, sigmf_metadata, decimation=1):
+    """
+    Generates the frequency-domain (FFT) plot. Decimated captures are drawn as a
+    Welch spectrum rather than one FFT over every sample.
+    """
+    fig = _freq_domain_figure()
+    _draw_freq_domain(fig, iq_data, sigmf_metadata, decimation)
+    return fig
+
+
+def _rescale(ax):
+    """Fits the axis limits to the current data of the axes' lines."""
+    ax.relim()
+    ax.autoscale_view()
+
+
+def iq_histogram(iq_data, bins=IQ_BINS, limit=None):
+    """
+    Counts every sample of the capture into a bins x bins grid over [-limit, limit]
+    in both I and Q, a block at a time, so it also works on memory-mapped captures.
+    :param limit: half width of the grid (default: a high quantile of a strided sample
+                  of the magnitudes, so the cost does not grow with the capture)
+    :return: (counts indexed [I bin, Q bin], limit)
+    """
+    if limit is None:
+        step = max(1, len(iq_data) // IQ_RANGE_SAMPLES)
+        sample = np.asarray(iq_data[::step][:IQ_RANGE_SAMPLES])
+        magnitudes = np.maximum(np.abs(sample.real), np.abs(sample.imag))
+        limit = float(np.quantile(magnitudes, IQ_RANGE_QUANTILE)) * IQ_RANGE_MARGIN if len(magnitudes) else 0.0
+        limit = limit or 1.0
+    counts = np.zeros(bins * bins, dtype=np.int64)
+    scale = bins / (2 * limit)
+    for s0 in range(0, len(iq_data), BLOCK_SAMPLES):
+        block = np.asarray(iq_data[s0:s0 + BLOCK_SAMPLES])
+        i = np.clip(((block.real + limit) * scale).astype(np.intp), 0, bins - 1)
+        q = np.clip(((block.imag + limit) * scale).astype(np.intp), 0, bins - 1)
+        counts += np.bincount(i * bins + q, minlength=bins * bins)
+    return counts.reshape(bins, bins), limit
+
+
+def _iq_figure():
+    fig = Figure(figsize=(8, 8))
+    ax = fig.subplots()
+    image = ax.imshow(np.ma.masked_all((IQ_BINS, IQ_BINS)), origin='lower', extent=[-1, 1, -1, 1], cmap='viridis',
+                      norm=LogNorm(vmin=1, vmax=1), interpolation='nearest')
+    fig.colorbar(image, ax=ax, label="Samples per bin")
+    ax.set_xlabel("In-phase")
+    ax.set_ylabel("Quadrature")
+    return fig
+
+
+def _draw_iq(fig, iq_data):
+    ax = fig.axes[0]
+    counts, limit = iq_histogram(iq_data)
+    image = ax.images[0]
+    # Empty bins are masked so they stay blank under the log scale
+    image.set_data(np.ma.masked_equal(counts.T, 0))
+    image.set_extent([-limit, limit, -limit, limit])
+    # A new norm makes the colorbar recompute its ticks as it would for a new figure
+    image.set_norm(LogNorm(vmin=1, vmax=max(int(counts.max()), 1)))
+    ax.set_title(f"IQ Density ({len(iq_data)} samples)")
+
+
+def plot_iq(iq_data):
+    """Generates the IQ plot (constellation diagram) as a log-scaled density of every sample."""
+    fig = _iq_figure()
+    _draw_iq(fig, iq_data)
+    return fig
+
+
+def _spectrogram_figure():
+    fig = Figure(figsize=(8, 4.8))
+    ax = fig.subplots()
+    # Only the Pxx image is drawn. Spectrograms used to also draw ax.specgram's image, with time on
+    # x and frequency on y, but this image covered it or it lay outside the axes limits
+    ax.imshow(np.zeros((1, 1)), aspect='auto', extent=[0, 1, 1, 0], cmap='viridis')
+    # Set plot labels
+    ax.set_xlabel("Frequency [Hz]")
+    ax.set_ylabel("Time [s]")
+    ax.set_title("Spectrogram")
+    return fig
+
+
+def _draw_spectrogram(fig, Pxx, freqs, bins):
+    image = fig.axes[0].images[0]
+    # Image representation of Pxx (Power Spectral Density)
+    image.set_data(10 * np.log10(Pxx.T))
+    image.set_extent([freqs[0], freqs[-1], bins[-1], 0])
+    image.autoscale()
+
+
+def plot_spectrogram(iq_data, sigmf_metadata, decimation=1):
+    """
+    Generates the spectrogram and returns Pxx, freqs, bins.
+    :param decimation: number of adjacent PSD columns averaged into one (see compute_psd)
+    """
+    Pxx, freqs, bins = compute_psd(iq_data, sigmf_metadata, decimation)
+    fig = _spectrogram_figure()
+    _draw_spectrogram(fig, Pxx, freqs, bins)
+    return fig, Pxx, freqs, bins
+
+
+def compute_psd(iq_data, sigmf_metadata, decimation=1):
+    """
+    Computes the same Pxx, freqs, bins as plot_spectrogram without rendering anything.
+    With decimation > 1 the PSD is computed block by block and every decimation
+    adjacent time columns are averaged, so memory follows the reduced size.
+    """
+    step = PSD_FFT_SIZE - PSD_NOVERLAP
+    num_columns = (len(iq_data) - PSD_NOVERLAP) // step
+    if decimation == 1 or num_columns < 1:
+        Pxx, freqs, bins = mlab.specgram(iq_data, Fs=sigmf_metadata.sample_rate)
+        return Pxx, freqs + sigmf_metadata.center_frequency, bins
+
+    # Blocks hold whole groups of columns, so only the last group can be short
+    block_columns = decimation * max(1, BLOCK_SAMPLES // (step * decimation))
+    Pxx_blocks, bin_blocks = [], []
+    for c0 in range(0, num_columns, block_columns):
+        c1 = min(c0 + block_columns, num_columns)
+        # The block's windows start where the full specgram's columns c0..c1 would
+        block = iq_data[c0 * step:(c1 - 1) * step + PSD_FFT_SIZE]
+        Pxx, freqs, bins = mlab.specgram(block, NFFT=PSD_FFT_SIZE, Fs=sigmf_metadata.sample_rate,
+                                         noverlap=PSD_NOVERLAP)
+        Pxx_blocks.append(_mean_groups(Pxx, decimation))
+        bin_blocks.append(_mean_groups(bins[np.newaxis, :] + c0 * step / sigmf_metadata.sample_rate, decimation)[0])
+    return np.concatenate(Pxx_blocks, axis=1), freqs + sigmf_metadata.center_frequency, np.concatenate(bin_blocks)
+
+
+def _mean_groups(columns, size):
+    """Averages every size adjacent columns of a 2D array; a shorter last group is averaged on its own."""
+    full = columns.shape[1] // size * size
+    groups = [columns[:, :full].reshape(len(columns), -1, size).mean(axis=2)]
+    if full < columns.shape[1]:
+        groups.append(columns[:, full:].mean(axis=1, keepdims=True))
+    return np.concatenate(groups, axis=1)
+
+
+def welch_spectrum(iq_data, sample_rate):
+    """
+    Mean power spectrum of non-overlapping Hann-windowed segments, computed block by block.
+    :return: (centered frequency axis, power per bin)
+    """
+    segment = min(WELCH_SEGMENT, len(iq_data))
+    window = np.hanning(segment).astype(np.float32)
+    total = np.zeros(segment)
+    segments = len(iq_data) // segment
+    block_segments = max(1, BLOCK_SAMPLES // segment)
+    for s0 in range(0, segments, block_segments):
+        s1 = min(s0 + block_segments, segments)
+        block = iq_data[s0 * segment:s1 * segment].reshape(s1 - s0, segment) * window
+        total += (np.abs(np.fft.fft(block, axis=1)) ** 2).sum(axis=0)
+    power = np.fft.fftshift(total / max(segments, 1))
+    return np.fft.fftshift(np.fft.fftfreq(segment, 1 / sample_rate)), power
+
+
+def colormap_lut(cmap):
+    """The 256 RGB colors of a registered colormap as a uint8 lookup table."""
+    return matplotlib.colormaps[cmap](np.linspace(0, 1, 256), bytes=True)[:, :3]
+
+
+def render_db_png(db, vmin, vmax, cmap='viridis', compress_level=DEFAULT_COMPRESS_LEVEL):
+    """
+    Colors a dB matrix through a colormap lookup table and encodes it as a PNG with one
+    pixel per value, without building a figure. Values are mapped linearly from
+    [vmin, vmax] onto the colormap and clipped to its ends.
+    """
+    from PIL import Image
+    scale = 256 / (vmax - vmin) if vmax > vmin else 0.0
+    levels = np.nan_to_num(db, nan=vmin, neginf=vmin, posinf=vmax)
+    index = np.clip((levels - vmin) * scale, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(colormap_lut(cmap)[index], 'RGB').save(buf, format='PNG', compress_level=compress_level)
+    return buf.getvalue()
+
+
+def plot_matrix(matrix):
+    """
+    Generates the image of a synthetic data matrix.
+
+    NOTE: Visualization Limitation
+    The image may not visibly reflect changes to noise_mean: imshow rescales the colormap to
+    the full range of the matrix, so shifting every value by the same amount gives the same
+    colors. The CSV and .npy outputs hold the actual values with the specified noise_mean.
+    Stored captures can be re-rendered with a fixed dB range through
+    /file/<file_id>/spectrogram/render.
+    """
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.imshow(matrix, aspect='auto', cmap='viridis')
+    ax.set_title('Generated Data Matrix')
+    ax.set_xlabel("Frequency")
+    ax.set_ylabel("Time")
+    return fig
+
+
+def render_png(fig, dpi=DEFAULT_DPI, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """
+    Rasterizes a figure to PNG bytes.
+    :param compress_level: zlib level from 0 (fastest, largest) to 9 (slowest, smallest)
+    """
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi, pil_kwargs={"compress_level": compress_level})
+    return buf.getvalue()
+
+
+class PlotRenderer:
+    """
+    Renders the stored plots into figures built once and reused, so each plot only
+    pays for swapping its data and rasterizing. A renderer must only be used by one
+    thread at a time; renderer() returns the calling thread's.
+    """
+
+    def __init__(self, dpi=DEFAULT_DPI, compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self._figures = {}
+
+    def _figure(self, plot_type, build):
+        if plot_type not in self._figures:
+            fig = build()
+            # An attached Agg canvas keeps its renderer and pixel buffer between renders
+            FigureCanvasAgg(fig)
+            self._figures[plot_type] = fig
+        return self._figures[plot_type]
+
+    def render(self, fig):
+        return render_png(fig, self.dpi, self.compress_level)
+
+    def time_domain(self, iq_data, sigmf_metadata):
+        """:return: PNG bytes of the time-domain plot"""
+        fig = self._figure('time_domain', _time_domain_figure)
+        _draw_time_domain(fig, iq_data, sigmf_metadata)
+        return self.render(fig)
+
+    def freq_domain(self, iq_data, sigmf_metadata, decimation=1):
+        """:return: PNG bytes of the frequency-domain plot"""
+        fig = self._figure('freq_domain', _freq_domain_figure)
+        _draw_freq_domain(fig, iq_data, sigmf_metadata, decimation)
+        return self.render(fig)
+
+    def iq_plot(self, iq_data):
+        """:return: PNG bytes of the IQ density plot"""
+        fig = self._figure('iq_plot', _iq_figure)
+        _draw_iq(fig, iq_data)
+        return self.render(fig)
+
+    def spectrogram(self, iq_data, sigmf_metadata, decimation=1):
+        """:return: (PNG bytes of the spectrogram, Pxx, freqs, bins)"""
+        Pxx, freqs, bins = compute_psd(iq_data, sigmf_metadata, decimation)
+        return self.spectrogram_from_psd(Pxx, freqs, bins), Pxx, freqs, bins
+
+    def spectrogram_from_psd(self, Pxx, freqs, bins):
+        """:return: PNG bytes of the spectrogram of an already computed PSD"""
+        fig = self._figure('spectrogram', _spectrogram_figure)
+        _draw_spectrogram(fig, Pxx, freqs, bins)
+        return self.render(fig)
+
+
+_renderers = threading.local()
+
+
+def renderer(dpi=DEFAULT_DPI, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """The calling thread's PlotRenderer, made on first use."""
+    current = getattr(_renderers, "renderer", None)
+    if current is None or (current.dpi, current.compress_level) != (dpi, compress_level):
+        current = _renderers.renderer = PlotRenderer(dpi, compress_level)
+    return current
+
+
+def warm_up():
+    """Renders a tiny figure so the Agg renderer and its fonts are loaded before the first real plot."""
+    fig = Figure(figsize=(2, 2))
+    ax = fig.subplots()
+    ax.plot(np.zeros(16))
+    ax.set_title("warm up")
+    render_png(fig)
+
+
+register_colormaps()
@@ -0,0 +1,66 @@
+"""
+CS-410: Opt-in cProfile capture of slow requests, exported for storage in GridFS
+@file profiling.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+A stored .prof file opens with `python -m pstats FILE` or a viewer such as snakeviz.
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+
+# Functions listed in the summary stored on the file record and in the text report
+TOP_FUNCTIONS = 25
+
+# From Python 3.12 only one cProfile can be active per process at a time
+_profile_lock = threading.Lock()
+
+
+def profile_requested(value):
+    """True if a request flag or header value asks for a profile."""
+    return str(value).lower() in ('1', 'true', 'yes', 'y')
+
+
+def run_profiled(func, *args, **kwargs):
+    """
+    Calls func under cProfile. Profiled calls in the same process run one at a time.
+    :return: (func's result, the profiler)
+    """
+    profiler = cProfile.Profile()
+    with _profile_lock:
+        result = profiler.runcall(func, *args, **kwargs)
+    return result, profiler
+
+
+def _function_name(function):
+    filename, line, name = function
+    return f"{filename.rsplit('/', 1)[-1]}:{line}({name})" if line else name
+
+
+def export_profile(profiler, top=TOP_FUNCTIONS):
+    """
+    :return: (pstats dump bytes, text report, summary dict with the profiled time and
+             the functions with the most own time)
+    """
+    profiler.create_stats()
+    # Same format as Profile.dump_stats, without a temporary file
+    data = marshal.dumps(profiler.stats)
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+
+    # stats.stats maps function -> (primitive calls, calls, own time, cumulative time, callers)
+    hottest = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    top_functions = [{
+        "function": _function_name(function),
+        "calls": calls,
+        "own_seconds": own,
+        "cumulative_seconds": cumulative,
+    } for function, (_, calls, own, cumulative, _) in hottest]
+    return data, report.getvalue(), {"total_seconds": stats.total_tt, "top_functions": top_functions}
@@ -0,0 +1,75 @@
+"""
+CS-410: Windows of a stored PSD, resized and quantized for the re-render and binary PSD endpoints
+@file psd_window.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Matrices here are the PSD in dB laid out as the spectrogram draws it: one row per
+time bin and one column per frequency bin.
+"""
+
+import numpy as np
+
+# Quantized PSD types: values 1..max map the dB range linearly and 0 marks no power (-inf dB)
+QUANTIZED_DTYPES = {"uint8": np.dtype("u1"), "uint16": np.dtype("<u2")}
+
+
+def psd_to_db(Pxx):
+    """The PSD returned by compute_psd in dB, as time rows by frequency columns."""
+    with np.errstate(divide='ignore'):
+        return (10 * np.log10(Pxx.T)).astype(np.float32)
+
+
+def window_indices(freqs, bins, tmin=None, tmax=None, fmin=None, fmax=None):
+    """
+    Rows and columns whose time and frequency bins fall inside the window; unset bounds are open.
+    :return: (first row, end row, first column, end column)
+    """
+    r0 = np.searchsorted(bins, -np.inf if tmin is None else tmin, side='left')
+    r1 = np.searchsorted(bins, np.inf if tmax is None else tmax, side='right')
+    c0 = np.searchsorted(freqs, -np.inf if fmin is None else fmin, side='left')
+    c1 = np.searchsorted(freqs, np.inf if fmax is None else fmax, side='right')
+    return int(r0), int(r1), int(c0), int(c1)
+
+
+def db_range(matrix):
+    """(min, max) of the finite values, or (0.0, 0.0) if there are none."""
+    finite = matrix[np.isfinite(matrix)]
+    if not finite.size:
+        return 0.0, 0.0
+    return float(finite.min()), float(finite.max())
+
+
+def resample_nearest(matrix, height, width):
+    """Picks the nearest rows and columns of a 2D array to give it the requested shape."""
+    rows = np.arange(height) * matrix.shape[0] // height
+    columns = np.arange(width) * matrix.shape[1] // width
+    return matrix[rows[:, np.newaxis], columns]
+
+
+def max_pool(matrix, height, width):
+    """
+    Shrinks a 2D array to at most height x width by keeping the largest value of each
+    block of rows and columns, so narrow or short transmissions stay visible.
+    """
+    height, width = min(height, matrix.shape[0]), min(width, matrix.shape[1])
+    if (height, width) == matrix.shape:
+        return matrix
+    row_starts = np.arange(height) * matrix.shape[0] // height
+    column_starts = np.arange(width) * matrix.shape[1] // width
+    return np.maximum.reduceat(np.maximum.reduceat(matrix, row_starts, axis=0), column_starts, axis=1)
+
+
+def quantize(matrix, dtype, vmin, vmax):
+    """
+    Maps dB values linearly onto the integers 1..max of dtype, clipping to [vmin, vmax];
+    -inf and NaN become 0. A value q > 0 decodes as q * scale + offset dB.
+    :return: (quantized array, scale, offset)
+    """
+    top = np.iinfo(dtype).max
+    scale = (vmax - vmin) / (top - 1) if vmax > vmin else 1.0
+    offset = vmin - scale
+    with np.errstate(invalid='ignore'):
+        levels = np.clip(np.rint((matrix - offset) / scale), 1, top)
+    quantized = np.where(np.isfinite(matrix) | (matrix > 0), levels, 0)
+    return quantized.astype(dtype), scale, offset
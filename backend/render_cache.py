@@ -0,0 +1,69 @@
+"""
+CS-410: In-process LRU cache of loaded PSDs and re-rendered spectrogram images
+@file render_cache.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import threading
+from collections import OrderedDict
+
+
+def nbytes(value):
+    """Approximate size of a cached value: bytes, a NumPy array, or a tuple of them."""
+    if isinstance(value, tuple):
+        return sum(nbytes(item) for item in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 64
+
+
+class RenderCache:
+    """
+    Least recently used cache bounded by the total size of its values. Each worker
+    process keeps its own. Keys include the GridFS id of the PSD they derive from,
+    so entries of deleted files are never hit again and simply age out.
+
+    Keys:
+        psd:     (PSD GridFS id)
+        render:  (PSD GridFS id, rendering parameters)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,62 @@
+"""
+CS-410: Measures how long a fresh process takes to import the app and create it
+@file startup_time.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Usage: python startup_time.py [--runs N] [--budget SECONDS]
+Exits non-zero when the median startup time exceeds the budget or when a module
+that should only load on demand was imported during startup.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must not be imported just to create the app
+HEAVY_MODULES = ('numpy', 'matplotlib', 'pydantic', 'pymongo', 'gridfs', 'airview', 'plots')
+
+# Runs in a fresh interpreter so nothing is already cached in sys.modules
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "create_app_seconds": created - imported,
+    "total_seconds": created - started,
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure():
+    """Returns the timings of one cold start."""
+    # The background GC thread is not part of startup; keep the probe from starting it
+    env = dict(os.environ, GC_INTERVAL_SECONDS="0")
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to time")
+    parser.add_argument("--budget", type=float, default=1.0, help="maximum median startup time in seconds")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    median = statistics.median(run["total_seconds"] for run in runs)
+    heavy = sorted({m for run in runs for m in run["heavy_modules"]})
+    print(f"import app:   {statistics.median(run['import_seconds'] for run in runs) * 1000:.0f} ms (median of {args.runs})")
+    print(f"create_app(): {statistics.median(run['create_app_seconds'] for run in runs) * 1000:.0f} ms")
+    print(f"total:        {median * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms)")
+    if heavy:
+        print(f"loaded during startup: {', '.join(heavy)}")
+    sys.exit(1 if median > args.budget or heavy else 0)
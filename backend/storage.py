@@ -0,0 +1,303 @@
+"""
+CS-410: GridFS artifact bookkeeping: bulk deletion, reference counts, the content
+        index used to deduplicate uploads, and garbage collection of orphans
+@file storage.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+
+# File record fields that hold GridFS ids of artifacts owned by the record
+ARTIFACT_FIELDS = (
+    "raw_data_file_id",
+    "csv_file_id",
+    "spectrogram_file_id",
+    "iq_plot_file_id",
+    "time_domain_file_id",
+    "freq_domain_file_id",
+    "meta_file_id",
+    "psd_file_id",
+    "profile_file_id",
+    "profile_summary_file_id",
+)
+
+# Ids are deleted in batches so a single $in list never grows unbounded
+DELETE_BATCH_SIZE = 1000
+
+# Claims of artifacts whose record is still being written protect them from the collector
+# for at most this long, so the artifacts of a request that crashed are still reclaimed
+PENDING_TTL_SECONDS = 24 * 3600
+
+# GridFS ids claimed by the request or job running on the current thread
+_pending = threading.local()
+
+
+def artifact_ids(file_record):
+    """Returns the GridFS ids referenced by a file record, skipping empty ("None") fields."""
+    ids = []
+    for field in ARTIFACT_FIELDS:
+        value = file_record.get(field)
+        if value is not None and ObjectId.is_valid(value):
+            ids.append(ObjectId(value))
+    return ids
+
+
+def delete_gridfs_files(db, ids):
+    """
+    Deletes GridFS files and their chunks with one delete_many per collection
+    instead of one fs.delete round trip per file.
+    :param ids: iterable of ObjectIds
+    :return: number of fs.files documents removed
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    deleted = 0
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[i:i + DELETE_BATCH_SIZE]
+        # Remove the files documents first so a partially deleted file is never readable
+        deleted += db.fs.files.delete_many({"_id": {"$in": batch}}).deleted_count
+        db.fs.chunks.delete_many({"files_id": {"$in": batch}})
+    return deleted
+
+
+def clear_gridfs(db):
+    """Removes every GridFS file and the content index that points at them."""
+    db.fs.files.delete_many({})
+    db.fs.chunks.delete_many({})
+    db.content_index.delete_many({})
+
+
+# REFERENCE COUNTING
+# GridFS files can be shared by several file records once uploads are deduplicated.
+# The number of records using a file is kept in its metadata.refs field; files
+# written before reference counting existed have no such field and count as one.
+
+def _normalize_refs(db, ids):
+    db.fs.files.update_many({"_id": {"$in": ids}, "metadata.refs": {"$exists": False}},
+                            {"$set": {"metadata.refs": 1}})
+
+
+def add_references(db, ids):
+    """
+    Registers one more file record as a user of each GridFS file.
+    :return: True if every file still exists, otherwise the references are
+             rolled back and False is returned
+    """
+    ids = list(ids)
+    _normalize_refs(db, ids)
+    matched = db.fs.files.update_many({"_id": {"$in": ids}}, {"$inc": {"metadata.refs": 1}}).matched_count
+    if matched != len(set(ids)):
+        db.fs.files.update_many({"_id": {"$in": ids}}, {"$inc": {"metadata.refs": -1}})
+        return False
+    return True
+
+
+def release_references(db, ids):
+    """
+    Drops one reference from each GridFS file and deletes the files nobody uses
+    anymore, along with any content index entry pointing at them.
+    :return: number of GridFS files deleted
+    """
+    ids = list(ids)
+    _normalize_refs(db, ids)
+    db.fs.files.update_many({"_id": {"$in": ids}}, {"$inc": {"metadata.refs": -1}})
+    unused = [grid_file["_id"] for grid_file in
+              db.fs.files.find({"_id": {"$in": ids}, "metadata.refs": {"$lte": 0}}, {"_id": 1})]
+    if unused:
+        db.content_index.delete_many({"artifact_ids": {"$in": unused}})
+    return delete_gridfs_files(db, unused)
+
+
+# CONTENT INDEX
+# Maps the hash of an uploaded (IQ data, metadata) pair to the artifacts already
+# derived from it so a re-upload can reference them instead of recomputing them.
+
+def content_key(iq_sha256, meta_sha256):
+    """Content index key of an uploaded capture."""
+    return f"{iq_sha256}:{meta_sha256}"
+
+
+def claim_content(db, key, fields):
+    """
+    Looks up a capture in the content index and takes a reference on the requested artifacts.
+    :param fields: artifact names (keys of the entry's 'artifacts') the new record will use
+    :return: the index entry, or None on a miss or if its artifacts are no longer stored
+    """
+    entry = db.content_index.find_one({"_id": key})
+    if not entry:
+        return None
+    ids = [entry["artifacts"][field] for field in fields if field in entry["artifacts"]]
+    if not add_references(db, ids):
+        # Some artifact was collected out from under the entry; start over
+        db.content_index.delete_one({"_id": key})
+        return None
+    return entry
+
+
+def register_content(db, key, artifacts, extent, decimation=1):
+    """
+    Records the artifacts derived from a capture.
+    :param artifacts: dict of artifact name to GridFS id
+    :param extent: dict with max_time, min_freq and max_freq of the spectrogram
+    :param decimation: averaging the plots were made with to fit the memory budget
+    """
+    db.content_index.replace_one({"_id": key}, {
+        "_id": key,
+        "artifacts": artifacts,
+        "artifact_ids": list(artifacts.values()),
+        "extent": extent,
+        "decimation": decimation,
+    }, upsert=True)
+
+
+def add_content_artifact(db, key, name, grid_id):
+    """Attaches an artifact produced after the entry was registered (e.g. a CSV requested later)."""
+    db.content_index.update_one({"_id": key}, {
+        "$set": {f"artifacts.{name}": grid_id},
+        "$addToSet": {"artifact_ids": grid_id},
+    })
+
+
+def claim_pending(db, grid_id):
+    """
+    Marks an artifact about to be stored as in use until the request or job storing it
+    ends (see start_pending), however long it takes to write the record that references it.
+    Must be called before the GridFS file is written.
+    """
+    db.pending_artifacts.replace_one({"_id": grid_id}, {"_id": grid_id, "claimed_at": datetime.now(timezone.utc)},
+                                     upsert=True)
+    claimed = getattr(_pending, "ids", None)
+    if claimed is not None:
+        claimed.append(grid_id)
+
+
+def start_pending():
+    """Starts collecting the artifacts claimed on this thread, e.g. when a request begins."""
+    _pending.ids = []
+
+
+def release_pending(db):
+    """Releases the artifacts claimed on this thread since start_pending; their records are written by now."""
+    claimed = getattr(_pending, "ids", None) or []
+    _pending.ids = None
+    for i in range(0, len(claimed), DELETE_BATCH_SIZE):
+        db.pending_artifacts.delete_many({"_id": {"$in": claimed[i:i + DELETE_BATCH_SIZE]}})
+
+
+def pending_ids(db):
+    """Set of every GridFS id claimed less than PENDING_TTL_SECONDS ago."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=PENDING_TTL_SECONDS)
+    return {claim["_id"] for claim in db.pending_artifacts.find({"claimed_at": {"$gte": cutoff}}, {"_id": 1})}
+
+
+def referenced_ids(db):
+    """Set of every GridFS id referenced by some file record."""
+    referenced = set()
+    for file_record in db.file_records.find({}, {field: 1 for field in ARTIFACT_FIELDS}):
+        referenced.update(artifact_ids(file_record))
+    return referenced
+
+
+def collect_orphans(db, grace_seconds):
+    """
+    Deletes GridFS files that no file record references and no request or job still
+    storing them has claimed.
+    :param grace_seconds: files younger than this are skipped, which also covers
+                          files stored without a claim
+    :return: dict with the number of files and bytes reclaimed
+    """
+    # Claims are read before the records: a claim is only released once its record is written
+    referenced = pending_ids(db)
+    referenced |= referenced_ids(db)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+
+    orphans = []
+    reclaimed_bytes = 0
+    for grid_file in db.fs.files.find({"uploadDate": {"$lt": cutoff}}, {"length": 1}):
+        if grid_file["_id"] not in referenced:
+            orphans.append(grid_file["_id"])
+            reclaimed_bytes += grid_file.get("length", 0)
+
+    return {"files": delete_gridfs_files(db, orphans), "bytes": reclaimed_bytes}
+
+
+class GarbageCollector:
+    """Periodically removes orphaned GridFS files on a daemon thread and keeps reclaim metrics."""
+
+    def __init__(self, db, interval_seconds, grace_seconds):
+        """
+        :param db: database holding file_records and the GridFS collections
+        :param interval_seconds: time between background runs
+        :param grace_seconds: minimum age of a GridFS file before it can be collected
+        """
+        self.db = db
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._lock_path = None
+        self._lock_file = None
+        self.metrics = {
+            "runs": 0,
+            "files_reclaimed": 0,
+            "bytes_reclaimed": 0,
+            "last_run": None,
+            "last_duration_seconds": None,
+            "last_result": None,
+            "last_error": None,
+        }
+
+    def run_once(self):
+        """Runs one collection pass. Concurrent callers wait for the pass in progress."""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                result = collect_orphans(self.db, self.grace_seconds)
+                self.metrics["files_reclaimed"] += result["files"]
+                self.metrics["bytes_reclaimed"] += result["bytes"]
+                self.metrics["last_result"] = result
+                self.metrics["last_error"] = None
+            except Exception as e:
+                self.metrics["last_error"] = str(e)
+            self.metrics["runs"] += 1
+            self.metrics["last_run"] = datetime.now(timezone.utc)
+            self.metrics["last_duration_seconds"] = time.perf_counter() - started
+            return dict(self.metrics)
+
+    def start(self, lock_path=None):
+        """
+        Starts the background thread. Does nothing if it is already running.
+        :param lock_path: when several processes start a collector, only the one holding an
+            exclusive lock on this file collects; the others keep trying, so one of them
+            takes over once the holder exits
+        """
+        if self._thread is not None:
+            return
+        self._lock_path = lock_path
+        self._thread = threading.Thread(target=self._loop, name="gridfs-gc", daemon=True)
+        self._thread.start()
+
+    def _is_leader(self):
+        if self._lock_path is None or self._lock_file is not None:
+            return True
+        import fcntl
+        lock_file = open(self._lock_path, "a")
+        try:
+            # Released by the OS when this process exits, however it exits
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            if self._is_leader():
+                self.run_once()
@@ -0,0 +1,201 @@
+"""
+CS-410: Synthetic spectrogram matrices with Gaussian noise and injected transmitters
+@file synthetic.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+"""
+
+import numpy as np
+
+PLACEMENT_METHODS = ('random', 'equally_spaced')
+
+# Target size of the blocks a matrix is generated in
+BLOCK_CELLS = 1 << 22
+
+# Independent random streams derived from the seed
+PLACEMENT_STREAM, NOISE_STREAM, SIGNAL_STREAM = range(3)
+
+
+# Seeds stay below 2**53 so JavaScript numbers hold them exactly and the frontend can send them back
+MAX_SEED = (1 << 53) - 1
+
+
+def new_seed():
+    """Draws a fresh seed so an unseeded run can still be reproduced from its response."""
+    return int(np.random.SeedSequence().entropy % (MAX_SEED + 1))
+
+
+def _lanes(cols, bandwidth, frequency_positions):
+    """Start frequency bin of each transmitter lane; a position is the lane's center bin."""
+    if not frequency_positions:
+        frequency_positions = [cols // 2]  # Center frequency bin
+    lanes = []
+    for position in frequency_positions:
+        position = int(position)
+        if not 0 <= position < cols:
+            raise ValueError(f"Frequency position {position} is outside 0..{cols - 1}")
+        lanes.append(position - (bandwidth // 2))
+    return lanes
+
+
+def place_random(rng, rows, lanes, num_transmitters, bandwidth, active_time):
+    """
+    Places transmitters at uniformly random free (lane, start time) slots so that
+    no two overlap in both time and frequency.
+    Each lane keeps an occupancy vector over rows; a start time is free when the
+    active_time rows after it are all unoccupied, which a cumulative sum answers
+    for every start at once. Placement therefore never retries and fails with a
+    ValueError as soon as no free slot is left.
+    :return: list of (start_time, start_freq)
+    """
+    starts = rows - active_time + 1
+    occupied = np.zeros((len(lanes), rows), dtype=np.int32)
+    # Lanes closer than one bandwidth apart overlap in frequency and block each other
+    lane_starts = np.array(lanes)
+    blocks = np.abs(lane_starts[:, None] - lane_starts[None, :]) < bandwidth
+
+    transmitters = []
+    for n in range(num_transmitters):
+        window = np.zeros((len(lanes), rows + 1), dtype=np.int32)
+        np.cumsum(occupied, axis=1, out=window[:, 1:])
+        free = (window[:, active_time:active_time + starts] - window[:, :starts]) == 0
+        slots = np.flatnonzero(free)
+        if slots.size == 0:
+            raise ValueError(f"Only {n} of {num_transmitters} transmitters fit without overlapping")
+        lane, start_time = divmod(int(slots[rng.integers(slots.size)]), starts)
+        occupied[blocks[lane], start_time:start_time + active_time] = 1
+        transmitters.append((start_time, lanes[lane]))
+    return transmitters
+
+
+def place_equally_spaced(rng, rows, lanes, num_transmitters, active_time):
+    """
+    Spreads the transmitters over the lanes round-robin and spaces each lane's
+    transmitters equally in time below a randomly placed first one.
+    :return: list of (start_time, start_freq)
+    """
+    transmitters = []
+    for i, start_freq in enumerate(lanes):
+        count = len(range(i, num_transmitters, len(lanes)))
+        if count == 0:
+            continue
+        if count == 1:
+            # Handle single transmitter case - place it randomly
+            transmitters.append((int(rng.integers(0, rows - active_time + 1)), start_freq))
+            continue
+        # Place the first transmitter randomly in the top third of the matrix
+        top_third = (rows - active_time) // 3
+        min_position = max(0, top_third // 2)  # Ensure some margin from the very top
+        first_transmitter_pos = int(rng.integers(min_position, min_position + max(top_third, 1)))
+        # Equal gaps over the space left between the first transmitter and the bottom of the matrix
+        gap_size = (rows - first_transmitter_pos - active_time) // count
+        transmitters.append((first_transmitter_pos, start_freq))
+        for k in range(1, count):
+            transmitters.append((first_transmitter_pos + active_time + k * gap_size, start_freq))
+    return transmitters
+
+
+def _rng(seed, *stream):
+    """Independent generator for one part of the matrix, so blocks can be drawn in any order."""
+    return np.random.default_rng(np.random.SeedSequence([seed, *stream]))
+
+
+def place_transmitters(rows, cols, num_transmitters, bandwidth, active_time, placement_method,
+                       frequency_positions=None, seed=0):
+    """
+    Validates the parameters and chooses where each transmitter goes.
+    :param frequency_positions: center bins transmitters are placed on (default: the middle bin)
+    :return: list of (start_time, start_freq) of each transmitter
+    """
+    if rows <= 0 or cols <= 0:
+        raise ValueError("Rows and columns must be positive")
+    if not 0 < active_time <= rows:
+        raise ValueError(f"Active time must be between 1 and the number of rows ({rows})")
+    if bandwidth <= 0:
+        raise ValueError("Bandwidth must be positive")
+    if num_transmitters < 0:
+        raise ValueError("Number of transmitters cannot be negative")
+    if placement_method not in PLACEMENT_METHODS:
+        raise ValueError(f"Unknown placement method {placement_method}")
+
+    rng = _rng(seed, PLACEMENT_STREAM)
+    lanes = _lanes(cols, bandwidth, frequency_positions)
+    if placement_method == "random":
+        return place_random(rng, rows, lanes, num_transmitters, bandwidth, active_time)
+    return place_equally_spaced(rng, rows, lanes, num_transmitters, active_time)
+
+
+def iter_matrix_rows(rows, cols, num_transmitters, transmitter_mean, transmitter_sd, noise_mean, noise_sd,
+                     bandwidth, active_time, placement_method, frequency_positions=None, seed=0,
+                     block_rows=None, dtype=np.float64):
+    """
+    Generates the matrix block by block so callers can stream matrices larger than memory.
+    The values do not depend on block_rows.
+    :param block_rows: rows per block (default: about 4M cells per block)
+    :return: iterator of (first row, block of rows x cols)
+    """
+    transmitters = place_transmitters(rows, cols, num_transmitters, bandwidth, active_time, placement_method,
+                                      frequency_positions, seed)
+    if block_rows is None:
+        block_rows = max(1, BLOCK_CELLS // cols)
+    # Successive draws from one generator continue the same sequence, so the
+    # noise does not change with the block size
+    noise_rng = _rng(seed, NOISE_STREAM)
+    for r0 in range(0, rows, block_rows):
+        r1 = min(r0 + block_rows, rows)
+        # Noise is drawn and scaled in place to avoid temporaries the size of the block
+        block = noise_rng.standard_normal(size=(r1 - r0, cols), dtype=dtype)
+        block *= noise_sd
+        block += noise_mean
+        # Inject each transmitter overlapping the block as one slice, clipped to the matrix bounds
+        for i, (start_time, start_freq) in enumerate(transmitters):
+            t0, t1 = max(start_time, r0), min(start_time + active_time, r1)
+            f0, f1 = max(start_freq, 0), min(start_freq + bandwidth, cols)
+            if t0 < t1 and f0 < f1:
+                signal = _rng(seed, SIGNAL_STREAM, i).normal(transmitter_mean, transmitter_sd,
+                                                             size=(active_time, bandwidth))
+                block[t0 - r0:t1 - r0, f0:f1] += signal[t0 - start_time:t1 - start_time,
+                                                        f0 - start_freq:f1 - start_freq]
+        yield r0, block
+
+
+def generate_matrix(rows, cols, num_transmitters, transmitter_mean, transmitter_sd, noise_mean, noise_sd,
+                    bandwidth, active_time, placement_method, frequency_positions=None, seed=None,
+                    dtype=np.float64):
+    """
+    Generates a synthetic data matrix (time x frequency) with Gaussian noise and
+    injected transmitter signals. The same seed always yields the same matrix.
+    :param seed: seed every random draw derives from (default: a fresh one)
+    :return: (matrix, list of (start_time, start_freq) of each transmitter)
+    """
+    seed = new_seed() if seed is None else seed
+    matrix = np.empty((rows, cols), dtype=dtype)
+    for r0, block in iter_matrix_rows(rows, cols, num_transmitters, transmitter_mean, transmitter_sd,
+                                      noise_mean, noise_sd, bandwidth, active_time, placement_method,
+                                      frequency_positions, seed, dtype=dtype):
+        matrix[r0:r0 + len(block)] = block
+    return matrix, place_transmitters(rows, cols, num_transmitters, bandwidth, active_time, placement_method,
+                                      frequency_positions, seed)
+
+
+def preview_matrix(max_rows, max_cols, **spec):
+    """
+    Mean-pools the matrix described by spec (the iter_matrix_rows arguments) down to
+    at most max_rows x max_cols, one block at a time, for plotting matrices too large to hold.
+    """
+    rows, cols = spec["rows"], spec["cols"]
+    row_factor = -(-rows // max_rows)
+    col_factor = -(-cols // max_cols)
+    out_cols = cols // col_factor
+    # Blocks hold whole row groups so each pools independently
+    block_rows = row_factor * max(1, BLOCK_CELLS // (cols * row_factor))
+    pooled = []
+    for _, block in iter_matrix_rows(block_rows=block_rows, **spec):
+        block = block[:, :out_cols * col_factor].reshape(len(block), out_cols, col_factor).mean(axis=2)
+        full = len(block) // row_factor * row_factor
+        if full:
+            pooled.append(block[:full].reshape(-1, row_factor, out_cols).mean(axis=1))
+        if full < len(block):
+            # The last rows of the matrix form a shorter group
+            pooled.append(block[full:].mean(axis=0, keepdims=True))
+    return np.concatenate(pooled)
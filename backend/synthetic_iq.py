@@ -0,0 +1,227 @@
+"""
+CS-410: Synthetic complex IQ captures with matching SigMF metadata and ground-truth annotations
+@file synthetic_iq.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Usage: python synthetic_iq.py OUTPUT_BASENAME [--duration SECONDS] [--sample-rate HZ]
+           [--center-frequency HZ] [--tones N] [--bursts N] [--scenario FILE] [--seed N]
+Writes OUTPUT_BASENAME.cfile (cf32_le samples) and OUTPUT_BASENAME.sigmf-meta, ready for /upload.
+
+A scenario is a JSON list of emitters; frequencies are offsets from the center frequency:
+    {"kind": "tone", "frequency": 1e6, "snr_db": 10, "start": 0.0, "end": 0.5}
+    {"kind": "burst", "frequency": -2e6, "symbol_rate": 250e3, "snr_db": 5,
+     "start": 0.1, "end": 0.9, "burst_on": 0.01, "burst_off": 0.02}
+A burst emitter transmits QPSK with rectangular pulses for burst_on seconds every
+burst_on + burst_off seconds between start and end. SNRs are per-sample power
+ratios against the noise power. Every burst (and every tone) becomes one annotation.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import numpy as np
+
+from SigMF import PSD_FFT_SIZE
+
+# Samples generated per chunk; bounds memory independently of the capture length
+CHUNK_SAMPLES = 1 << 20
+
+# Default noise floor per sample. AirVIEW expects spectrogram power below 0 dB, as
+# in real captures scaled to full scale, so the floor sits well below that
+NOISE_POWER = 1e-9
+
+# QPSK constellation, unit power
+QPSK = (np.array([1 + 1j, -1 + 1j, -1 - 1j, 1 - 1j]) / np.sqrt(2)).astype(np.complex64)
+
+
+def random_emitters(rng, sample_rate, duration, num_tones=1, num_bursts=3):
+    """Draws a scenario of tones and bursty QPSK transmitters spread over the band."""
+    emitters = []
+    for _ in range(num_tones):
+        start = rng.uniform(0, duration / 2)
+        emitters.append({
+            "kind": "tone",
+            "frequency": rng.uniform(-0.4, 0.4) * sample_rate,
+            "snr_db": rng.uniform(0, 20),
+            "start": start,
+            "end": rng.uniform(start, duration),
+        })
+    for _ in range(num_bursts):
+        start = rng.uniform(0, duration / 2)
+        symbol_rate = sample_rate / rng.choice([8, 16, 32, 64])
+        emitters.append({
+            "kind": "burst",
+            "frequency": rng.uniform(-0.4, 0.4) * sample_rate,
+            "symbol_rate": symbol_rate,
+            "snr_db": rng.uniform(0, 20),
+            "start": start,
+            "end": rng.uniform(start, duration),
+            "burst_on": rng.uniform(0.02, 0.1) * duration,
+            "burst_off": rng.uniform(0.02, 0.1) * duration,
+        })
+    return emitters
+
+
+def _sample_window(emitter, sample_rate, num_samples):
+    """First and one-past-last sample of the emitter's activity, clipped to the capture."""
+    start = min(max(int(round(emitter["start"] * sample_rate)), 0), num_samples)
+    end = min(max(int(round(emitter.get("end", num_samples / sample_rate) * sample_rate)), start), num_samples)
+    return start, end
+
+
+def _burst_period(emitter, sample_rate):
+    """(on samples, period samples) of a burst emitter; a tone is on for its whole window."""
+    if emitter["kind"] != "burst":
+        return None, None
+    on = max(int(round(emitter["burst_on"] * sample_rate)), 1)
+    return on, on + max(int(round(emitter["burst_off"] * sample_rate)), 0)
+
+
+def emitter_intervals(emitter, sample_rate, num_samples):
+    """(sample_start, sample_count) of every transmission of an emitter."""
+    start, end = _sample_window(emitter, sample_rate, num_samples)
+    if start >= end:
+        return []
+    on, period = _burst_period(emitter, sample_rate)
+    if on is None:
+        return [(start, end - start)]
+    starts = np.arange(start, end, period)
+    counts = np.minimum(starts + on, end) - starts
+    return list(zip(starts.tolist(), counts.tolist()))
+
+
+def _hash_symbols(symbol_index, key):
+    """Pseudo-random QPSK symbol indices that depend only on the symbol's position, so chunks line up."""
+    x = symbol_index.astype(np.uint64) + np.uint64(key)
+    # splitmix64 finalizer
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x & np.uint64(3)).astype(np.intp)
+
+
+def iter_iq(emitters, sample_rate, num_samples, noise_power=NOISE_POWER, seed=0, chunk_samples=CHUNK_SAMPLES):
+    """
+    Generates the capture chunk by chunk. The samples do not depend on chunk_samples.
+    :param noise_power: power of the complex Gaussian noise floor
+    :return: iterator of complex64 arrays
+    """
+    rng = np.random.default_rng(seed)
+    noise_scale = np.float32(np.sqrt(noise_power / 2))
+    windows = [_sample_window(emitter, sample_rate, num_samples) for emitter in emitters]
+    for n0 in range(0, num_samples, chunk_samples):
+        n1 = min(n0 + chunk_samples, num_samples)
+        # Real and imaginary parts interleaved, viewed as complex64 without a copy
+        chunk = rng.standard_normal(2 * (n1 - n0), dtype=np.float32).view(np.complex64)
+        chunk *= noise_scale
+
+        for e, (emitter, (start, end)) in enumerate(zip(emitters, windows)):
+            s0, s1 = max(start, n0), min(end, n1)
+            if s0 >= s1:
+                continue
+            idx = np.arange(s0, s1, dtype=np.int64)
+            amplitude = np.sqrt(noise_power * 10 ** (emitter["snr_db"] / 10))
+            # Phase from the absolute sample index keeps the carrier continuous across chunks
+            cycles = np.mod(emitter["frequency"] / sample_rate * idx, 1.0)
+            signal = (amplitude * np.exp(2j * np.pi * cycles)).astype(np.complex64)
+            on, period = _burst_period(emitter, sample_rate)
+            if on is not None:
+                sps = max(int(round(sample_rate / emitter["symbol_rate"])), 1)
+                signal *= QPSK[_hash_symbols(idx // sps, (seed << 16) + e)]
+                signal[(idx - start) % period >= on] = 0
+            chunk[s0 - n0:s1 - n0] += signal
+        yield chunk
+
+
+def annotations(emitters, sample_rate, center_frequency, num_samples):
+    """SigMF annotations of every transmission, sorted by start sample."""
+    result = []
+    for emitter in emitters:
+        if emitter["kind"] == "burst":
+            # Main lobe of rectangular-pulse QPSK
+            half_width = emitter["symbol_rate"]
+            label = "burst"
+        else:
+            # A tone occupies a single bin of the displayed spectrogram
+            half_width = sample_rate / PSD_FFT_SIZE / 2
+            label = "tone"
+        frequency = center_frequency + emitter["frequency"]
+        for sample_start, sample_count in emitter_intervals(emitter, sample_rate, num_samples):
+            result.append({
+                "core:sample_start": sample_start,
+                "core:sample_count": sample_count,
+                "core:freq_lower_edge": frequency - half_width,
+                "core:freq_upper_edge": frequency + half_width,
+                "core:label": label,
+                "core:comment": f"ground truth, SNR {emitter['snr_db']:.1f} dB",
+            })
+    result.sort(key=lambda annotation: annotation["core:sample_start"])
+    return result
+
+
+def sigmf_metadata(emitters, sample_rate, center_frequency, num_samples, sha512, description):
+    """The .sigmf-meta document of a generated capture."""
+    return {
+        "global": {
+            "core:author": "GC3 synthetic_iq.py",
+            "core:datatype": "cf32_le",
+            "core:description": description,
+            "core:num_channels": 1,
+            "core:sample_rate": sample_rate,
+            "core:sha512": sha512,
+            "core:version": "1.2.6",
+        },
+        "captures": [{
+            "core:datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "core:frequency": center_frequency,
+            "core:sample_start": 0,
+        }],
+        "annotations": annotations(emitters, sample_rate, center_frequency, num_samples),
+    }
+
+
+def write_capture(basename, emitters, sample_rate, center_frequency, num_samples, noise_power=NOISE_POWER, seed=0,
+                  chunk_samples=CHUNK_SAMPLES):
+    """
+    Streams a capture to basename.cfile and writes basename.sigmf-meta next to it.
+    :return: the metadata document
+    """
+    sha512 = hashlib.sha512()
+    with open(f"{basename}.cfile", "wb") as f:
+        for chunk in iter_iq(emitters, sample_rate, num_samples, noise_power, seed, chunk_samples):
+            data = chunk.tobytes()
+            sha512.update(data)
+            f.write(data)
+    metadata = sigmf_metadata(emitters, sample_rate, center_frequency, num_samples, sha512.hexdigest(),
+                              f"Synthetic capture with {len(emitters)} emitter(s), seed {seed}")
+    with open(f"{basename}.sigmf-meta", "w") as f:
+        json.dump(metadata, f, indent=4)
+    return metadata
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("basename", help="output path without extension")
+    parser.add_argument("--duration", type=float, default=1.0, help="capture length in seconds")
+    parser.add_argument("--sample-rate", type=float, default=8e6)
+    parser.add_argument("--center-frequency", type=float, default=915e6)
+    parser.add_argument("--noise-power", type=float, default=NOISE_POWER)
+    parser.add_argument("--tones", type=int, default=1, help="random tones (ignored with --scenario)")
+    parser.add_argument("--bursts", type=int, default=3, help="random burst emitters (ignored with --scenario)")
+    parser.add_argument("--scenario", help="JSON file with the list of emitters")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    num_samples = int(args.duration * args.sample_rate)
+    if args.scenario:
+        with open(args.scenario) as f:
+            emitters = json.load(f)
+    else:
+        emitters = random_emitters(np.random.default_rng(args.seed), args.sample_rate, args.duration,
+                                   args.tones, args.bursts)
+    metadata = write_capture(args.basename, emitters, args.sample_rate, args.center_frequency, num_samples,
+                             args.noise_power, args.seed)
+    print(f"Wrote {num_samples} samples ({num_samples * 8 / 2**20:.1f} MiB) to {args.basename}.cfile "
+          f"with {len(metadata['annotations'])} annotation(s) in {args.basename}.sigmf-meta")
@@ -0,0 +1,82 @@
+"""
+CS-410: Tests that migrating file records keeps the annotations they already store
+@file test_migrations.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Run with: python -m unittest test_migrations (requires `pip install mongomock`)
+"""
+
+import os
+import unittest
+
+try:
+    import mongomock
+    import mongomock.gridfs
+except ImportError:
+    mongomock = None
+
+from migrations import migrate_record
+
+META_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qpsk_in_noise.sigmf-meta")
+LEGACY_DETECTION = {
+    "core:freq_lower_edge": 914000000, "core:freq_upper_edge": 916000000,
+    "core:sample_start": 0, "core:sample_count": 1024, "core:label": "Transmitter",
+}
+
+
+@unittest.skipIf(mongomock is None, "requires mongomock")
+class MigrateRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        from gridfs import GridFS
+        mongomock.gridfs.enable_gridfs_integration()
+        self.db = mongomock.MongoClient()["files_db"]
+        self.fs = GridFS(self.db)
+        with open(META_PATH, "rb") as f:
+            self.meta_file_id = self.fs.put(f.read(), filename="capture.sigmf-meta")
+
+    def insert_record(self, **fields):
+        record_id = self.db.file_records.insert_one(dict(fields, meta_file_id=self.meta_file_id)).inserted_id
+        return self.db.file_records.find_one({"_id": record_id})
+
+    def annotations(self, record, source):
+        return list(self.db.annotations.find({"file_id": record["_id"], "source": source}))
+
+    def test_schema_v2_annotations_array_moves_to_collection(self):
+        record = self.insert_record(schema_version=2, annotations=[
+            {"id": "a1", "sample_start": 0, "sample_count": 10, "freq_lower_edge": 1.0, "freq_upper_edge": 2.0,
+             "label": "manual", "comment": ""},
+        ])
+        migrate_record(self.db, self.fs, record)
+        manual = self.annotations(record, "manual")
+        self.assertEqual([annotation["client_id"] for annotation in manual], ["a1"])
+        self.assertNotIn("annotations", self.db.file_records.find_one({"_id": record["_id"]}))
+
+    def test_schema_v3_keeps_collection_annotations(self):
+        record = self.insert_record(schema_version=3, airview_annotations=[LEGACY_DETECTION])
+        self.db.annotations.insert_one({
+            "file_id": record["_id"], "source": "manual", "sample_start": 0, "sample_end": 10,
+            "freq_lower_edge": 1.0, "freq_upper_edge": 2.0, "label": "kept", "comment": "",
+        })
+        migrate_record(self.db, self.fs, record)
+        self.assertEqual([annotation["label"] for annotation in self.annotations(record, "manual")], ["kept"])
+        airview = self.annotations(record, "airview")
+        self.assertEqual(len(airview), 1)
+        self.assertEqual(airview[0]["sample_end"], 1024)
+        migrated = self.db.file_records.find_one({"_id": record["_id"]})
+        self.assertEqual(migrated["detection_count"], 1)
+        self.assertNotIn("airview_annotations", migrated)
+
+    def test_current_detections_leave_airview_annotations_alone(self):
+        record = self.insert_record(schema_version=3, airview_annotations=[LEGACY_DETECTION])
+        migrate_record(self.db, self.fs, record)
+        # Edited after the first migration; migrating again must not rebuild it from the table
+        self.db.annotations.update_one({"file_id": record["_id"], "source": "airview"}, {"$set": {"label": "edited"}})
+        migrate_record(self.db, self.fs, self.db.file_records.find_one({"_id": record["_id"]}))
+        self.assertEqual([annotation["label"] for annotation in self.annotations(record, "airview")], ["edited"])
+        self.assertEqual(len(self.annotations(record, "manual")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,15 @@
+"""
+CS-410: WSGI entry point for serving the backend with a production server
+@file wsgi.py
+@authors Jun Cho, Will Cho, Grace Johnson, Connor Whynott
+@collaborators None
+
+Run with, for example:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import create_app
+
+# The app is preloaded in the gunicorn master, which must not run background threads that
+# forked workers could inherit mid-operation; post_fork starts the garbage collector instead
+app = create_app(start_collector=False)
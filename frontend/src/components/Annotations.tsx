@@ -10,6 +10,7 @@ import React, { useState } from 'react';
 
 export interface Annotation {
   id: string;
+  annotation_id?: string; // backend id, when it differs from id (annotations saved through /save-file)
   corners: { freq1: number; time1: number; freq2: number; time2: number };
   label: string;
   comment: string;
@@ -32,6 +32,8 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
   const [selectedCFile, setSelectedCFile] = useState<File | null>(null);
   const [selectedMetaFile, setSelectedMetaFile] = useState<File | null>(null);
   const [savedFiles, setSavedFiles] = useState<SavedFile[]>([]);
+  const [savedFilesCursor, setSavedFilesCursor] = useState<string | null>(null); // Cursor for the next page of saved files
+  const [savedFilesSearch, setSavedFilesSearch] = useState<string>('');
   const [statusMessage, setStatusMessage] = useState<string>('Please upload a .cfile and .sigmf-meta file.');
   const [selectedCFileName, setSelectedCFileName] = useState<string | null>(null);
   const [selectedMetaFileName, setSelectedMetaFileName] = useState<string | null>(null);
@@ -50,6 +52,7 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
     maxFreq: number;
     annotations: { 
       id: string; 
+      annotation_id?: string;
       corners: { freq1: number; time1: number; freq2: number; time2: number }; 
       label: string; 
       comment: string; 
@@ -59,7 +62,7 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
   const spectrogramRef = useRef<HTMLDivElement | null>(null);
 
   const [annotations, setAnnotations] = useState<
-    { id: string; corners: { freq1: number; time1: number; freq2: number; time2: number }; label: string; comment: string; display: boolean}[]
+    { id: string; annotation_id?: string; corners: { freq1: number; time1: number; freq2: number; time2: number }; label: string; comment: string; display: boolean}[]
   >([]);
   const [annotationLabel, setAnnotationLabel] = useState<string>(''); // State for the annotation label
   const [annotationComment, setAnnotationComment] = useState<string>(''); // State for the annotation comment
@@ -189,7 +192,7 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
 
       // Immediately set spectrogram image
       if (result.spectrogram) {
-        setPlotImages((prevImages) => ({ ...prevImages, spectrogram: result.spectrogram }));
+        setPlotImages((prevImages) => ({ ...prevImages, spectrogram: `data:image/png;base64,${result.spectrogram}` }));
         setActiveTab('spectrogram'); // Ensure spectrogram is shown first
       }
 
@@ -240,34 +243,36 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
     setStatusMessage('File cleared. Please upload new files.');
   };
   
-  // Fetch and store images dynamically
+  // Point each plot tab at its image URL from a bundle response
+  const applyBundlePlots = (plots: { [key: string]: { url: string } } | undefined) => {
+    if (!plots) {
+      return;
+    }
+    setPlotImages((prevImages) => {
+      const nextImages = { ...prevImages };
+      for (const [plot, info] of Object.entries(plots)) {
+        nextImages[plot] = `http://127.0.0.1:5000${info.url}`;
+      }
+      return nextImages;
+    });
+    if (plots.spectrogram) {
+      setActiveTab('spectrogram');  // Ensure spectrogram is shown first
+    }
+  };
+
+  // Fetch every plot URL for a file in a single bundle request
   const fetchPlots = async (fileId: string) => {
-    const plotTypes = ['spectrogram', 'time_domain', 'freq_domain', 'iq_plot'];
-  
-    for (const plot of plotTypes) {
-      try {
-        console.log(`Fetching ${plot}...`);
-  
-        const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/${plot}`);
-        const result = await response.json();
-  
-        if (result.error) {
-          console.error(`Error fetching ${plot}:`, result.error);
-          continue;
-        }
-  
-        console.log(`Fetched ${plot}: ✅ Success`);
-  
-        // Ensure the spectrogram is set first
-        setPlotImages((prevImages) => ({ ...prevImages, [plot]: result.image }));
-  
-        if (plot === 'spectrogram') {
-          setActiveTab('spectrogram');  // Ensure spectrogram is shown first
-        }
-  
-      } catch (error) {
-        console.error(`Error fetching ${plot}:`, error);
+    try {
+      const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/bundle?fields=plots`);
+      const result = await response.json();
+
+      if (result.error) {
+        console.error('Error fetching plots:', result.error);
+        return;
       }
+      applyBundlePlots(result.plots);
+    } catch (error) {
+      console.error('Error fetching plots:', error);
     }
   };
 
@@ -312,11 +317,13 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
   const handleLoadFile = async (fileId: string) => {
     setActiveTab('spectrogram');  
     setStatusMessage('Loading file...');
-    fetchPlots(fileId);
   
     try {
-      const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/data`);
-      const result = await response.json();
+      // Plots and file data arrive together in one round trip
+      const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/bundle?fields=data,plots`);
+      const bundle = await response.json();
+      const result = bundle.error ? bundle : bundle.data;
+      applyBundlePlots(bundle.plots);
   
       if (result.error) {
         console.error("Error fetching airview annotations:", result.error);
@@ -368,10 +375,18 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
   };
   
 
-  // Fetch saved files from the database
-  const fetchSavedFiles = async () => {
+  // Fetch a page of saved files from the database. Without a cursor the list is replaced,
+  // with one the next page is appended.
+  const fetchSavedFiles = async (search: string = savedFilesSearch, cursor: string | null = null) => {
     try {  
-      const response = await fetch('http://127.0.0.1:5000/files');
+      const params = new URLSearchParams({ sort: 'filename', limit: '100' });
+      if (search) {
+        params.set('q', search);
+      }
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
+      const response = await fetch(`http://127.0.0.1:5000/files?${params.toString()}`);
       const result = await response.json();
   
       if (result.error) {
@@ -380,16 +395,24 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
         return;
       }  
       if (Array.isArray(result.files)) {
-        setSavedFiles(result.files);
+        setSavedFiles((prevFiles) => (cursor ? [...prevFiles, ...result.files] : result.files));
+        setSavedFilesCursor(result.next_cursor ?? null);
       } else {
         console.error("Unexpected response format:", result);
         setSavedFiles([]);
+        setSavedFilesCursor(null);
       }
     } catch (error) {
       console.error("Error fetching saved files:", error);
       setStatusMessage('Error fetching saved files');
     }
   };
+
+  // Re-query the server whenever the saved files search changes
+  const handleSavedFilesSearch = (search: string) => {
+    setSavedFilesSearch(search);
+    fetchSavedFiles(search);
+  };
   
   // Fetch saved files on component mount
   useEffect(() => {
@@ -563,45 +586,41 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
     const time2 = Math.max(calculateHorizontalCursorPosition(horizontalCursors[0]), calculateHorizontalCursorPosition(horizontalCursors[1]));
   
     const newAnnotation = {
-      id: `${Date.now()}`, // Unique ID for the annotation
       corners: { freq1, time1, freq2, time2 },
       label: annotationLabel.trim(),
       comment: annotationComment.trim(), // Include the comment
       display: true,
     };
   
-    // Update the frontend state
-    setAnnotations((prev) => [...prev, newAnnotation]);
-    setAnnotationLabel(''); // Clear the label input field
-    setAnnotationComment(''); // Clear the comment input field
-  
-    // Update the fileData state to include the new annotations
-    setFileData((prev) => {
-      if (!prev) return null;
-      return {
-        ...prev,
-        annotations: [...annotations, newAnnotation], // Include the new annotation
-      };
-    });
-  
-    // Send the updated annotations to the backend
+    // Save only the new annotation; the backend assigns its id
     try {
-      const response = await fetch(`http://127.0.0.1:5000/save-file`, {
+      const response = await fetch(`http://127.0.0.1:5000/file/${currentFileId}/annotations`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          file_id: currentFileId, // Pass the current file ID
-          annotations: [...annotations, newAnnotation], // Include the new annotation
-        }),
+        body: JSON.stringify(newAnnotation),
       });
   
       const result = await response.json();
       if (result.error) {
         console.error('Error saving annotation:', result.error);
         alert('Failed to save annotation to the backend.');
-      } else {
-        console.log('Annotation saved successfully:', result.message);
+        return;
       }
+      console.log('Annotation saved successfully:', result.id);
+
+      // Update the frontend state
+      setAnnotations((prev) => [...prev, result]);
+      setAnnotationLabel(''); // Clear the label input field
+      setAnnotationComment(''); // Clear the comment input field
+  
+      // Update the fileData state to include the new annotation
+      setFileData((prev) => {
+        if (!prev) return null;
+        return {
+          ...prev,
+          annotations: [...prev.annotations, result],
+        };
+      });
     } catch (error) {
       console.error('Error saving annotation:', error);
       alert('Failed to save annotation to the backend.');
@@ -609,6 +628,7 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
   };
 
   const deleteAnnotation = async (annotationId: string) => {
+    const deleted = annotations.find((annotation) => annotation.id === annotationId);
     const updatedAnnotations = annotations.filter((annotation) => annotation.id !== annotationId);
     setAnnotations(updatedAnnotations);
   
@@ -623,14 +643,11 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
   
     // Update the backend
     try {
-      const response = await fetch(`http://127.0.0.1:5000/save-file`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          file_id: currentFileId, // Pass the current file ID
-          annotations: updatedAnnotations, // Send the updated list of annotations
-        }),
-      });
+      // Annotations saved through /save-file keep the frontend's id, so delete by the backend's
+      const response = await fetch(
+        `http://127.0.0.1:5000/file/${currentFileId}/annotations/${deleted?.annotation_id ?? annotationId}`,
+        { method: 'DELETE' },
+      );
   
       const result = await response.json();
       if (result.error) {
@@ -807,7 +824,7 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
           {plotImages[activeTab] ? (
             <div className="spectrogram-container" ref={spectrogramRef}>
               <img
-                src={`data:image/png;base64,${plotImages[activeTab]}`}
+                src={plotImages[activeTab] ?? undefined}
                 alt={activeTab}
                 className="plot-image"
               />
@@ -908,6 +925,9 @@ const FileHandle: React.FC<FileHandleProps> = ({ fileId, onFileSelect }) => {
         savedFiles={savedFiles}
         onDelete={handleSingleDelete}
         onLoad={handleLoadFile}
+        onSearch={handleSavedFilesSearch}
+        hasMore={savedFilesCursor !== null}
+        onLoadMore={() => fetchSavedFiles(savedFilesSearch, savedFilesCursor)}
       />
     </main>
   );
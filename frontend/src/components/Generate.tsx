@@ -9,11 +9,22 @@
 import React, { useState } from 'react';
 import GeneratePopup from './GeneratePopup';
 
+// Ground-truth position of a generated transmitter, in rows and columns of the matrix
+interface GeneratedTransmitter {
+  start_time: number;
+  end_time: number;
+  start_freq: number;
+  end_freq: number;
+}
+
 const Generate: React.FC<{ onPlotGenerated: (plot: string | null) => void }> = ({ onPlotGenerated }) => {
   const [showPopup, setShowPopup] = useState(false);
   const [generatedPlot, setGeneratedPlot] = useState<string | null>(null);
-  const [csvData, setCsvData] = useState<string | null>(null);
-  const [filename, setFilename] = useState<string>("generated_data.csv");
+  // The backend streams the CSV from this URL; it is never held in the page
+  const [csvUrl, setCsvUrl] = useState<string | null>(null);
+  // Seed and transmitters of the last generated matrix, as returned by /generate
+  const [seed, setSeed] = useState<number | null>(null);
+  const [transmitters, setTransmitters] = useState<GeneratedTransmitter[]>([]);
 
   const handleGenerateClick = () => {
     setShowPopup(true);
@@ -22,43 +33,29 @@ const Generate: React.FC<{ onPlotGenerated: (plot: string | null) => void }> = (
   const handleClosePopup = () => {
     setShowPopup(false);
     setGeneratedPlot(null);
-    setCsvData(null);
+    setCsvUrl(null);
+    setTransmitters([]);
   };
 
   const handleClosePlot = () => {
     setGeneratedPlot(null);
-    setCsvData(null);
+    setCsvUrl(null);
+    setTransmitters([]);
   };
 
   const handleDownloadCSV = () => {
-    if (!csvData) return;
-    
-    // Create a blob from the CSV data
-    const blob = new Blob([csvData], { type: 'text/csv;charset=utf-8;' });
-    
-    // Create a URL for the blob
-    const url = URL.createObjectURL(blob);
+    if (!csvUrl) return;
     
-    // Create a temporary link element
+    // The response is sent as an attachment with its own filename, so following the link downloads it
     const link = document.createElement('a');
-    link.href = url;
-    link.setAttribute('download', filename);
-    
-    // Append the link to the body
+    link.href = csvUrl;
     document.body.appendChild(link);
-    
-    // Trigger a click on the link
     link.click();
-    
-    // Clean up
     document.body.removeChild(link);
-    URL.revokeObjectURL(url);
   };
 
   const handleGenerateData = async (data: any) => {
     try {
-      setFilename(`${data.placementMethod}_transmitters_${data.numTransmitters}_${Date.now()}.csv`);
-      
       const response = await fetch('http://127.0.0.1:5000/generate', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
@@ -67,9 +64,13 @@ const Generate: React.FC<{ onPlotGenerated: (plot: string | null) => void }> = (
 
       if (response.ok) {
         const result = await response.json();
-        setGeneratedPlot(result.plot);
-        setCsvData(result.csv);
-        onPlotGenerated(result.plot);
+        // The response only carries the seed, transmitter positions and URLs of the outputs
+        const plotUrl = `http://127.0.0.1:5000${result.png_url}`;
+        setGeneratedPlot(plotUrl);
+        setCsvUrl(`http://127.0.0.1:5000${result.csv_url}`);
+        setSeed(result.seed);
+        setTransmitters(result.transmitters ?? []);
+        onPlotGenerated(plotUrl);
       } else {
         const error = await response.json();
         console.error('Backend error:', error.error);
@@ -92,6 +93,7 @@ const Generate: React.FC<{ onPlotGenerated: (plot: string | null) => void }> = (
               <GeneratePopup 
                 onClose={handleClosePopup} 
                 onGenerate={handleGenerateData} 
+                lastSeed={seed}
               />
             </div>
             
@@ -104,13 +106,33 @@ const Generate: React.FC<{ onPlotGenerated: (plot: string | null) => void }> = (
                   </div>
                   <div className="spectrogram-image-container">
                     <img 
-                      src={`data:image/png;base64,${generatedPlot}`} 
+                      src={generatedPlot} 
                       alt="Generated Spectrogram" 
                       className="spectrogram-image"
                     />
                   </div>
                   
-                  {csvData && (
+                  <div className="generated-details">
+                    <div>Seed: <code>{seed}</code></div>
+                    <div>{transmitters.length} transmitter(s)</div>
+                    {transmitters.length > 0 && (
+                      <table className="generated-transmitters">
+                        <thead>
+                          <tr><th>Rows</th><th>Columns</th></tr>
+                        </thead>
+                        <tbody>
+                          {transmitters.map((t, i) => (
+                            <tr key={i}>
+                              <td>{t.start_time}–{t.end_time}</td>
+                              <td>{t.start_freq}–{t.end_freq}</td>
+                            </tr>
+                          ))}
+                        </tbody>
+                      </table>
+                    )}
+                  </div>
+
+                  {csvUrl && (
                     <div className="download-container">
                       <button 
                         className="download-btn"
@@ -8,8 +8,13 @@
 
 import React, { useState } from 'react';
 
+// Largest seed a JavaScript number holds exactly; the backend only hands out seeds up to it
+const MAX_SEED = Number.MAX_SAFE_INTEGER;
+
 interface GeneratePopupProps {
   onClose: () => void;
+  // Seed of the last generated matrix, shown so it can be reused
+  lastSeed?: number | null;
   onGenerate: (data: {
     rows: number | null;
     cols: number | null;
@@ -23,10 +28,11 @@ interface GeneratePopupProps {
     matrixFilename: string;
     transmittersFilename: string;
     placementMethod: string;
+    seed: number | null;
   }) => void;
 }
 
-const GeneratePopup: React.FC<GeneratePopupProps> = ({ onClose, onGenerate }) => {
+const GeneratePopup: React.FC<GeneratePopupProps> = ({ onClose, onGenerate, lastSeed = null }) => {
   const [rows, setRows] = useState<number | null>(1000);
   const [cols, setCols] = useState<number | null>(1024);
   const [numTransmitters, setNumTransmitters] = useState<number | null>(5);
@@ -37,6 +43,8 @@ const GeneratePopup: React.FC<GeneratePopupProps> = ({ onClose, onGenerate }) =>
   const [bandwidth, setBandwidth] = useState<number | null>(200);
   const [activeTime, setActiveTime] = useState<number | null>(10);
   const [placementMethod, setPlacementMethod] = useState<string>('equally_spaced');
+  // Optional; the same seed reproduces the same matrix
+  const [seed, setSeed] = useState<number | null>(null);
   const [error, setError] = useState<string | null>(null);
 
   const handleInputChange = (
@@ -90,6 +98,10 @@ const GeneratePopup: React.FC<GeneratePopupProps> = ({ onClose, onGenerate }) =>
       setError('Active Time is required');
       return false;
     }
+    if (seed !== null && (!Number.isInteger(seed) || seed < 0 || seed > MAX_SEED)) {
+      setError(`Seed must be a whole number between 0 and ${MAX_SEED}`);
+      return false;
+    }
     
     return true;
   };
@@ -114,6 +126,7 @@ const GeneratePopup: React.FC<GeneratePopupProps> = ({ onClose, onGenerate }) =>
       matrixFilename: 'output_matrix.csv',
       transmittersFilename: 'output_transmitters.csv',
       placementMethod,
+      seed,
     });
   };
 
@@ -230,6 +243,21 @@ const GeneratePopup: React.FC<GeneratePopupProps> = ({ onClose, onGenerate }) =>
             onChange={(e) => handleInputChange(e.target.value, setActiveTime)} 
           />
         </label>
+
+        <label>
+          Seed (optional):
+          <input 
+            type="number" 
+            value={seed === null ? '' : seed} 
+            onChange={(e) => handleInputChange(e.target.value, setSeed)} 
+          />
+        </label>
+        {lastSeed !== null && (
+          <div className="last-seed">
+            Last seed: <code>{lastSeed}</code>
+            <button type="button" onClick={() => { setSeed(lastSeed); setError(null); }}>Reuse</button>
+          </div>
+        )}
         
         <button type="submit">Generate</button>
       </form>
@@ -6,7 +6,7 @@
  * @description This component is used to display the saved files for the application.
  */
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { IconButton } from '@mui/material';
 import EditIcon from '@mui/icons-material/Edit';
 
@@ -20,19 +20,33 @@ interface SavedFilesProps {
   savedFiles: SavedFile[];
   onDelete: (fileId: string) => void;
   onLoad: (fileId: string) => void;
+  onSearch?: (searchTerm: string) => void; // server-side search over the whole archive
+  hasMore?: boolean;
+  onLoadMore?: () => void;
 }
 
-const SavedFiles: React.FC<SavedFilesProps> = ({ savedFiles, onDelete, onLoad }) => {
+const SavedFiles: React.FC<SavedFilesProps> = ({ savedFiles, onDelete, onLoad, onSearch, hasMore, onLoadMore }) => {
   const [searchTerm, setSearchTerm] = useState('');
   const [files, setFiles] = useState(savedFiles);
   const [editingId, setEditingId] = useState<string | null>(null);
   const [editingName, setEditingName] = useState('');
+  const isFirstSearch = useRef(true); // the parent already loads the first page on mount
 
   // Update local state when props change
   useEffect(() => {
     setFiles(savedFiles);
   }, [savedFiles]);
 
+  // Debounce the search so the server is queried once typing pauses
+  useEffect(() => {
+    if (!onSearch || isFirstSearch.current) {
+      isFirstSearch.current = false;
+      return;
+    }
+    const timeout = setTimeout(() => onSearch(searchTerm), 300);
+    return () => clearTimeout(timeout);
+  }, [searchTerm]);
+
   // Filter saved files based on the search term
   const filteredFiles = files.filter((file) =>
     file.filename.toLowerCase().includes(searchTerm.toLowerCase())
@@ -142,6 +156,11 @@ const SavedFiles: React.FC<SavedFilesProps> = ({ savedFiles, onDelete, onLoad })
         ) : (
           <li>No files match your search.</li>
         )}
+        {hasMore && onLoadMore && (
+          <li>
+            <button onClick={onLoadMore}>Load more</button>
+          </li>
+        )}
       </ul>
     </div>
   );
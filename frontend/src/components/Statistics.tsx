@@ -63,63 +63,38 @@ const Statistics: React.FC<StatisticsProps> = ({ fileId, airview_annotations })
       return;
     }
 
-    const fetchMetadata = async () => {
+    const hasAirviewProps = Boolean(airview_annotations && airview_annotations.length > 0);
+    if (hasAirviewProps) {
+      setTransmissionStats(airview_annotations ?? null);
+    }
+
+    // Metadata, PSD statistics and (if not passed in) AirVIEW results in one request
+    const fetchBundle = async () => {
       setLoading(true);
       setError(null);
       try {
-        const response = await fetch(`http://127.0.0.1:5000/metadata/${fileId}`);
+        const fields = hasAirviewProps ? 'metadata,calculated_statistics' : 'metadata,calculated_statistics,data';
+        const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/bundle?fields=${fields}`);
         const result = await response.json();
 
         if (result.error) {
           setError(result.error);
           setMetadata(null);
-        } else {
-          setMetadata(result);
+          return;
+        }
+        setMetadata(result.metadata);
+        setCalculatedStats(result.calculated_statistics);
+        if (!hasAirviewProps && Array.isArray(result.data?.airview_annotations)) {
+          setTransmissionStats(result.data.airview_annotations);
         }
       } catch (err) {
-        console.error('Error fetching metadata:', err);
+        console.error('Error fetching file bundle:', err);
         setError('Failed to load metadata.');
       } finally {
         setLoading(false);
       }
     };
-
-    fetchMetadata();
-    const fetchCalculatedStats = async () => {
-      try {
-        const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/calculated_statistics`);
-        const result = await response.json();
-    
-        console.log("Received calculated stats:", result); // ✅ DEBUG HERE
-    
-        if (!result.error) {
-          setCalculatedStats(result);
-        }
-      } catch (err) {
-        console.error('Error fetching calculated statistics:', err);
-      }
-    };
-    fetchCalculatedStats();  
-    if (airview_annotations && airview_annotations.length > 0) {
-      console.log("Setting transmission stats from props:", airview_annotations);
-      setTransmissionStats(airview_annotations);
-    } else {
-      const fetchTransmissionStats = async () => {
-        try {
-          const response = await fetch(`http://127.0.0.1:5000/file/${fileId}/data`);
-          const result = await response.json();
-    
-          console.log("[Frontend] Fallback fetched AirVIEW annotations:", result.airview_annotations);
-    
-          if (result.airview_annotations && Array.isArray(result.airview_annotations)) {
-            setTransmissionStats(result.airview_annotations);
-          }
-        } catch (err) {
-          console.error("Failed to fetch AirVIEW results:", err);
-        }
-      };
-      fetchTransmissionStats();
-    }
+    fetchBundle();
   }, [airview_annotations, fileId]);
 
 